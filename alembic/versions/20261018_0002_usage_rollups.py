@@ -0,0 +1,49 @@
+"""usage rollup tables and (user_id, created_at) index
+
+Revision ID: 20261018_0002
+Revises: 20241030_0001
+Create Date: 2026-10-18 10:00:00
+
+Rollups are backfilled from usage_events by the app on first start
+(see app.usage_rollups.ensure_rollups).
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '20261018_0002'
+down_revision = '20241030_0001'
+branch_labels = None
+depends_on = None
+
+
+def _counter_columns():
+    return [
+        sa.Column(name, sa.BigInteger(), nullable=False, server_default='0')
+        for name in ('events', 'input_bytes', 'prompt_tokens', 'completion_tokens', 'prompt_chars', 'completion_chars')
+    ]
+
+
+def upgrade() -> None:
+    op.create_index('ix_usage_events_user_id_created_at', 'usage_events', ['user_id', 'created_at'])
+
+    op.create_table(
+        'usage_totals',
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), primary_key=True),
+        *_counter_columns(),
+    )
+
+    op.create_table(
+        'usage_buckets',
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), primary_key=True),
+        sa.Column('granularity', sa.String(length=8), primary_key=True),
+        sa.Column('bucket_start', sa.DateTime(), primary_key=True),
+        *_counter_columns(),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('usage_buckets')
+    op.drop_table('usage_totals')
+    op.drop_index('ix_usage_events_user_id_created_at', table_name='usage_events')
@@ -0,0 +1,68 @@
+"""background OCR jobs and their page results
+
+Revision ID: 20261018_0003
+Revises: 20261018_0002
+Create Date: 2026-10-18 12:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '20261018_0003'
+down_revision = '20261018_0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'ocr_jobs',
+        sa.Column('id', sa.String(length=32), primary_key=True),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('kind', sa.String(length=16), nullable=False),
+        sa.Column('status', sa.String(length=16), nullable=False, server_default='queued'),
+        sa.Column('content_hash', sa.String(length=64), nullable=False),
+        sa.Column('media_type', sa.String(length=64), nullable=False),
+        sa.Column('filename', sa.String(length=256), nullable=True),
+        sa.Column('prompt', sa.Text(), nullable=False),
+        sa.Column('render', sa.String(length=32), nullable=True),
+        sa.Column('dedup_key', sa.String(length=64), nullable=False),
+        sa.Column('input_bytes', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.Column('total_pages', sa.Integer(), nullable=True),
+        sa.Column('done_pages', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('failed_pages', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('lease_owner', sa.String(length=32), nullable=True),
+        sa.Column('lease_expires_at', sa.DateTime(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('started_at', sa.DateTime(), nullable=True),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+    )
+    op.create_index('ix_ocr_jobs_status_created_at', 'ocr_jobs', ['status', 'created_at'])
+    op.create_index('ix_ocr_jobs_user_id_created_at', 'ocr_jobs', ['user_id', 'created_at'])
+    op.create_index('ix_ocr_jobs_user_id_dedup_key', 'ocr_jobs', ['user_id', 'dedup_key'])
+
+    op.create_table(
+        'ocr_job_pages',
+        sa.Column('job_id', sa.String(length=32), sa.ForeignKey('ocr_jobs.id'), primary_key=True),
+        sa.Column('page', sa.Integer(), primary_key=True),
+        sa.Column('status', sa.String(length=16), nullable=False),
+        sa.Column('text', sa.Text(), nullable=False, server_default=''),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('cached', sa.Boolean(), nullable=False, server_default=sa.false()),
+        sa.Column('prompt_tokens', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('completion_tokens', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('completion_chars', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('finished_at', sa.DateTime(), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('ocr_job_pages')
+    op.drop_index('ix_ocr_jobs_user_id_dedup_key', table_name='ocr_jobs')
+    op.drop_index('ix_ocr_jobs_user_id_created_at', table_name='ocr_jobs')
+    op.drop_index('ix_ocr_jobs_status_created_at', table_name='ocr_jobs')
+    op.drop_table('ocr_jobs')
@@ -0,0 +1,51 @@
+"""resumable /ocr/pdf streams: documents and per-page checkpoints
+
+Revision ID: 20261018_0004
+Revises: 20261018_0003
+Create Date: 2026-10-18 14:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '20261018_0004'
+down_revision = '20261018_0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'pdf_documents',
+        sa.Column('id', sa.String(length=64), primary_key=True),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id'), nullable=False),
+        sa.Column('content_hash', sa.String(length=64), nullable=False),
+        sa.Column('prompt', sa.Text(), nullable=False),
+        sa.Column('render', sa.String(length=32), nullable=False),
+        sa.Column('total_pages', sa.Integer(), nullable=False),
+        sa.Column('input_bytes', sa.BigInteger(), nullable=False, server_default='0'),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+    )
+    op.create_index('ix_pdf_documents_expires_at', 'pdf_documents', ['expires_at'])
+
+    op.create_table(
+        'page_checkpoints',
+        sa.Column('document_id', sa.String(length=64), sa.ForeignKey('pdf_documents.id'), primary_key=True),
+        sa.Column('page', sa.Integer(), primary_key=True),
+        sa.Column('seq', sa.Integer(), nullable=False),
+        sa.Column('text', sa.Text(), nullable=False, server_default=''),
+        sa.Column('cached', sa.Boolean(), nullable=False, server_default=sa.false()),
+        sa.Column('prompt_tokens', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('completion_tokens', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('completion_chars', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('page_checkpoints')
+    op.drop_index('ix_pdf_documents_expires_at', table_name='pdf_documents')
+    op.drop_table('pdf_documents')
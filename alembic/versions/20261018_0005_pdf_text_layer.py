@@ -0,0 +1,28 @@
+"""text layer mode of resumable PDF documents
+
+Revision ID: 20261018_0005
+Revises: 20261018_0004
+Create Date: 2026-10-18 16:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '20261018_0005'
+down_revision = '20261018_0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        'pdf_documents',
+        sa.Column('text_layer', sa.String(length=8), nullable=False, server_default='ocr'),
+    )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('pdf_documents') as batch:
+        batch.drop_column('text_layer')
@@ -0,0 +1,49 @@
+"""unique finish order of page checkpoints per document
+
+Revision ID: 20261018_0006
+Revises: 20261018_0005
+Create Date: 2026-10-18 18:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '20261018_0006'
+down_revision = '20261018_0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Concurrent resumes could have stored the same seq twice; renumber 1..n in the existing order
+    checkpoints = sa.table(
+        'page_checkpoints',
+        sa.column('document_id', sa.String),
+        sa.column('page', sa.Integer),
+        sa.column('seq', sa.Integer),
+    )
+    bind = op.get_bind()
+    rows = bind.execute(
+        sa.select(checkpoints.c.document_id, checkpoints.c.page, checkpoints.c.seq).order_by(
+            checkpoints.c.document_id, checkpoints.c.seq, checkpoints.c.page
+        )
+    ).all()
+    document, seq = None, 0
+    for row in rows:
+        seq = seq + 1 if row.document_id == document else 1
+        document = row.document_id
+        if row.seq != seq:
+            bind.execute(
+                checkpoints.update()
+                .where(checkpoints.c.document_id == row.document_id, checkpoints.c.page == row.page)
+                .values(seq=seq)
+            )
+    op.create_index(
+        'ix_page_checkpoints_document_id_seq', 'page_checkpoints', ['document_id', 'seq'], unique=True
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_page_checkpoints_document_id_seq', table_name='page_checkpoints')
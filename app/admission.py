@@ -0,0 +1,133 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from app.core.config import settings
+from app.metrics import (
+    OCR_ADMISSION_ACTIVE,
+    OCR_ADMISSION_QUEUE_DEPTH,
+    OCR_ADMISSION_REJECTED_TOTAL,
+    OCR_ADMISSION_WAIT_SECONDS,
+)
+
+
+class AdmissionRejected(Exception):
+    """Raised when an engine request cannot be admitted (queue full or wait timed out)."""
+
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+        self.retry_after = retry_after
+
+    @property
+    def headers(self) -> dict[str, str]:
+        return {"Retry-After": str(self.retry_after)}
+
+
+class AdmissionController:
+    """Process-wide limiter for concurrent engine requests.
+
+    Requests beyond ``max_concurrent`` wait in per-flow FIFO queues. Freed slots
+    are handed out round-robin across flows (one flow per user and request kind),
+    so a large PDF fanning out many pages cannot starve other users' requests.
+    """
+
+    def __init__(self, max_concurrent: int, max_queue: int, timeout: float, retry_after: int):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._active = 0
+        self._waiting = 0
+        self._flows: "OrderedDict[str, deque[asyncio.Future]]" = OrderedDict()
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting
+
+    def check(self) -> None:
+        """Fail fast before accepting new work when the wait queue is already full."""
+        if self._waiting >= self.max_queue:
+            OCR_ADMISSION_REJECTED_TOTAL.labels(reason="queue_full").inc()
+            raise AdmissionRejected(429, "OCR queue is full, retry later", self.retry_after)
+
+    @asynccontextmanager
+    async def slot(self, flow: str) -> AsyncIterator[None]:
+        await self._acquire(flow)
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def _acquire(self, flow: str) -> None:
+        if self._active < self.max_concurrent and self._waiting == 0:
+            self._active += 1
+            OCR_ADMISSION_ACTIVE.set(self._active)
+            OCR_ADMISSION_WAIT_SECONDS.observe(0.0)
+            return
+        if self._waiting >= self.max_queue:
+            OCR_ADMISSION_REJECTED_TOTAL.labels(reason="queue_full").inc()
+            raise AdmissionRejected(429, "OCR queue is full, retry later", self.retry_after)
+
+        fut: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._flows.setdefault(flow, deque()).append(fut)
+        self._waiting += 1
+        OCR_ADMISSION_QUEUE_DEPTH.set(self._waiting)
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(fut), timeout=self.timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as exc:
+            if fut.done() and not fut.cancelled():
+                # The slot was handed over just as we gave up; pass it on.
+                self._release()
+            else:
+                fut.cancel()
+            if isinstance(exc, asyncio.CancelledError):
+                raise
+            OCR_ADMISSION_REJECTED_TOTAL.labels(reason="timeout").inc()
+            raise AdmissionRejected(
+                503,
+                f"Timed out after {self.timeout:g}s waiting for an OCR slot",
+                self.retry_after,
+            ) from None
+        finally:
+            self._waiting -= 1
+            OCR_ADMISSION_QUEUE_DEPTH.set(self._waiting)
+            OCR_ADMISSION_WAIT_SECONDS.observe(time.perf_counter() - started)
+
+    def _next_waiter(self) -> asyncio.Future | None:
+        while self._flows:
+            flow, waiters = self._flows.popitem(last=False)
+            while waiters and waiters[0].done():
+                waiters.popleft()  # cancelled or timed out while queued
+            if not waiters:
+                continue
+            fut = waiters.popleft()
+            if waiters:
+                self._flows[flow] = waiters  # back of the round-robin
+            return fut
+        return None
+
+    def _release(self) -> None:
+        fut = self._next_waiter()
+        if fut is not None:
+            # Hand the slot straight over; the active count is unchanged.
+            fut.set_result(None)
+            return
+        self._active -= 1
+        OCR_ADMISSION_ACTIVE.set(self._active)
+
+
+admission = AdmissionController(
+    max_concurrent=settings.OCR_MAX_CONCURRENT_REQUESTS,
+    max_queue=settings.OCR_MAX_QUEUED_REQUESTS,
+    timeout=settings.OCR_QUEUE_TIMEOUT_SECONDS,
+    retry_after=settings.OCR_RETRY_AFTER_SECONDS,
+)
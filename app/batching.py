@@ -0,0 +1,73 @@
+"""Micro-batching of engine requests that share a prompt.
+
+Pages of a PDF (and images sent with the same prompt) reach the engine as
+separate chat completions. Sent one by one as they become ready, they land in
+different scheduler steps of the engine and, with several replicas, on
+different engines. The dispatcher holds each request for at most ``window``
+seconds, before it takes an admission slot, so that requests with the same
+prompt prefix are released together, up to ``max_batch`` at a time, all pinned to the same engine: the
+engine's continuous batching prefills them in the same step and its prefix
+cache computes the shared prompt once.
+
+The OpenAI API has no multi-request call, so a batch is a burst of concurrent
+requests rather than one request; each is admitted and, if its engine fails,
+fails over on its own. Off by default (``ENGINE_BATCH_WINDOW_MS=0``): the
+window adds its latency to every request that arrives alone.
+"""
+import asyncio
+import time
+from typing import Optional
+
+from app.core.config import settings
+from app.metrics import ENGINE_BATCH_SIZE, ENGINE_BATCH_WAIT_SECONDS
+from app.ocr_client import Engine, engine_pool
+
+
+class _Batch:
+    def __init__(self):
+        self.size = 0
+        self.opened = time.perf_counter()
+        self.released = asyncio.Event()
+        self.engine: Optional[Engine] = None
+
+
+class BatchDispatcher:
+    def __init__(self, window: float, max_batch: int):
+        self.window = window
+        self.max_batch = max_batch
+        self._open: dict[str, _Batch] = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0 and self.max_batch > 1
+
+    async def join(self, key: str) -> Optional[Engine]:
+        """Wait until the batch for ``key`` is released; the engine its requests should go to."""
+        if not self.enabled:
+            return None
+        batch = self._open.get(key)
+        if batch is None:
+            batch = self._open[key] = _Batch()
+            asyncio.get_running_loop().call_later(self.window, self._release, key, batch)
+        batch.size += 1
+        if batch.size >= self.max_batch:
+            self._release(key, batch)
+        joined = time.perf_counter()
+        await batch.released.wait()
+        ENGINE_BATCH_WAIT_SECONDS.observe(time.perf_counter() - joined)
+        return batch.engine
+
+    def _release(self, key: str, batch: _Batch) -> None:
+        if batch.released.is_set():
+            return
+        if self._open.get(key) is batch:
+            del self._open[key]
+        batch.engine = engine_pool.pick(set())
+        ENGINE_BATCH_SIZE.observe(batch.size)
+        batch.released.set()
+
+
+batch_dispatcher = BatchDispatcher(
+    window=settings.ENGINE_BATCH_WINDOW_MS / 1000,
+    max_batch=settings.ENGINE_BATCH_MAX_SIZE,
+)
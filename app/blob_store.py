@@ -0,0 +1,134 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import BinaryIO
+
+from asgiref.sync import sync_to_async
+from sqlalchemy import func, select
+
+from app.core.config import settings
+from app.db import AsyncSessionLocal
+from app.models import OcrJob, PdfDocument
+
+
+class BlobStore:
+    """Content-addressed files on local disk: ``<root>/<sha[:2]>/<sha>``.
+
+    Writes go to a temp file in the same directory and are renamed into place,
+    so a blob is either complete or absent.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest)
+
+    def exists(self, digest: str) -> bool:
+        return os.path.exists(self.path(digest))
+
+    def put_file(self, source: BinaryIO, chunk_size: int = 1024 * 1024) -> tuple[str, int]:
+        """Store the rest of ``source``; returns ``(sha256 hex, size)``."""
+        tmp, digest, size = self.stage_file(source, chunk_size)
+        self.commit(tmp, digest)
+        return digest, size
+
+    def stage_file(self, source: BinaryIO, chunk_size: int = 1024 * 1024) -> tuple[str, str, int]:
+        """Copy the rest of ``source`` to a temp file; returns ``(temp path, sha256 hex, size)``.
+
+        The blob appears only on ``commit``, so the caller can check what it
+        is for first and ``discard`` it instead.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        sha = hashlib.sha256()
+        size = 0
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix=".upload-")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                while chunk := source.read(chunk_size):
+                    sha.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+            return tmp, sha.hexdigest(), size
+        except BaseException:
+            self.discard(tmp)
+            raise
+
+    def commit(self, tmp: str, digest: str) -> None:
+        """Move a staged file into place as blob ``digest``."""
+        final = self.path(digest)
+        try:
+            os.makedirs(os.path.dirname(final), exist_ok=True)
+            if os.path.exists(final):
+                os.unlink(tmp)
+            else:
+                os.replace(tmp, final)
+        except BaseException:
+            self.discard(tmp)
+            raise
+
+    def discard(self, tmp: str) -> None:
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+
+    def read(self, digest: str) -> bytes:
+        with open(self.path(digest), "rb") as f:
+            return f.read()
+
+    def delete(self, digest: str) -> None:
+        try:
+            os.unlink(self.path(digest))
+        except FileNotFoundError:
+            pass
+
+
+blob_store = BlobStore(settings.JOB_STORAGE_DIR)
+
+
+# Per-blob locks: storing an upload and creating the job or document that
+# needs it happen under one, so ``release_blob`` cannot delete the blob between
+# the two.
+_blob_locks: dict[str, tuple[asyncio.Lock, int]] = {}
+
+
+@asynccontextmanager
+async def blob_lock(content_hash: str):
+    lock, users = _blob_locks.get(content_hash, (None, 0))
+    if lock is None:
+        lock = asyncio.Lock()
+    _blob_locks[content_hash] = (lock, users + 1)
+    try:
+        async with lock:
+            yield
+    finally:
+        lock, users = _blob_locks[content_hash]
+        if users > 1:
+            _blob_locks[content_hash] = (lock, users - 1)
+        else:
+            del _blob_locks[content_hash]
+
+
+async def release_blob(content_hash: str, locked: bool = False) -> None:
+    """Delete an upload once no unfinished job and no resumable PDF stream needs it.
+
+    ``locked``: the caller already holds ``blob_lock(content_hash)``.
+    """
+    if not locked:
+        async with blob_lock(content_hash):
+            return await release_blob(content_hash, locked=True)
+    async with AsyncSessionLocal() as session:
+        jobs = await session.scalar(
+            select(func.count()).where(OcrJob.content_hash == content_hash, OcrJob.status.in_(("queued", "running")))
+        )
+        documents = await session.scalar(
+            select(func.count()).where(
+                PdfDocument.content_hash == content_hash, PdfDocument.expires_at >= datetime.utcnow()
+            )
+        )
+    if not jobs and not documents:
+        await sync_to_async(blob_store.delete, thread_sensitive=False)(content_hash)
@@ -0,0 +1,167 @@
+"""Per-page checkpoints for /ocr/pdf streams.
+
+Every page that finishes is stored under its document id (user, PDF content
+hash, prompt, render policy, text layer mode and model) together with the PDF itself, so a
+client whose stream dropped can resume it and only the missing pages are sent
+to the engine again. Uploading the same document again reuses them as well.
+"""
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.exc import IntegrityError
+
+from app.blob_store import release_blob
+from app.core.config import settings
+from app.db import AsyncSessionLocal
+from app.models import PageCheckpoint, PdfDocument
+
+
+logger = logging.getLogger(__name__)
+
+PURGE_INTERVAL_SECONDS = 15 * 60
+# Tries to store a checkpoint when other streams of the document keep taking the next seq
+_SAVE_ATTEMPTS = 10
+
+
+def checkpoints_enabled() -> bool:
+    return settings.PDF_CHECKPOINT_TTL_HOURS > 0
+
+
+def document_id(user_id: int, content_hash: str, prompt: str, render: str, text_layer: str = "ocr") -> str:
+    parts = [str(user_id), content_hash, prompt, render, settings.LLM_MODEL]
+    if text_layer != "ocr":  # documents from before text layer modes keep their ids
+        parts.append(text_layer)
+    raw = "\0".join(parts)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _expiry() -> datetime:
+    return datetime.utcnow() + timedelta(hours=settings.PDF_CHECKPOINT_TTL_HOURS)
+
+
+async def open_document(
+    user_id: int, content_hash: str, prompt: str, render: str, text_layer: str, total_pages: int, input_bytes: int
+) -> PdfDocument:
+    """Create the document, or extend the lifetime of an existing one with the same id."""
+    doc_id = document_id(user_id, content_hash, prompt, render, text_layer)
+    async with AsyncSessionLocal() as session:
+        doc = await session.get(PdfDocument, doc_id)
+        if doc is None:
+            doc = PdfDocument(
+                id=doc_id,
+                user_id=user_id,
+                content_hash=content_hash,
+                prompt=prompt,
+                render=render,
+                text_layer=text_layer,
+                total_pages=total_pages,
+                input_bytes=input_bytes,
+            )
+            session.add(doc)
+        doc.expires_at = _expiry()
+        await session.commit()
+        return doc
+
+
+async def get_document(doc_id: str, user_id: int) -> Optional[PdfDocument]:
+    async with AsyncSessionLocal() as session:
+        doc = await session.get(PdfDocument, doc_id)
+        if doc is None or doc.user_id != user_id or doc.expires_at < datetime.utcnow():
+            return None
+        doc.expires_at = _expiry()
+        await session.commit()
+        return doc
+
+
+async def load_checkpoints(doc_id: str) -> list[PageCheckpoint]:
+    """Finished pages in the order they finished."""
+    async with AsyncSessionLocal() as session:
+        rows = await session.scalars(
+            select(PageCheckpoint).where(PageCheckpoint.document_id == doc_id).order_by(PageCheckpoint.seq)
+        )
+        return list(rows.all())
+
+
+async def save_checkpoint(doc_id: str, page: int, text: str, usage: dict, cached: bool) -> int:
+    """Store a finished page; returns its ``seq``, its place in the order the document's pages finished.
+
+    ``seq`` is the document's highest plus one. Streams of the same document
+    (e.g. two resumes) can pick the same one at once; the unique index on
+    ``(document_id, seq)`` rejects the later insert, which is then retried. A
+    page stored before keeps its ``seq``.
+    """
+    for attempt in range(_SAVE_ATTEMPTS):
+        async with AsyncSessionLocal() as session:
+            row = await session.get(PageCheckpoint, (doc_id, page))
+            if row is None:
+                last = await session.scalar(
+                    select(func.max(PageCheckpoint.seq)).where(PageCheckpoint.document_id == doc_id)
+                )
+                row = PageCheckpoint(document_id=doc_id, page=page, seq=(last or 0) + 1)
+                session.add(row)
+            row.text = text
+            row.cached = cached
+            row.prompt_tokens = usage["prompt_tokens"]
+            row.completion_tokens = usage["completion_tokens"]
+            row.completion_chars = usage["completion_chars"]
+            row.created_at = datetime.utcnow()
+            try:
+                await session.commit()
+            except IntegrityError:
+                if attempt == _SAVE_ATTEMPTS - 1:
+                    raise
+                continue
+            return row.seq
+
+
+async def purge_expired() -> int:
+    """Delete expired documents, their checkpoints and PDFs nothing else needs; returns documents removed."""
+    now = datetime.utcnow()
+    async with AsyncSessionLocal() as session:
+        expired = (
+            await session.execute(select(PdfDocument.id, PdfDocument.content_hash).where(PdfDocument.expires_at < now))
+        ).all()
+        if not expired:
+            return 0
+        ids = [row.id for row in expired]
+        await session.execute(delete(PageCheckpoint).where(PageCheckpoint.document_id.in_(ids)))
+        await session.execute(delete(PdfDocument).where(PdfDocument.id.in_(ids)))
+        await session.commit()
+    for content_hash in {row.content_hash for row in expired}:
+        await release_blob(content_hash)
+    return len(expired)
+
+
+class CheckpointJanitor:
+    """Purges expired checkpoints periodically."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if self._task is None and checkpoints_enabled():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                removed = await purge_expired()
+                if removed:
+                    logger.info("Purged %d expired PDF documents", removed)
+            except Exception:
+                logger.exception("Failed to purge expired PDF checkpoints")
+            await asyncio.sleep(self.interval)
+
+
+checkpoint_janitor = CheckpointJanitor(interval=PURGE_INTERVAL_SECONDS)
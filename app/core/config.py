@@ -1,5 +1,6 @@
+import os
 from datetime import timedelta
-from typing import Literal
+from typing import Literal, Optional
 from urllib.parse import urlparse
 
 from pydantic import AnyUrl, Field, field_validator
@@ -17,13 +18,144 @@ class Settings(BaseSettings):
 
     # Database
     DATABASE_URL: str = Field(default="sqlite+aiosqlite:///./data.db")
+    # Usage events are buffered and bulk-inserted by a background writer
+    USAGE_FLUSH_BATCH_SIZE: int = Field(default=200, ge=1)
+    USAGE_FLUSH_INTERVAL_SECONDS: float = Field(default=1.0, gt=0)
+    USAGE_MAX_BACKLOG: int = Field(default=100_000, ge=1)
 
     # LLM / OCR backend (OpenAI-compatible)
     LLM_BASE_URL: str = Field(default="http://localhost:8000/v1")
     LLM_API_KEY: str = Field(default="token-abc123")
     LLM_MODEL: str = Field(default="deepseek-ai/DeepSeek-OCR")
     LLM_PROMPT: str = Field(default="Free OCR, output markdown.")
+    # Tokenizer (Hugging Face hub id or tokenizer.json path, needs `tokenizers`) that counts tokens
+    # when the engine reports no usage; empty falls back to a chars/4 estimate
+    TOKENIZER: str = Field(default="")
+    # Image pixels per prompt token, added to tokenizer counts for the image: DeepSeek-OCR encodes
+    # 16x16 patches compressed 16x (1024x1024 = 256 tokens); see ocr_prompt_tokens_per_megapixel
+    TOKENIZER_IMAGE_PIXELS_PER_TOKEN: int = Field(default=4096, ge=1)
+    # Engine replicas as comma-separated base URLs; LLM_BASE_URL alone when empty
+    LLM_BASE_URLS: str = Field(default="")
+    # Route to the engine with the fewest in-flight requests, or estimated outstanding completion tokens
+    ENGINE_ROUTING: Literal["requests", "tokens"] = Field(default="requests")
+    # Engines tried per request when it fails before the first token
+    ENGINE_MAX_ATTEMPTS: int = Field(default=3, ge=1)
+    # Consecutive failures that eject an engine, and for how long
+    ENGINE_FAILURE_THRESHOLD: int = Field(default=3, ge=1)
+    ENGINE_EJECT_SECONDS: float = Field(default=30.0, gt=0)
+    # Health probe (GET /models) period (0 disables) and timeout
+    ENGINE_HEALTH_INTERVAL_SECONDS: float = Field(default=10.0, ge=0)
+    ENGINE_HEALTH_TIMEOUT_SECONDS: float = Field(default=5.0, gt=0)
+    # HTTP connections per engine: pool size, idle connections kept alive and for how long, HTTP/2 (needs h2)
+    ENGINE_MAX_CONNECTIONS: int = Field(default=128, ge=1)
+    ENGINE_MAX_KEEPALIVE_CONNECTIONS: int = Field(default=64, ge=0)
+    ENGINE_KEEPALIVE_EXPIRY_SECONDS: float = Field(default=60.0, gt=0)
+    ENGINE_HTTP2: bool = Field(default=False)
+    # Timeouts: TCP connect, wait for a free connection, first output of a request, gap between chunks
+    ENGINE_CONNECT_TIMEOUT_SECONDS: float = Field(default=5.0, gt=0)
+    ENGINE_POOL_TIMEOUT_SECONDS: float = Field(default=30.0, gt=0)
+    ENGINE_FIRST_TOKEN_TIMEOUT_SECONDS: float = Field(default=180.0, gt=0)
+    ENGINE_READ_TIMEOUT_SECONDS: float = Field(default=60.0, gt=0)
+    # Micro-batching: requests with the same prompt arriving within this window are released
+    # together to one engine (0, the default, disables), at most ENGINE_BATCH_MAX_SIZE per batch
+    ENGINE_BATCH_WINDOW_MS: float = Field(default=0.0, ge=0)
+    ENGINE_BATCH_MAX_SIZE: int = Field(default=16, ge=1)
 
+    # PDF pipeline: max pages rendered or in flight to the engine per request
+    PDF_MAX_PAGES_IN_FLIGHT: int = Field(default=8, ge=1, le=256)
+    # PDF stream event order: as pages finish ("completion") or page by page ("page"); overridable per request
+    PDF_STREAM_ORDER: Literal["completion", "page"] = Field(default="completion")
+    # Uploaded images are normalized before the engine call: EXIF orientation applied, longest side
+    # fit within IMAGE_MAX_SIDE (0 keeps the size) and re-encoded; kept as is when that would not help
+    IMAGE_NORMALIZE: bool = Field(default=True)
+    IMAGE_MAX_SIDE: int = Field(default=2560, ge=0)
+    IMAGE_FORMAT: Literal["png", "jpeg", "webp"] = Field(default="jpeg")
+    IMAGE_JPEG_QUALITY: int = Field(default=90, ge=1, le=100)
+    IMAGE_GRAYSCALE: bool = Field(default=False)
+    # Oversized images on /ocr/image are cut into overlapping tiles OCR'd in parallel: "off", "on", or "auto"
+    # (images above IMAGE_TILING_MIN_PIXELS); overridable per request
+    IMAGE_TILING: Literal["off", "auto", "on"] = Field(default="off")
+    IMAGE_TILING_MIN_PIXELS: int = Field(default=6_000_000, ge=1)
+    # Tile side in pixels (about the vision encoder's input size) and the overlap between neighbouring tiles
+    IMAGE_TILE_SIZE: int = Field(default=1024, ge=256)
+    IMAGE_TILE_OVERLAP: int = Field(default=128, ge=0)
+    # Images needing more tiles are scaled down; tiles of one image OCR'd at once
+    IMAGE_MAX_TILES: int = Field(default=32, ge=1, le=256)
+    IMAGE_TILES_IN_FLIGHT: int = Field(default=8, ge=1, le=256)
+    # Embedded PDF text layers: "ocr" ignores them, "auto" returns pages with a usable text layer
+    # without the engine and OCRs the rest, "text" never calls the engine; overridable per request
+    PDF_TEXT_LAYER: Literal["auto", "ocr", "text"] = Field(default="ocr")
+    # A text layer with fewer non-whitespace characters than this is not trusted in "auto" mode
+    PDF_TEXT_LAYER_MIN_CHARS: int = Field(default=64, ge=1)
+    # Deltas of a page are sent together once this many characters or milliseconds have built up (0 = every token)
+    STREAM_COALESCE_CHARS: int = Field(default=2048, ge=0)
+    STREAM_COALESCE_MS: float = Field(default=20.0, ge=0)
+    # Output queued for a slow client (or held back for page order) before page workers stop reading the engine
+    STREAM_BUFFER_MAX_BYTES: int = Field(default=1024 * 1024, ge=1)
+    # Documents one /ocr/ws connection may have streaming at once
+    WS_MAX_DOCUMENTS: int = Field(default=16, ge=1)
+    # PDF rasterization policy (scale:<s> | dpi:<d> | pixels:<n>), overridable per request.
+    # 2457600 px = 1280x1920, the largest grid of 640px crops (6) DeepSeek-OCR's encoder tiles an image into.
+    PDF_RENDER_POLICY: str = Field(default="pixels:2457600")
+    PDF_RENDER_MIN_SCALE: float = Field(default=0.5, gt=0)
+    PDF_RENDER_MAX_SCALE: float = Field(default=8.0, gt=0)
+    # Page image encoding before inlining into the engine request
+    PAGE_IMAGE_FORMAT: Literal["png", "jpeg", "webp"] = Field(default="png")
+    PAGE_PNG_COMPRESS_LEVEL: int = Field(default=6, ge=0, le=9)
+    PAGE_JPEG_QUALITY: int = Field(default=90, ge=1, le=100)
+    PAGE_GRAYSCALE: bool = Field(default=False)
+    # Pages whose ink coverage is below this ratio are treated as blank and not sent to the engine (0 disables)
+    PDF_BLANK_INK_RATIO: float = Field(default=0.0005, ge=0, le=1)
+    # Pages matching an earlier page (same user, prompt and render policy) reuse its result:
+    # "exact" when the ink bitmaps are identical, "perceptual" also for near-identical scans
+    # (may merge pages that differ in a few small characters), "off" disables
+    PDF_PAGE_DEDUP: Literal["off", "exact", "perceptual"] = Field(default="exact")
+    # Perceptual mode only: max differing bits of the 256-bit dHash, max gray-level difference of any 32x32 cell
+    PDF_PAGE_DEDUP_MAX_DISTANCE: int = Field(default=10, ge=0, le=256)
+    PDF_PAGE_DEDUP_MAX_TILE_DIFF: int = Field(default=12, ge=0, le=255)
+    # Recent page signatures kept for matching
+    PDF_PAGE_DEDUP_MAX_ENTRIES: int = Field(default=4096, ge=1)
+    # Worker processes for PDF rendering and image encoding (unset = CPU count, 0 = threads in-process)
+    RENDER_PROCESS_WORKERS: Optional[int] = Field(default=None, ge=0)
+
+    # Finished pages of /ocr/pdf streams are checkpointed so a dropped stream can be resumed
+    # (POST /ocr/pdf/resume); documents and checkpoints expire after this many hours (0 disables)
+    PDF_CHECKPOINT_TTL_HOURS: float = Field(default=24.0, ge=0)
+
+    # Upload limits, enforced on the request body before it is parsed (413 above the limit)
+    MAX_IMAGE_UPLOAD_BYTES: int = Field(default=20 * 1024 * 1024, ge=1)
+    MAX_PDF_UPLOAD_BYTES: int = Field(default=200 * 1024 * 1024, ge=1)
+    # POST /ocr/images: total size of a batch (zip archives count unpacked) and number of files in it
+    MAX_BATCH_UPLOAD_BYTES: int = Field(default=200 * 1024 * 1024, ge=1)
+    MAX_BATCH_ITEMS: int = Field(default=256, ge=1, le=1000)
+    # Images of one batch being OCR'd at once
+    BATCH_MAX_IMAGES_IN_FLIGHT: int = Field(default=8, ge=1, le=256)
+    # Multipart file parts larger than this are spooled to a temp file instead of memory
+    UPLOAD_SPOOL_MAX_BYTES: int = Field(default=1024 * 1024, ge=0)
+
+    # Admission control: process-wide cap on concurrent engine requests
+    OCR_MAX_CONCURRENT_REQUESTS: int = Field(default=64, ge=1)
+    OCR_MAX_QUEUED_REQUESTS: int = Field(default=512, ge=0)
+    OCR_QUEUE_TIMEOUT_SECONDS: float = Field(default=60.0, gt=0)
+    OCR_RETRY_AFTER_SECONDS: int = Field(default=5, ge=1)
+
+    # OCR result cache: in-memory LRU plus optional SQLite file (empty path disables the disk tier)
+    OCR_CACHE_ENABLED: bool = Field(default=True)
+    OCR_CACHE_MAX_BYTES: int = Field(default=64 * 1024 * 1024, ge=0)
+    OCR_CACHE_PATH: str = Field(default="")
+    OCR_CACHE_DISK_MAX_ENTRIES: int = Field(default=100_000, ge=1)
+
+    # Background OCR jobs (POST /ocr/jobs): uploads are kept under JOB_STORAGE_DIR by content hash
+    # (outside the checkout by default, so runtime blobs never end up in the source tree)
+    JOB_STORAGE_DIR: str = Field(default_factory=lambda: os.path.join(os.path.expanduser("~"), ".cache", "my-ocr", "jobs"))
+    # Jobs processed concurrently by this process (0 = submit only, another process runs them)
+    JOB_WORKERS: int = Field(default=2, ge=0)
+    JOB_POLL_INTERVAL_SECONDS: float = Field(default=2.0, gt=0)
+    # A running job whose lease is not renewed within this time is picked up again (e.g. after a crash)
+    JOB_LEASE_SECONDS: float = Field(default=60.0, gt=0)
+    JOB_MAX_ATTEMPTS: int = Field(default=3, ge=1)
+    # Live events waiting for one /jobs/{id}/events client; past it, a page's deltas are merged into one
+    JOB_EVENT_QUEUE_SIZE: int = Field(default=256, ge=1)
 
     # Demo bootstrap user (for quick start)
     BOOTSTRAP_USER: str = Field(default="demo", min_length=1)
@@ -32,6 +164,32 @@ class Settings(BaseSettings):
     # Auth toggle
     AUTH_ENABLED: bool = Field(default=False)
     ANON_USERNAME: str = Field(default="anonymous", min_length=1)
+    # Authenticated users are cached in-process after the first lookup (0 disables)
+    AUTH_CACHE_TTL_SECONDS: float = Field(default=60.0, ge=0)
+    AUTH_CACHE_MAX_ENTRIES: int = Field(default=10_000, ge=1)
+
+    # Event-loop lag sampling period for the event_loop_lag_seconds metric (0 disables)
+    EVENT_LOOP_LAG_INTERVAL_SECONDS: float = Field(default=0.25, ge=0)
+    # Per-phase timings (upload, render, encode, queue, ttft, decode, db) in the end and page_end
+    # events of OCR streams; requests can turn them on or off with the "timings" form field
+    OCR_EVENT_TIMINGS: bool = Field(default=False)
+    # OpenTelemetry spans of OCR requests: "otlp" (OTLP/HTTP collector) or "file" (JSON lines), needs opentelemetry-sdk
+    TRACING_EXPORTER: Literal["off", "otlp", "file"] = Field(default="off")
+    TRACING_OTLP_ENDPOINT: str = Field(default="http://localhost:4318/v1/traces")
+    TRACING_FILE: str = Field(default="./data/traces.jsonl")
+    TRACING_SERVICE_NAME: str = Field(default="my-ocr")
+
+    @field_validator("PDF_RENDER_POLICY")
+    @classmethod
+    def validate_render_policy(cls, v: str) -> str:
+        mode, sep, value = v.partition(":")
+        try:
+            ok = bool(sep) and mode in ("scale", "dpi", "pixels") and float(value) > 0
+        except ValueError:
+            ok = False
+        if not ok:
+            raise ValueError("PDF_RENDER_POLICY must look like scale:<s>, dpi:<d> or pixels:<n>")
+        return v
 
     @field_validator("SECRET_KEY")
     @classmethod
@@ -40,6 +198,11 @@ class Settings(BaseSettings):
             raise ValueError("SECRET_KEY must be at least 8 characters")
         return v
 
+    @property
+    def engine_base_urls(self) -> list[str]:
+        urls = [u.strip() for u in self.LLM_BASE_URLS.split(",") if u.strip()]
+        return urls or [self.LLM_BASE_URL]
+
     @property
     def access_token_expires(self) -> timedelta:
         return timedelta(minutes=self.ACCESS_TOKEN_EXPIRE_MINUTES)
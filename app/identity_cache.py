@@ -0,0 +1,77 @@
+import time
+from typing import Optional
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models import User
+
+
+class IdentityCache:
+    """In-process TTL cache of authenticated users, keyed by username.
+
+    Cached users are detached ORM instances with all columns loaded, so they can
+    be returned from ``get_current_user`` without a database round trip. The
+    anonymous user (auth disabled) is pinned and never expires. Users changed
+    or deleted through the ORM are dropped when the change commits; other
+    processes see it within ``ttl``.
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.anonymous: Optional[User] = None
+        self._entries: dict[str, tuple[float, User]] = {}
+
+    def get(self, username: str) -> Optional[User]:
+        entry = self._entries.get(username)
+        if entry is None:
+            return None
+        expires_at, user = entry
+        if expires_at < time.monotonic():
+            self._entries.pop(username, None)
+            return None
+        return user
+
+    def put(self, user: User) -> None:
+        if self.ttl <= 0:
+            return
+        self._entries.pop(user.username, None)
+        self._entries[user.username] = (time.monotonic() + self.ttl, user)
+        while len(self._entries) > self.max_entries:
+            # dicts keep insertion order, so this drops the oldest entry
+            self._entries.pop(next(iter(self._entries)))
+
+    def invalidate(self, username: str) -> None:
+        self._entries.pop(username, None)
+        if self.anonymous is not None and self.anonymous.username == username:
+            self.anonymous = None
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.anonymous = None
+
+
+identity_cache = IdentityCache(ttl=settings.AUTH_CACHE_TTL_SECONDS, max_entries=settings.AUTH_CACHE_MAX_ENTRIES)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_changed_users(session: Session, flush_context) -> None:
+    # Password changes, renames, deletions: collected at flush, dropped once committed
+    changed = session.info.setdefault("identity_cache_changed", set())
+    for obj in (*session.dirty, *session.deleted):
+        if isinstance(obj, User):
+            changed.add(obj.username)
+            changed.update(inspect(obj).attrs.username.history.deleted)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_changed_users(session: Session) -> None:
+    for username in session.info.pop("identity_cache_changed", ()):
+        identity_cache.invalidate(username)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_changed_users(session: Session) -> None:
+    session.info.pop("identity_cache_changed", None)
@@ -0,0 +1,154 @@
+"""Inputs of ``POST /ocr/images``: uploaded images and zip archives of images.
+
+All images of a batch are copied into one temp file while the request is
+handled (zip entries are extracted into it), so the stream can read them one at
+a time after the upload's own files are gone. Limits are checked while copying:
+a zip's declared sizes are checked before anything is extracted, and no entry
+is read past its declared size.
+"""
+import os
+import posixpath
+import tempfile
+import zipfile
+from dataclasses import dataclass
+from typing import BinaryIO, Optional
+
+
+IMAGE_TYPES_BY_EXTENSION = {
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".webp": "image/webp",
+}
+ZIP_TYPES = ("application/zip", "application/x-zip-compressed")
+
+_COPY_CHUNK = 1024 * 1024
+
+
+class BatchTooLarge(Exception):
+    def __init__(self, detail: str):
+        super().__init__(detail)
+        self.detail = detail
+
+
+@dataclass(frozen=True)
+class BatchItem:
+    name: str
+    media_type: Optional[str]
+    offset: int
+    size: int
+    error: Optional[str] = None  # set for entries that are not OCR'd
+
+
+class ImageBatch:
+    def __init__(self, max_bytes: int, max_items: int, max_image_bytes: int):
+        self.max_bytes = max_bytes
+        self.max_items = max_items
+        self.max_image_bytes = max_image_bytes
+        self.items: list[BatchItem] = []
+        self.total_bytes = 0
+        self._file = tempfile.NamedTemporaryFile(prefix="ocr-batch-", delete=False)
+        self.path = self._file.name
+
+    # ---- building (request handler, in a thread) ---------------------------------------
+
+    def add_upload(self, filename: str, content_type: Optional[str], fileobj: BinaryIO) -> None:
+        if content_type in ZIP_TYPES or (filename or "").lower().endswith(".zip"):
+            self._add_zip(fileobj)
+            return
+        fileobj.seek(0)
+        name = filename or f"file{len(self.items) + 1}"
+        media_type = content_type if content_type in IMAGE_TYPES_BY_EXTENSION.values() else _media_type(name)
+        self._add(name, media_type, fileobj, limit=None)
+
+    def seal(self) -> None:
+        self._file.close()
+
+    def _add_zip(self, fileobj: BinaryIO) -> None:
+        fileobj.seek(0)
+        try:
+            archive = zipfile.ZipFile(fileobj)
+        except zipfile.BadZipFile:
+            raise ValueError("not a valid zip archive")
+        with archive:
+            entries = [
+                info for info in archive.infolist()
+                if not info.is_dir() and not _hidden(info.filename)
+            ]
+            declared = sum(info.file_size for info in entries if _media_type(info.filename))
+            if self.total_bytes + declared > self.max_bytes:
+                raise BatchTooLarge(f"Batch exceeds the {self.max_bytes} byte limit once unpacked")
+            for info in entries:
+                media_type = _media_type(info.filename)
+                if media_type is None:
+                    self._reject(info.filename, "unsupported file type")
+                    continue
+                with archive.open(info) as entry:
+                    self._add(info.filename, media_type, entry, limit=info.file_size)
+
+    def _add(self, name: str, media_type: Optional[str], source: BinaryIO, limit: Optional[int]) -> None:
+        if len(self.items) >= self.max_items:
+            raise BatchTooLarge(f"Batch exceeds the {self.max_items} image limit")
+        if media_type not in IMAGE_TYPES_BY_EXTENSION.values():
+            self._reject(name, "unsupported file type")
+            return
+        offset = self._file.tell()
+        size = 0
+        while True:
+            # Never read more than an entry declared (zip) or than the limits allow
+            want = _COPY_CHUNK if limit is None else min(_COPY_CHUNK, limit - size + 1)
+            chunk = source.read(want) if want > 0 else b""
+            if not chunk:
+                break
+            size += len(chunk)
+            if self.total_bytes + size > self.max_bytes:
+                raise BatchTooLarge(f"Batch exceeds the {self.max_bytes} byte limit")
+            if size > self.max_image_bytes or (limit is not None and size > limit):
+                self._file.seek(offset)
+                self._file.truncate()
+                self._reject(name, f"image exceeds the {self.max_image_bytes} byte limit")
+                return
+            self._file.write(chunk)
+        self.total_bytes += size
+        self.items.append(BatchItem(name=name, media_type=media_type, offset=offset, size=size))
+
+    def _reject(self, name: str, error: str) -> None:
+        if len(self.items) >= self.max_items:
+            raise BatchTooLarge(f"Batch exceeds the {self.max_items} image limit")
+        self.items.append(BatchItem(name=name, media_type=None, offset=0, size=0, error=error))
+
+    # ---- reading (stream) -------------------------------------------------------------
+
+    def read(self, item: BatchItem) -> bytes:
+        with open(self.path, "rb") as f:
+            f.seek(item.offset)
+            return f.read(item.size)
+
+    def discard(self) -> None:
+        self._file.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+def _media_type(name: str) -> Optional[str]:
+    return IMAGE_TYPES_BY_EXTENSION.get(posixpath.splitext(name)[1].lower())
+
+
+def _hidden(name: str) -> bool:
+    """Metadata that archivers add (``__MACOSX/``, ``.DS_Store``, AppleDouble ``._*`` files)."""
+    return any(part.startswith((".", "__MACOSX")) for part in name.split("/"))
+
+
+def build_batch(uploads: list, max_bytes: int, max_items: int, max_image_bytes: int) -> ImageBatch:
+    """Spool ``(filename, content_type, fileobj)`` uploads; raises BatchTooLarge or ValueError (bad zip)."""
+    batch = ImageBatch(max_bytes, max_items, max_image_bytes)
+    try:
+        for filename, content_type, fileobj in uploads:
+            batch.add_upload(filename, content_type, fileobj)
+        batch.seal()
+    except BaseException:
+        batch.discard()
+        raise
+    return batch
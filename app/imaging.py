@@ -0,0 +1,418 @@
+"""CPU-bound image work (PDF rasterization, upload normalization, encoding) and the pool it runs in.
+
+Functions in this module are executed in worker processes, so they take and
+return plain picklable values (paths, bytes, small dataclasses) and must not
+touch the event loop, the database or Prometheus.
+"""
+import asyncio
+import hashlib
+import io
+import math
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+from asgiref.sync import sync_to_async
+from PIL import Image, ImageOps
+
+from app.core.config import settings
+from app.render_policy import RenderPolicy
+from app.tiling import TileBox, grid_size, tile_boxes
+
+
+@dataclass(frozen=True)
+class PageSignature:
+    """Cheap look at a rendered page, taken before it is sent to the engine."""
+
+    ink_ratio: float  # share of pixels clearly darker or lighter than the page background
+    digest: bytes  # hash of the ink bitmap: equal for pages that render the same
+    dhash: int  # 256-bit difference hash (16 rows of 16 horizontal gradients)
+    tiles: bytes  # 32x32 grid of mean gray levels, to confirm a hash match
+
+
+@dataclass
+class RenderedPage:
+    data: bytes
+    media_type: str
+    width: int
+    height: int
+    scale: float
+    render_seconds: float
+    encode_seconds: float
+    signature: Optional[PageSignature] = None
+
+
+@dataclass(frozen=True)
+class PageEncoding:
+    """How rendered pages are encoded before being inlined as a data URL."""
+
+    format: str = "png"  # png | jpeg | webp (lossless)
+    png_compress_level: int = 6
+    jpeg_quality: int = 90
+    grayscale: bool = False
+
+    @property
+    def media_type(self) -> str:
+        return f"image/{self.format}"
+
+    @classmethod
+    def from_settings(cls) -> "PageEncoding":
+        return cls(
+            format=settings.PAGE_IMAGE_FORMAT,
+            png_compress_level=settings.PAGE_PNG_COMPRESS_LEVEL,
+            jpeg_quality=settings.PAGE_JPEG_QUALITY,
+            grayscale=settings.PAGE_GRAYSCALE,
+        )
+
+
+def encode_image(image, encoding: PageEncoding) -> bytes:
+    """Encode a PIL image; grayscale conversion shrinks text documents at no accuracy cost."""
+    if encoding.grayscale and image.mode != "L":
+        image = image.convert("L")
+    elif image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    buf = io.BytesIO()
+    if encoding.format == "jpeg":
+        image.save(buf, "JPEG", quality=encoding.jpeg_quality)
+    elif encoding.format == "webp":
+        image.save(buf, "WEBP", lossless=True)
+    else:
+        image.save(buf, "PNG", compress_level=encoding.png_compress_level)
+    return buf.getvalue()
+
+
+# Pixels this far from the background gray, darker or lighter, count as ink: dark text on
+# paper, light text on a dark slide and faint gray text alike
+_INK_CONTRAST = 32
+_ANALYSIS_MAX_SIDE = 1024
+
+
+def page_signature(image) -> PageSignature:
+    gray = image.convert("L")
+    factor = max(1, max(gray.size) // _ANALYSIS_MAX_SIDE)
+    small = gray.reduce(factor) if factor > 1 else gray
+    histogram = small.histogram()
+    background = max(range(256), key=histogram.__getitem__)
+    is_ink = [abs(level - background) >= _INK_CONTRAST for level in range(256)]
+    ink = sum(count for level, count in enumerate(histogram) if is_ink[level])
+    ink_ratio = ink / max(1, small.width * small.height)
+    bitmap = small.point([255 if flag else 0 for flag in is_ink], mode="1")
+    digest = hashlib.blake2b(bitmap.tobytes(), digest_size=16).digest()
+    grid = small.resize((17, 16), Image.Resampling.BOX).tobytes()
+    dhash = 0
+    for row in range(16):
+        for col in range(16):
+            dhash = (dhash << 1) | (grid[row * 17 + col] > grid[row * 17 + col + 1])
+    tiles = small.resize((32, 32), Image.Resampling.BOX).tobytes()
+    return PageSignature(ink_ratio=ink_ratio, digest=digest, dhash=dhash, tiles=tiles)
+
+
+# pdfium is not thread-safe. In a worker process there is one caller at a time;
+# in thread mode (RENDER_PROCESS_WORKERS=0) this lock serializes all calls.
+_pdfium_lock = threading.Lock()
+# path -> (document, (device, inode, mtime) of the file it was opened from, last use)
+_open_docs: "OrderedDict[str, tuple[Any, tuple, float]]" = OrderedDict()
+_MAX_OPEN_DOCS = 4
+# Documents unused for this long, or whose file is gone, are closed by the next call or the sweeper
+_OPEN_DOC_IDLE_SECONDS = 30.0
+
+
+def _file_key(path: str) -> Optional[tuple]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_dev, stat.st_ino, stat.st_mtime_ns
+
+
+def _close_stale_docs(keep: Optional[str] = None) -> None:
+    """Close cached documents whose file was removed or replaced, or that sat unused for a while."""
+    now = time.monotonic()
+    for cached, (old, key, used) in list(_open_docs.items()):
+        if cached == keep or (now - used < _OPEN_DOC_IDLE_SECONDS and _file_key(cached) == key):
+            continue
+        del _open_docs[cached]
+        old.close()
+
+
+def _document(path: str):
+    """Open documents are kept per process so consecutive pages skip re-parsing the file."""
+    import pypdfium2 as pdfium  # type: ignore
+
+    _close_stale_docs(keep=path)
+    key = _file_key(path)
+    entry = _open_docs.get(path)
+    if entry is not None and entry[1] != key:
+        del _open_docs[path]
+        entry[0].close()
+        entry = None
+    if entry is None:
+        pdf = pdfium.PdfDocument(path)
+        while len(_open_docs) >= _MAX_OPEN_DOCS:
+            _, (old, _, _) = _open_docs.popitem(last=False)
+            old.close()
+    else:
+        pdf = entry[0]
+        _open_docs.move_to_end(path)
+    _open_docs[path] = (pdf, key, time.monotonic())
+    return pdf
+
+
+def pdf_page_count(path: str) -> Optional[int]:
+    """Number of pages, or None if pypdfium2 is missing or the file cannot be parsed."""
+    try:
+        with _pdfium_lock:
+            return len(_document(path))
+    except Exception:
+        return None
+
+
+def _close_pdf(path: str) -> None:
+    with _pdfium_lock:
+        entry = _open_docs.pop(path, None)
+        if entry is not None:
+            entry[0].close()
+
+
+def release_pdf(path: str) -> None:
+    """Close ``path`` here and ask the render workers to close their copies.
+
+    Which worker runs a task is up to the pool, so a worker may miss it; its
+    sweeper thread closes the document once the file is gone or it idles.
+    """
+    _close_pdf(path)
+    executor = _executor
+    if executor is not None:
+        for _ in range(_worker_count()):
+            try:
+                executor.submit(_close_pdf, path)
+            except RuntimeError:  # pool shut down
+                break
+
+
+def _sweep_open_docs() -> None:
+    while True:
+        time.sleep(_OPEN_DOC_IDLE_SECONDS / 2)
+        with _pdfium_lock:
+            _close_stale_docs()
+
+
+def _init_render_worker() -> None:
+    """Each worker has its own document cache, which ``release_pdf`` in the parent cannot reach reliably."""
+    threading.Thread(target=_sweep_open_docs, name="pdf-doc-sweeper", daemon=True).start()
+
+
+def render_pdf_page(
+    path: str, page_index: int, policy: RenderPolicy, encoding: PageEncoding, analyze: bool = False
+) -> RenderedPage:
+    """Render one page and encode it, so only the encoded bytes (and its signature) leave the worker."""
+    started = time.perf_counter()
+    with _pdfium_lock:
+        page = _document(path).get_page(page_index)
+        try:
+            scale = policy.scale_for(*page.get_size())
+            pil_image = page.render(scale=scale).to_pil()
+        finally:
+            page.close()
+    rendered = time.perf_counter()
+    signature = page_signature(pil_image) if analyze else None
+    data = encode_image(pil_image, encoding)
+    return RenderedPage(
+        data=data,
+        media_type=encoding.media_type,
+        width=pil_image.width,
+        height=pil_image.height,
+        scale=scale,
+        render_seconds=rendered - started,
+        encode_seconds=time.perf_counter() - rendered,
+        signature=signature,
+    )
+
+
+@dataclass
+class NormalizedImage:
+    data: bytes
+    media_type: str
+    width: int
+    height: int
+    changed: bool  # False: the upload is sent as it is
+    decode_seconds: float
+    transform_seconds: float
+    encode_seconds: float
+
+
+_EXIF_ORIENTATION = 0x0112
+
+
+def normalize_image(data: bytes, media_type: str, max_side: int, encoding: PageEncoding) -> NormalizedImage:
+    """Prepare an upload for the engine: apply EXIF orientation, fit within ``max_side``, re-encode.
+
+    The upload is kept as it is when it needs no rotation or downscale and
+    re-encoding would not make it smaller.
+    """
+    started = time.perf_counter()
+    image = Image.open(io.BytesIO(data))
+    if max_side and image.format == "JPEG" and max(image.size) > max_side:
+        # Let the JPEG decoder skip detail we would throw away (DCT scaling, up to 8x)
+        ratio = max_side / max(image.size)
+        image.draft(image.mode, (math.ceil(image.width * ratio), math.ceil(image.height * ratio)))
+    image.load()
+    decoded = time.perf_counter()
+    source_format = image.format
+    rotated = image.getexif().get(_EXIF_ORIENTATION, 1) != 1
+    if rotated:
+        image = ImageOps.exif_transpose(image)
+    resized = bool(max_side) and max(image.size) > max_side
+    if resized:
+        ratio = max_side / max(image.size)
+        size = (max(1, round(image.width * ratio)), max(1, round(image.height * ratio)))
+        image = image.resize(size, Image.Resampling.LANCZOS, reducing_gap=3.0)
+    transformed = time.perf_counter()
+    encoded = encode_image(image, encoding)
+    finished = time.perf_counter()
+    same_format = (source_format or "").lower() == encoding.format and not encoding.grayscale
+    keep = not rotated and not resized and (same_format or len(encoded) >= len(data))
+    return NormalizedImage(
+        data=data if keep else encoded,
+        media_type=media_type if keep else encoding.media_type,
+        width=image.width,
+        height=image.height,
+        changed=not keep,
+        decode_seconds=decoded - started,
+        transform_seconds=transformed - decoded,
+        encode_seconds=finished - transformed,
+    )
+
+
+@dataclass
+class ImageTile:
+    box: TileBox
+    data: bytes
+    media_type: str
+
+
+def split_image(
+    data: bytes, tile: int, overlap: int, max_tiles: int, min_pixels: Optional[int], encoding: PageEncoding
+) -> list[ImageTile]:
+    """Cut an uploaded image into overlapping encoded tiles; [] when it has at most ``min_pixels``.
+
+    ``min_pixels=None`` always tiles. An image that would need more than
+    ``max_tiles`` tiles is scaled down until it fits.
+    """
+    image = Image.open(io.BytesIO(data))
+    if min_pixels is not None and image.width * image.height <= min_pixels:
+        return []
+    image = ImageOps.exif_transpose(image)
+    width, height = image.width, image.height
+    while grid_size(width, height, tile, overlap) > max_tiles:
+        width, height = max(1, int(width * 0.9)), max(1, int(height * 0.9))
+    if (width, height) != image.size:
+        image = image.resize((width, height), Image.Resampling.LANCZOS)
+    return [
+        ImageTile(
+            box=box,
+            data=encode_image(image.crop((box.left, box.top, box.right, box.bottom)), encoding),
+            media_type=encoding.media_type,
+        )
+        for box in tile_boxes(width, height, tile, overlap)
+    ]
+
+
+def image_pixels(data: bytes) -> Optional[int]:
+    """Pixel count of an encoded image, read from its header; None if it cannot be parsed."""
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            return image.width * image.height
+    except Exception:
+        return None
+
+
+@dataclass(frozen=True)
+class PageText:
+    text: str
+    image_coverage: float  # share of the page area covered by image objects
+    extract_seconds: float
+
+
+def pdf_page_text(path: str, page_index: int) -> PageText:
+    """The page's embedded text layer, and how much of the page is covered by images (scans are)."""
+    import pypdfium2.raw as pdfium_c  # type: ignore
+
+    started = time.perf_counter()
+    with _pdfium_lock:
+        page = _document(path).get_page(page_index)
+        try:
+            textpage = page.get_textpage()
+            try:
+                text = textpage.get_text_range()
+            finally:
+                textpage.close()
+            width, height = page.get_size()
+            covered = 0.0
+            for obj in page.get_objects(filter=(pdfium_c.FPDF_PAGEOBJ_IMAGE,), max_depth=1):
+                left, bottom, right, top = obj.get_pos()
+                covered += max(0.0, min(right, width) - max(left, 0.0)) * max(0.0, min(top, height) - max(bottom, 0.0))
+        finally:
+            page.close()
+    text = text.replace("\r\n", "\n").replace("\r", "\n").strip()
+    return PageText(
+        text=text,
+        image_coverage=min(1.0, covered / max(1.0, width * height)),
+        extract_seconds=time.perf_counter() - started,
+    )
+
+
+# Share of a text layer that must be readable characters; broken font encodings
+# extract as U+FFFD, control or private-use characters
+_MIN_READABLE_RATIO = 0.95
+# A page mostly covered by an image is a scan, even if a previous OCR left text on it
+_MAX_IMAGE_COVERAGE = 0.8
+
+
+def usable_text_layer(page_text: PageText, min_chars: int) -> bool:
+    chars = [c for c in page_text.text if not c.isspace()]
+    if len(chars) < min_chars or page_text.image_coverage >= _MAX_IMAGE_COVERAGE:
+        return False
+    unreadable = sum(1 for c in chars if c == "\ufffd" or not c.isprintable() or "\ue000" <= c <= "\uf8ff")
+    return unreadable <= len(chars) * (1 - _MIN_READABLE_RATIO)
+
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def _worker_count() -> int:
+    if settings.RENDER_PROCESS_WORKERS is not None:
+        return settings.RENDER_PROCESS_WORKERS
+    return os.cpu_count() or 1
+
+
+def get_render_executor() -> Optional[ProcessPoolExecutor]:
+    """Process pool for CPU-bound image work, or None when it is disabled (run in threads instead)."""
+    global _executor
+    if _executor is None and _worker_count() > 0:
+        # spawn, not fork: the parent runs an event loop and helper threads.
+        _executor = ProcessPoolExecutor(
+            max_workers=_worker_count(),
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_render_worker,
+        )
+    return _executor
+
+
+async def run_cpu(fn: Callable, *args):
+    executor = get_render_executor()
+    if executor is None:
+        return await sync_to_async(fn, thread_sensitive=False)(*args)
+    return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+
+
+def shutdown_render_executor() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
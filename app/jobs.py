@@ -0,0 +1,473 @@
+"""Background OCR jobs: the database-backed queue, live event fan-out and the worker pool.
+
+A job row is its own queue entry. Workers claim a ``queued`` job (or a
+``running`` one whose lease expired, e.g. after a crash) with a conditional
+UPDATE, renew the lease while they work and store every page as it finishes,
+so a job picked up again only processes the pages that are still missing.
+"""
+import asyncio
+import hashlib
+import logging
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+
+from asgiref.sync import sync_to_async
+from sqlalchemy import and_, func, or_, select, update
+
+from app.admission import AdmissionRejected
+from app.blob_store import blob_store, release_blob
+from app.core.config import settings
+from app.db import AsyncSessionLocal
+from app.imaging import PageEncoding, pdf_page_count, render_pdf_page, run_cpu
+from app.metrics import (
+    OCR_JOB_PAGES_TOTAL,
+    OCR_JOBS_FINISHED_TOTAL,
+    OCR_JOBS_RUNNING,
+    approx_tokens_from_chars,
+    observe_page_encoding,
+)
+from app.models import OcrJob, OcrJobPage
+from app.ocr_pipeline import engine_extra_body, ocr_stream, prepare_image, record_usage
+from app.render_policy import parse_render_policy
+
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ("succeeded", "failed", "cancelled")
+
+
+def new_job_id() -> str:
+    return uuid.uuid4().hex
+
+
+def dedup_key(kind: str, content_hash: str, prompt: str, render: Optional[str]) -> str:
+    """Jobs with the same key would produce the same result, so a resubmission returns the existing job."""
+    raw = "\0".join((kind, content_hash, prompt, render or "", settings.LLM_MODEL))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+async def job_usage(session, job: OcrJob) -> dict:
+    """Usage summed over the job's finished pages."""
+    row = (
+        await session.execute(
+            select(
+                func.coalesce(func.sum(OcrJobPage.prompt_tokens), 0),
+                func.coalesce(func.sum(OcrJobPage.completion_tokens), 0),
+                func.coalesce(func.sum(OcrJobPage.completion_chars), 0),
+                func.count(),
+            ).where(OcrJobPage.job_id == job.id, OcrJobPage.status == "done")
+        )
+    ).one()
+    return {
+        "prompt_tokens": int(row[0]),
+        "completion_tokens": int(row[1]),
+        "prompt_chars": len(job.prompt) * int(row[3]),
+        "completion_chars": int(row[2]),
+        "input_bytes": int(job.input_bytes or 0),
+        "pages": job.total_pages or 0,
+    }
+
+
+def page_events(row: OcrJobPage) -> list[dict]:
+    """A stored page as the event sequence a live client would have seen."""
+    events = [{"type": "page_start", "page": row.page}]
+    if row.text:
+        events.append({"type": "page_delta", "page": row.page, "delta": row.text})
+    end = {
+        "type": "page_end",
+        "page": row.page,
+        "usage": {
+            "prompt_tokens": row.prompt_tokens,
+            "completion_tokens": row.completion_tokens,
+            "completion_chars": row.completion_chars,
+        },
+    }
+    if row.status != "done":
+        end["error"] = row.error or "failed"
+    if row.cached:
+        end["cache"] = "hit"
+    events.append(end)
+    return events
+
+
+class _EventQueue(asyncio.Queue):
+    """A client's live events; once ``limit`` are waiting, a page's deltas are merged.
+
+    A client that reads slower than the engine writes then costs memory for
+    the page text only, not for one event per delta. Other events are always
+    queued; there are a few per page.
+    """
+
+    def __init__(self, limit: int):
+        super().__init__()
+        self.limit = limit
+
+    def put_nowait(self, event: dict) -> None:
+        if event["type"] == "page_delta" and self.qsize() >= self.limit:
+            waiting = self._queue
+            for index in range(len(waiting) - 1, -1, -1):
+                queued = waiting[index]
+                if queued.get("page") != event["page"]:
+                    continue
+                if queued["type"] == "page_delta":
+                    # Events are shared between clients, so the merged one is a new dict
+                    waiting[index] = {**queued, "delta": queued["delta"] + event["delta"]}
+                    return
+                break
+        super().put_nowait(event)
+
+
+class JobEvents:
+    """In-process fan-out of live job events to attached clients.
+
+    The text streamed so far for pages in progress is kept, so a client that
+    attaches mid-page gets it in one piece before the live deltas.
+    """
+
+    def __init__(self, queue_size: int = 256):
+        self.queue_size = queue_size
+        self._subscribers: dict[str, set[asyncio.Queue]] = {}
+        self._partial: dict[str, dict[int, list[str]]] = {}
+
+    def subscribe(self, job_id: str) -> tuple[asyncio.Queue, dict[int, str]]:
+        queue: asyncio.Queue = _EventQueue(self.queue_size)
+        self._subscribers.setdefault(job_id, set()).add(queue)
+        snapshot = {page: "".join(pieces) for page, pieces in self._partial.get(job_id, {}).items()}
+        return queue, snapshot
+
+    def unsubscribe(self, job_id: str, queue: asyncio.Queue) -> None:
+        subscribers = self._subscribers.get(job_id)
+        if subscribers is not None:
+            subscribers.discard(queue)
+            if not subscribers:
+                del self._subscribers[job_id]
+
+    def publish(self, job_id: str, event: dict) -> None:
+        etype, page = event["type"], event.get("page")
+        partial = self._partial.setdefault(job_id, {})
+        if etype == "page_start":
+            partial[page] = []
+        elif etype == "page_delta" and page in partial:
+            partial[page].append(event["delta"])
+        elif etype == "page_end":
+            partial.pop(page, None)
+        if etype in ("end", "status"):
+            self._partial.pop(job_id, None)
+        for queue in self._subscribers.get(job_id, ()):
+            queue.put_nowait(event)
+
+
+class JobRunner:
+    """Pool of asyncio workers processing queued jobs in this process."""
+
+    def __init__(self, workers: int, poll_interval: float, lease_seconds: float, max_attempts: int):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.owner = uuid.uuid4().hex
+        self.events = JobEvents(settings.JOB_EVENT_QUEUE_SIZE)
+        self._tasks: list[asyncio.Task] = []
+        self._active: dict[str, asyncio.Task] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+
+    async def start(self) -> None:
+        if self._tasks or self.workers <= 0:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # Hand our jobs back to the queue right away instead of waiting for the leases to expire;
+        # a shutdown does not count against the job's attempts
+        async with AsyncSessionLocal() as session:
+            await session.execute(
+                update(OcrJob)
+                .where(OcrJob.lease_owner == self.owner, OcrJob.status == "running")
+                .values(status="queued", lease_owner=None, lease_expires_at=None, attempts=OcrJob.attempts - 1)
+            )
+            await session.commit()
+
+    def notify(self) -> None:
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def cancel(self, job_id: str) -> None:
+        """Stop a job running in this process (its status is set by the caller)."""
+        task = self._active.get(job_id)
+        if task is not None:
+            task.cancel()
+
+    async def _worker(self) -> None:
+        assert self._wakeup is not None
+        while True:
+            try:
+                job = await self._claim()
+            except Exception:
+                logger.exception("Failed to claim a job")
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                continue
+            task = asyncio.create_task(self._process(job))
+            self._active[job.id] = task
+            OCR_JOBS_RUNNING.inc()
+            try:
+                await asyncio.wait([task])
+            except asyncio.CancelledError:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                raise
+            finally:
+                self._active.pop(job.id, None)
+                OCR_JOBS_RUNNING.dec()
+
+    def _claimable(self, now: datetime):
+        return or_(
+            OcrJob.status == "queued",
+            and_(OcrJob.status == "running", OcrJob.lease_expires_at < now),
+        )
+
+    async def _claim(self) -> Optional[OcrJob]:
+        now = datetime.utcnow()
+        async with AsyncSessionLocal() as session:
+            candidates = await session.scalars(
+                select(OcrJob.id).where(self._claimable(now)).order_by(OcrJob.created_at).limit(8)
+            )
+            for job_id in candidates.all():
+                result = await session.execute(
+                    update(OcrJob)
+                    .where(OcrJob.id == job_id, self._claimable(now))
+                    .values(
+                        status="running",
+                        lease_owner=self.owner,
+                        lease_expires_at=now + timedelta(seconds=self.lease_seconds),
+                        attempts=OcrJob.attempts + 1,
+                        started_at=func.coalesce(OcrJob.started_at, now),
+                    )
+                )
+                await session.commit()
+                if result.rowcount == 1:
+                    return await session.get(OcrJob, job_id)
+        return None
+
+    async def _heartbeat(self, job_id: str, task: asyncio.Task) -> None:
+        """Renew the lease; if the job was cancelled or taken over, stop working on it."""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            async with AsyncSessionLocal() as session:
+                result = await session.execute(
+                    update(OcrJob)
+                    .where(OcrJob.id == job_id, OcrJob.lease_owner == self.owner, OcrJob.status == "running")
+                    .values(lease_expires_at=datetime.utcnow() + timedelta(seconds=self.lease_seconds))
+                )
+                await session.commit()
+            if result.rowcount == 0:
+                task.cancel()
+                return
+
+    async def _process(self, job: OcrJob) -> None:
+        heartbeat = asyncio.create_task(self._heartbeat(job.id, asyncio.current_task()))
+        try:
+            if job.attempts > self.max_attempts:
+                await self._finish(job, "failed", error=job.error or "too many attempts")
+                return
+            await self._run(job)
+        except asyncio.CancelledError:
+            # Cancelled by the user or shut down; pages finished so far are kept
+            async with AsyncSessionLocal() as session:
+                current = await session.get(OcrJob, job.id)
+            if current is not None and current.status == "cancelled":
+                await self._record_usage(job)
+                await release_blob(job.content_hash)
+                self.events.publish(job.id, {"type": "end", "status": "cancelled"})
+            raise
+        except Exception as exc:
+            logger.exception("Job %s failed", job.id)
+            await self._retry_or_fail(job, str(exc) or type(exc).__name__)
+        finally:
+            heartbeat.cancel()
+
+    async def _run(self, job: OcrJob) -> None:
+        path = blob_store.path(job.content_hash)
+        if job.kind == "pdf":
+            total = job.total_pages or await run_cpu(pdf_page_count, path)
+            if not total:
+                await self._finish(job, "failed", error="PDF parsing failed")
+                return
+            policy = parse_render_policy(job.render)
+            encoding = PageEncoding.from_settings()
+        else:
+            total, policy, encoding = 1, None, None
+
+        async with AsyncSessionLocal() as session:
+            done = set(
+                (
+                    await session.scalars(
+                        select(OcrJobPage.page).where(OcrJobPage.job_id == job.id, OcrJobPage.status == "done")
+                    )
+                ).all()
+            )
+            if job.total_pages != total:
+                await session.execute(update(OcrJob).where(OcrJob.id == job.id).values(total_pages=total))
+                await session.commit()
+        job.total_pages = total
+
+        self.events.publish(job.id, {"type": "status", "status": "running"})
+        slots = asyncio.Semaphore(settings.PDF_MAX_PAGES_IN_FLIGHT)
+        extra_body = engine_extra_body()
+
+        async def page_task(idx: int) -> bool:
+            async with slots:
+                return await self._run_page(job, idx, path, policy, encoding, extra_body)
+
+        results = await asyncio.gather(*(page_task(idx) for idx in range(1, total + 1) if idx not in done))
+        failed = results.count(False)
+        if failed:
+            await self._retry_or_fail(job, f"{failed} of {total} pages failed")
+        else:
+            await self._finish(job, "succeeded")
+
+    async def _run_page(self, job: OcrJob, idx: int, path: str, policy, encoding, extra_body: dict) -> bool:
+        publish = self.events.publish
+        publish(job.id, {"type": "page_start", "page": idx})
+        pieces: list[str] = []
+        try:
+            if job.kind == "pdf":
+                page = await run_cpu(render_pdf_page, path, idx - 1, policy, encoding)
+                observe_page_encoding(encoding.format, page.encode_seconds, len(page.data))
+                data, media_type = page.data, page.media_type
+            else:
+                data = await sync_to_async(blob_store.read, thread_sensitive=False)(job.content_hash)
+                data, media_type = await prepare_image(data, job.media_type)
+            usage: dict = {}
+            info: dict = {}
+            while True:
+                try:
+                    async for piece in ocr_stream(data, media_type, job.prompt, extra_body, usage, f"{job.user_id}:job", info):
+                        pieces.append(piece)
+                        publish(job.id, {"type": "page_delta", "page": idx, "delta": piece})
+                    break
+                except AdmissionRejected as exc:
+                    # Background work can wait for the engine instead of failing the page
+                    if pieces:
+                        raise
+                    await asyncio.sleep(exc.retry_after)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            error = str(exc) or type(exc).__name__
+            await self._save_page(job, OcrJobPage(job_id=job.id, page=idx, status="failed", text="", error=error))
+            publish(job.id, {"type": "page_end", "page": idx, "error": error,
+                             "usage": {"prompt_tokens": 0, "completion_tokens": 0, "completion_chars": 0}})
+            OCR_JOB_PAGES_TOTAL.labels(status="failed").inc()
+            return False
+
+        text = "".join(pieces)
+        row = OcrJobPage(
+            job_id=job.id,
+            page=idx,
+            status="done",
+            text=text,
+            cached=info.get("cache") == "hit",
+            prompt_tokens=int(usage.get("prompt_tokens") or 0) or approx_tokens_from_chars(len(job.prompt)),
+            completion_tokens=int(usage.get("completion_tokens") or 0) or approx_tokens_from_chars(len(text)),
+            completion_chars=len(text),
+        )
+        await self._save_page(job, row)
+        page_end = {
+            "type": "page_end",
+            "page": idx,
+            "usage": {"prompt_tokens": row.prompt_tokens, "completion_tokens": row.completion_tokens, "completion_chars": len(text)},
+        }
+        if "cache" in info:
+            page_end["cache"] = info["cache"]
+        publish(job.id, page_end)
+        OCR_JOB_PAGES_TOTAL.labels(status="done").inc()
+        return True
+
+    async def _save_page(self, job: OcrJob, row: OcrJobPage) -> None:
+        row.finished_at = datetime.utcnow()
+        async with AsyncSessionLocal() as session:
+            await session.merge(row)
+            if row.status == "done":
+                await session.execute(update(OcrJob).where(OcrJob.id == job.id).values(done_pages=OcrJob.done_pages + 1))
+            await session.commit()
+
+    async def _retry_or_fail(self, job: OcrJob, error: str) -> None:
+        if job.attempts < self.max_attempts:
+            async with AsyncSessionLocal() as session:
+                await session.execute(
+                    update(OcrJob)
+                    .where(OcrJob.id == job.id, OcrJob.lease_owner == self.owner, OcrJob.status == "running")
+                    .values(status="queued", lease_owner=None, lease_expires_at=None, error=error)
+                )
+                await session.commit()
+            self.events.publish(job.id, {"type": "status", "status": "queued", "error": error})
+            self.notify()
+        else:
+            await self._finish(job, "failed", error=error)
+
+    async def _finish(self, job: OcrJob, status: str, error: Optional[str] = None) -> None:
+        async with AsyncSessionLocal() as session:
+            failed = await session.scalar(
+                select(func.count()).where(OcrJobPage.job_id == job.id, OcrJobPage.status == "failed")
+            )
+            result = await session.execute(
+                update(OcrJob)
+                .where(OcrJob.id == job.id, OcrJob.lease_owner == self.owner, OcrJob.status == "running")
+                .values(
+                    status=status,
+                    error=error,
+                    failed_pages=0 if status == "succeeded" else int(failed or 0),
+                    finished_at=datetime.utcnow(),
+                    lease_owner=None,
+                    lease_expires_at=None,
+                )
+            )
+            await session.commit()
+            if result.rowcount == 0:
+                return  # cancelled meanwhile
+            job = await session.get(OcrJob, job.id, populate_existing=True)
+            usage = await job_usage(session, job)
+        OCR_JOBS_FINISHED_TOTAL.labels(status=status).inc()
+        await self._record_usage(job, usage)
+        await release_blob(job.content_hash)
+        end = {"type": "end", "status": status, "usage": usage}
+        if error:
+            end["error"] = error
+        self.events.publish(job.id, end)
+
+    async def _record_usage(self, job: OcrJob, usage: Optional[dict] = None) -> None:
+        if usage is None:
+            async with AsyncSessionLocal() as session:
+                usage = await job_usage(session, job)
+        if not usage["prompt_tokens"] and not usage["completion_chars"]:
+            return  # nothing was processed
+        record_usage(
+            job.user_id,
+            kind=job.kind,
+            prompt_chars=usage["prompt_chars"],
+            completion_chars=usage["completion_chars"],
+            prompt_tokens=usage["prompt_tokens"],
+            completion_tokens=usage["completion_tokens"],
+            input_bytes=usage["input_bytes"],
+            meta=f"job={job.id} pages={job.total_pages or 0}",
+        )
+
+
+job_runner = JobRunner(
+    workers=settings.JOB_WORKERS,
+    poll_interval=settings.JOB_POLL_INTERVAL_SECONDS,
+    lease_seconds=settings.JOB_LEASE_SECONDS,
+    max_attempts=settings.JOB_MAX_ATTEMPTS,
+)
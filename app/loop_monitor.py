@@ -0,0 +1,33 @@
+import asyncio
+import time
+from typing import Optional
+
+from app.core.config import settings
+from app.metrics import EVENT_LOOP_LAG_SECONDS
+
+
+class LoopLagMonitor:
+    """Samples event-loop lag by sleeping for ``interval`` and measuring the overshoot."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            EVENT_LOOP_LAG_SECONDS.observe(max(0.0, time.perf_counter() - expected))
+
+
+loop_monitor = LoopLagMonitor(interval=settings.EVENT_LOOP_LAG_INTERVAL_SECONDS)
@@ -7,12 +7,26 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from app.core.config import settings
 from app.db import Base, engine, AsyncSessionLocal
 from app.models import User
-from app.routers import auth, ocr, users
+from app.routers import auth, jobs, ocr, users
 from app.routers.metrics import router as metrics_router
-from app.middleware import MetricsMiddleware
+from app.middleware import MetricsMiddleware, UploadSizeLimitMiddleware
+from app.checkpoints import checkpoint_janitor
+from app.imaging import shutdown_render_executor
+from app.jobs import job_runner
+from app.loop_monitor import loop_monitor
 from app.metrics import set_users_total
+from app.ocr_cache import ocr_cache
+from app.ocr_client import engine_pool
+from app.tracing import tracing
+from app.usage_rollups import ensure_rollups
+from app.usage_writer import usage_writer
 from app.security import get_password_hash
 from asgiref.sync import sync_to_async
+from starlette.formparsers import MultiPartParser
+
+
+# Room for multipart boundaries, part headers and the prompt field on top of the file itself
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
 
 
 @asynccontextmanager
@@ -38,18 +52,49 @@ async def lifespan(app: FastAPI):
         from sqlalchemy import func
         count = await session.execute(select(func.count(User.id)))
         set_users_total(int(count.scalar_one() or 0))
+        # Backfill usage rollups on first start after the upgrade
+        await ensure_rollups(session)
+    if not settings.AUTH_ENABLED:
+        await auth.ensure_anonymous_user()
+    await usage_writer.start()
+    await engine_pool.start()
+    await loop_monitor.start()
+    tracing.start()
+    await job_runner.start()
+    await checkpoint_janitor.start()
     yield
+    await checkpoint_janitor.stop()
+    await job_runner.stop()
+    await loop_monitor.stop()
+    tracing.stop()
+    await engine_pool.stop()
+    await usage_writer.stop()
+    shutdown_render_executor()
+    ocr_cache.close()
 
 
 def create_app() -> FastAPI:
     app = FastAPI(title="My OCR API", version="0.1.0", lifespan=lifespan)
 
+    # Large uploads go to a temp file while the form is parsed, not to memory
+    MultiPartParser.spool_max_size = settings.UPLOAD_SPOOL_MAX_BYTES
+    app.add_middleware(
+        UploadSizeLimitMiddleware,
+        limits={
+            "/api/ocr/image": settings.MAX_IMAGE_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES,
+            "/api/ocr/pdf": settings.MAX_PDF_UPLOAD_BYTES + MULTIPART_OVERHEAD_BYTES,
+            "/api/ocr/images": settings.MAX_BATCH_UPLOAD_BYTES + settings.MAX_BATCH_ITEMS * MULTIPART_OVERHEAD_BYTES,
+            "/api/ocr/jobs": max(settings.MAX_IMAGE_UPLOAD_BYTES, settings.MAX_PDF_UPLOAD_BYTES) + MULTIPART_OVERHEAD_BYTES,
+        },
+    )
+    # Added last so it is outermost and also records 413s
     app.add_middleware(MetricsMiddleware)
 
     # Mount all application routes under "/api" to comply with proxying rules
     api_router = APIRouter(prefix="/api")
     api_router.include_router(auth.router)
     api_router.include_router(ocr.router)
+    api_router.include_router(jobs.router)
     api_router.include_router(users.router)
     api_router.include_router(metrics_router)
 
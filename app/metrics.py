@@ -38,6 +38,205 @@ OCR_PROCESSING_SECONDS = Histogram(
 OCR_INPUT_BYTES_TOTAL = Counter(
     "ocr_input_bytes_total", "Total input bytes received for OCR", labelnames=("kind",)
 )
+OCR_PAGE_ENCODE_SECONDS = Histogram(
+    "ocr_page_encode_seconds",
+    "Time to encode a rendered page image",
+    labelnames=("format",),
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 5),
+)
+OCR_PAGE_ENCODED_BYTES = Histogram(
+    "ocr_page_encoded_bytes",
+    "Size of encoded page images sent to the engine",
+    labelnames=("format",),
+    buckets=(16e3, 64e3, 128e3, 256e3, 512e3, 1e6, 2e6, 4e6, 8e6, 16e6, 32e6),
+)
+
+OCR_PDF_PAGE_SOURCE_TOTAL = Counter(
+    "ocr_pdf_page_source_total",
+    "PDF pages by where their text came from (engine or embedded text layer)",
+    labelnames=("source",),
+)
+OCR_TEXT_LAYER_SECONDS = Histogram(
+    "ocr_text_layer_seconds",
+    "Time to extract and check a PDF page's text layer",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0),
+)
+
+OCR_PAGES_SKIPPED_TOTAL = Counter(
+    "ocr_pages_skipped_total", "PDF pages answered without an engine call", labelnames=("reason",)
+)
+OCR_ENGINE_SECONDS_SAVED_TOTAL = Counter(
+    "ocr_engine_seconds_saved_total",
+    "Estimated engine time saved by skipped pages (a duplicate's original time, the running page average for blanks)",
+    labelnames=("reason",),
+)
+OCR_PAGE_INK_RATIO = Histogram(
+    "ocr_page_ink_ratio",
+    "Share of a rendered PDF page covered by ink",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5),
+)
+
+
+OCR_IMAGE_PREP_SECONDS = Histogram(
+    "ocr_image_prep_seconds",
+    "Time spent normalizing an uploaded image, per stage (decode, transform, encode)",
+    labelnames=("stage",),
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5),
+)
+OCR_IMAGE_PREP_TOTAL = Counter(
+    "ocr_image_prep_total", "Uploaded images by normalization outcome", labelnames=("outcome",)
+)
+OCR_IMAGE_PREP_INPUT_BYTES_TOTAL = Counter(
+    "ocr_image_prep_input_bytes_total", "Bytes of uploaded images before normalization"
+)
+OCR_IMAGE_PREP_OUTPUT_BYTES_TOTAL = Counter(
+    "ocr_image_prep_output_bytes_total", "Bytes of uploaded images sent to the engine after normalization"
+)
+
+
+def observe_image_prep(outcome: str, stages: dict[str, float], input_bytes: int, output_bytes: int) -> None:
+    for stage, seconds in stages.items():
+        OCR_IMAGE_PREP_SECONDS.labels(stage=stage).observe(seconds)
+    OCR_IMAGE_PREP_TOTAL.labels(outcome=outcome).inc()
+    OCR_IMAGE_PREP_INPUT_BYTES_TOTAL.inc(input_bytes)
+    OCR_IMAGE_PREP_OUTPUT_BYTES_TOTAL.inc(output_bytes)
+
+
+def observe_page_encoding(fmt: str, seconds: float, size: int) -> None:
+    OCR_PAGE_ENCODE_SECONDS.labels(format=fmt).observe(seconds)
+    OCR_PAGE_ENCODED_BYTES.labels(format=fmt).observe(size)
+
+
+# Latency breakdown (app.timings): one observation per page, image, tile or batch item and phase
+OCR_PHASE_SECONDS = Histogram(
+    "ocr_phase_seconds",
+    "Time spent per phase of OCR work (upload, extract, render, encode, queue, ttft, decode, db)",
+    labelnames=("kind", "phase"),
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+OCR_DECODE_TOKENS_PER_SECOND = Histogram(
+    "ocr_decode_tokens_per_second",
+    "Completion tokens per second between the first and the last token of an engine request",
+    labelnames=("kind",),
+    buckets=(5, 10, 20, 30, 50, 75, 100, 150, 200, 300, 500, 1000),
+)
+OCR_USAGE_SOURCE_TOTAL = Counter(
+    "ocr_usage_source_total",
+    "Engine requests by where their token counts came from (engine, tokenizer, estimate)",
+    labelnames=("source",),
+)
+OCR_PROMPT_TOKENS_PER_MEGAPIXEL = Histogram(
+    "ocr_prompt_tokens_per_megapixel",
+    "Engine-reported prompt tokens (prompt text included) per megapixel of the image sent",
+    buckets=(25, 50, 100, 150, 200, 300, 400, 600, 800, 1200, 1600, 2400, 3200),
+)
+
+
+# Admission control (engine concurrency limiter)
+OCR_ADMISSION_ACTIVE = Gauge("ocr_admission_active", "Engine requests currently admitted")
+OCR_ADMISSION_QUEUE_DEPTH = Gauge("ocr_admission_queue_depth", "Engine requests waiting for a slot")
+OCR_ADMISSION_WAIT_SECONDS = Histogram(
+    "ocr_admission_wait_seconds",
+    "Time engine requests spent waiting for a slot",
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+OCR_ADMISSION_REJECTED_TOTAL = Counter(
+    "ocr_admission_rejected_total", "Engine requests rejected by admission control", labelnames=("reason",)
+)
+
+
+# Engine pool (per replica)
+ENGINE_IN_FLIGHT = Gauge("engine_in_flight_requests", "Requests streaming from each engine", labelnames=("engine",))
+ENGINE_OUTSTANDING_TOKENS = Gauge(
+    "engine_outstanding_tokens", "Estimated completion tokens still to come from each engine", labelnames=("engine",)
+)
+ENGINE_AVAILABLE = Gauge("engine_available", "1 if the engine takes traffic, 0 while ejected", labelnames=("engine",))
+ENGINE_REQUESTS_TOTAL = Counter(
+    "engine_requests_total", "Engine requests by outcome", labelnames=("engine", "outcome")
+)
+ENGINE_REQUEST_SECONDS = Histogram(
+    "engine_request_seconds",
+    "Engine request duration, from send to end of stream",
+    labelnames=("engine",),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 60, 120),
+)
+ENGINE_FIRST_TOKEN_SECONDS = Histogram(
+    "engine_first_token_seconds",
+    "Time from sending an engine request to its first output",
+    labelnames=("engine",),
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30),
+)
+ENGINE_FAILOVERS_TOTAL = Counter(
+    "engine_failovers_total", "Requests retried elsewhere after failing before the first token", labelnames=("engine",)
+)
+ENGINE_BATCH_SIZE = Histogram(
+    "engine_batch_size",
+    "Requests released together by the micro-batching dispatcher",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+ENGINE_BATCH_WAIT_SECONDS = Histogram(
+    "engine_batch_wait_seconds",
+    "Time a request waited for its micro-batch to be released",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
+ENGINE_EJECTIONS_TOTAL = Counter("engine_ejections_total", "Times an engine's circuit breaker opened", labelnames=("engine",))
+ENGINE_POOL_IN_USE = Gauge(
+    "engine_pool_connections_in_use", "Engine HTTP connections carrying a request", labelnames=("engine",)
+)
+ENGINE_POOL_MAX = Gauge("engine_pool_connections_max", "Engine HTTP connection limit", labelnames=("engine",))
+ENGINE_POOL_WAIT_SECONDS = Histogram(
+    "engine_pool_wait_seconds",
+    "Time engine requests waited for a free HTTP connection",
+    labelnames=("engine",),
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30),
+)
+ENGINE_POOL_TIMEOUTS_TOTAL = Counter(
+    "engine_pool_timeouts_total", "Engine requests that gave up waiting for a connection", labelnames=("engine",)
+)
+ENGINE_CONNECTIONS_OPENED_TOTAL = Counter(
+    "engine_connections_opened_total", "New TCP connections to the engine (churn)", labelnames=("engine",)
+)
+
+
+# OCR result cache
+OCR_CACHE_HITS_TOTAL = Counter("ocr_cache_hits_total", "OCR result cache hits", labelnames=("tier",))
+OCR_CACHE_MISSES_TOTAL = Counter("ocr_cache_misses_total", "OCR result cache misses (engine calls)")
+OCR_CACHE_COALESCED_TOTAL = Counter(
+    "ocr_cache_coalesced_total", "OCR requests served by joining an identical in-flight engine call"
+)
+OCR_CACHE_EVICTIONS_TOTAL = Counter("ocr_cache_evictions_total", "OCR result cache evictions", labelnames=("tier",))
+OCR_CACHE_BYTES = Gauge("ocr_cache_bytes", "Bytes held by the in-memory OCR result cache")
+
+
+# Background OCR jobs
+OCR_JOBS_SUBMITTED_TOTAL = Counter(
+    "ocr_jobs_submitted_total", "OCR jobs accepted (deduplicated=true when an existing job was returned)",
+    labelnames=("kind", "deduplicated"),
+)
+OCR_JOBS_FINISHED_TOTAL = Counter("ocr_jobs_finished_total", "OCR jobs reaching a final status", labelnames=("status",))
+OCR_JOBS_RUNNING = Gauge("ocr_jobs_running", "OCR jobs being processed by this process")
+OCR_JOB_PAGES_TOTAL = Counter("ocr_job_pages_total", "Job pages processed", labelnames=("status",))
+
+
+# Background usage writer
+USAGE_WRITER_BACKLOG = Gauge("usage_writer_backlog", "Usage events waiting to be written")
+USAGE_WRITER_FLUSH_SECONDS = Histogram(
+    "usage_writer_flush_seconds",
+    "Time to bulk-insert one batch of usage events",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+USAGE_EVENTS_WRITTEN_TOTAL = Counter("usage_events_written_total", "Usage events written to the database")
+USAGE_EVENTS_DROPPED_TOTAL = Counter(
+    "usage_events_dropped_total", "Usage events dropped because the writer backlog was full"
+)
+
+
+# Event loop health: how late a periodic wake-up fires (blocking work on the loop shows up here)
+EVENT_LOOP_LAG_SECONDS = Histogram(
+    "event_loop_lag_seconds",
+    "Delay between when the loop monitor should have woken up and when it did",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
 
 
 # Users + tokens
@@ -76,6 +275,7 @@ class _OcrSpan:
     def __init__(self, kind: str):
         self.kind = kind
         self.start = time.perf_counter()
+        self.finished = False
         OCR_IN_PROGRESS.labels(kind=kind).inc()
         OCR_REQUESTS_TOTAL.labels(kind=kind).inc()
         if kind == "image":
@@ -89,6 +289,10 @@ class _OcrSpan:
         prompt_tokens: int,
         completion_tokens: int,
     ) -> None:
+        """Only the first call counts, so a stream may call it again when it ends however it ends."""
+        if self.finished:
+            return
+        self.finished = True
         duration = max(0.0, time.perf_counter() - self.start)
         OCR_PROCESSING_SECONDS.labels(kind=self.kind).observe(duration)
         OCR_INPUT_BYTES_TOTAL.labels(kind=self.kind).inc(input_bytes)
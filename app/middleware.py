@@ -38,3 +38,80 @@ class MetricsMiddleware:
                 done = True
             raise
 
+
+
+class UploadSizeLimitMiddleware:
+    """Rejects request bodies over a per-path byte limit with 413 before they are parsed.
+
+    ``limits`` maps a path prefix to a maximum body size. A ``Content-Length`` over
+    the limit is refused up front; bodies without one are counted as they arrive
+    and cut off once they exceed it.
+    """
+
+    def __init__(self, app: ASGIApp, limits: dict[str, int]) -> None:
+        self.app = app
+        # longest prefix first so more specific paths win
+        self.limits = sorted(limits.items(), key=lambda item: len(item[0]), reverse=True)
+
+    def _limit_for(self, path: str):
+        for prefix, limit in self.limits:
+            if path.startswith(prefix):
+                return limit
+        return None
+
+    async def _reject(self, send: Send) -> None:
+        body = b'{"detail":"Request body too large"}'
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        limit = self._limit_for(scope.get("path", "/")) if scope.get("type") == "http" else None
+        if limit is None:
+            await self.app(scope, receive, send)
+            return
+
+        for name, value in scope.get("headers", []):
+            if name == b"content-length":
+                try:
+                    declared = int(value)
+                except ValueError:
+                    declared = 0
+                if declared > limit:
+                    await self._reject(send)
+                    return
+
+        received = 0
+        rejected = False
+        response_started = False
+
+        async def receive_wrapper():
+            nonlocal received, rejected
+            if rejected:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    rejected = True
+                    if not response_started:
+                        await self._reject(send)
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def send_wrapper(message):
+            nonlocal response_started
+            # once the 413 is out, whatever the app tries to send is dropped
+            if not rejected:
+                response_started = True
+                await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        except Exception:
+            # the app sees the cut-off body as a client disconnect
+            if not rejected:
+                raise
@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text, Index, BigInteger, Boolean
 from sqlalchemy.orm import relationship
 from app.db import Base
 
@@ -31,3 +31,120 @@ class UsageEvent(Base):
 
     user = relationship("User", back_populates="usages")
 
+    __table_args__ = (Index("ix_usage_events_user_id_created_at", "user_id", "created_at"),)
+
+
+class UsageTotal(Base):
+    """Per-user running totals of usage_events, maintained by the usage writer."""
+
+    __tablename__ = "usage_totals"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    events = Column(BigInteger, default=0, nullable=False)
+    input_bytes = Column(BigInteger, default=0, nullable=False)
+    prompt_tokens = Column(BigInteger, default=0, nullable=False)
+    completion_tokens = Column(BigInteger, default=0, nullable=False)
+    prompt_chars = Column(BigInteger, default=0, nullable=False)
+    completion_chars = Column(BigInteger, default=0, nullable=False)
+
+
+class UsageBucket(Base):
+    """Per-user usage aggregated into hourly and daily buckets."""
+
+    __tablename__ = "usage_buckets"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    granularity = Column(String(8), primary_key=True)  # hour | day
+    bucket_start = Column(DateTime, primary_key=True)
+    events = Column(BigInteger, default=0, nullable=False)
+    input_bytes = Column(BigInteger, default=0, nullable=False)
+    prompt_tokens = Column(BigInteger, default=0, nullable=False)
+    completion_tokens = Column(BigInteger, default=0, nullable=False)
+    prompt_chars = Column(BigInteger, default=0, nullable=False)
+    completion_chars = Column(BigInteger, default=0, nullable=False)
+
+
+class OcrJob(Base):
+    """A queued OCR request; the row doubles as the persistent queue entry."""
+
+    __tablename__ = "ocr_jobs"
+
+    id = Column(String(32), primary_key=True)  # uuid4 hex
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    kind = Column(String(16), nullable=False)  # image | pdf
+    status = Column(String(16), nullable=False, default="queued")  # queued | running | succeeded | failed | cancelled
+    content_hash = Column(String(64), nullable=False)  # sha256 of the upload, also its blob store key
+    media_type = Column(String(64), nullable=False)
+    filename = Column(String(256), nullable=True)
+    prompt = Column(Text, nullable=False)
+    render = Column(String(32), nullable=True)  # render policy (pdf)
+    dedup_key = Column(String(64), nullable=False)
+    input_bytes = Column(BigInteger, default=0, nullable=False)
+    total_pages = Column(Integer, nullable=True)
+    done_pages = Column(Integer, default=0, nullable=False)
+    failed_pages = Column(Integer, default=0, nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    error = Column(Text, nullable=True)
+    lease_owner = Column(String(32), nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_ocr_jobs_status_created_at", "status", "created_at"),
+        Index("ix_ocr_jobs_user_id_created_at", "user_id", "created_at"),
+        Index("ix_ocr_jobs_user_id_dedup_key", "user_id", "dedup_key"),
+    )
+
+
+class OcrJobPage(Base):
+    """Result of one page of a job (images are a single page 1)."""
+
+    __tablename__ = "ocr_job_pages"
+
+    job_id = Column(String(32), ForeignKey("ocr_jobs.id"), primary_key=True)
+    page = Column(Integer, primary_key=True)  # 1-based
+    status = Column(String(16), nullable=False)  # done | failed
+    text = Column(Text, nullable=False, default="")
+    error = Column(Text, nullable=True)
+    cached = Column(Boolean, default=False, nullable=False)
+    prompt_tokens = Column(Integer, default=0, nullable=False)
+    completion_tokens = Column(Integer, default=0, nullable=False)
+    completion_chars = Column(Integer, default=0, nullable=False)
+    finished_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class PdfDocument(Base):
+    """A PDF streamed through /ocr/pdf, kept so an interrupted stream can be resumed."""
+
+    __tablename__ = "pdf_documents"
+
+    id = Column(String(64), primary_key=True)  # sha256 of user, content hash, prompt, render policy and model
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    content_hash = Column(String(64), nullable=False)  # blob store key of the PDF
+    prompt = Column(Text, nullable=False)
+    render = Column(String(32), nullable=False)
+    text_layer = Column(String(8), default="ocr", nullable=False)  # PDF_TEXT_LAYER mode
+    total_pages = Column(Integer, nullable=False)
+    input_bytes = Column(BigInteger, default=0, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+class PageCheckpoint(Base):
+    """OCR result of one finished page of a PdfDocument."""
+
+    __tablename__ = "page_checkpoints"
+
+    document_id = Column(String(64), ForeignKey("pdf_documents.id"), primary_key=True)
+    page = Column(Integer, primary_key=True)  # 1-based
+    seq = Column(Integer, nullable=False)  # order in which pages finished, for offset-based resume
+    text = Column(Text, nullable=False, default="")
+    cached = Column(Boolean, default=False, nullable=False)
+    prompt_tokens = Column(Integer, default=0, nullable=False)
+    completion_tokens = Column(Integer, default=0, nullable=False)
+    completion_chars = Column(Integer, default=0, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (Index("ix_page_checkpoints_document_id_seq", "document_id", "seq", unique=True),)
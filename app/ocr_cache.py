@@ -0,0 +1,278 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import AsyncIterator, Callable, Optional
+
+from asgiref.sync import sync_to_async
+
+from app.core.config import settings
+from app.metrics import (
+    OCR_CACHE_BYTES,
+    OCR_CACHE_COALESCED_TOTAL,
+    OCR_CACHE_EVICTIONS_TOTAL,
+    OCR_CACHE_HITS_TOTAL,
+    OCR_CACHE_MISSES_TOTAL,
+)
+
+
+@dataclass
+class CachedResult:
+    text: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+    @property
+    def size(self) -> int:
+        return len(self.text.encode("utf-8")) + 64
+
+
+class _InFlight:
+    """A single engine call shared by every request asking for the same key.
+
+    The call runs in its own task and buffers its deltas, so each follower can
+    replay them from the start; it is cancelled once the last follower leaves.
+    """
+
+    def __init__(self):
+        self.pieces: list[str] = []
+        self.usage: dict = {}
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.followers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def push(self, piece: str) -> None:
+        self.pieces.append(piece)
+        self._notify()
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        self.done = True
+        self.error = error
+        self._notify()
+
+    def _notify(self) -> None:
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def follow(self) -> AsyncIterator[str]:
+        i = 0
+        while True:
+            if i < len(self.pieces):
+                yield self.pieces[i]
+                i += 1
+                continue
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+
+class _DiskTier:
+    """SQLite-backed tier that survives restarts. All access is serialized."""
+
+    def __init__(self, path: str, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS ocr_cache ("
+            " key TEXT PRIMARY KEY, text TEXT NOT NULL,"
+            " prompt_tokens INTEGER NOT NULL, completion_tokens INTEGER NOT NULL,"
+            " used_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[CachedResult]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text, prompt_tokens, completion_tokens FROM ocr_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE ocr_cache SET used_at = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        return CachedResult(text=row[0], prompt_tokens=row[1], completion_tokens=row[2])
+
+    def put(self, key: str, result: CachedResult) -> int:
+        """Store a result and prune least recently used rows; returns how many were evicted."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO ocr_cache (key, text, prompt_tokens, completion_tokens, used_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, result.text, result.prompt_tokens, result.completion_tokens, time.time()),
+            )
+            cur = self._conn.execute(
+                "DELETE FROM ocr_cache WHERE key IN ("
+                " SELECT key FROM ocr_cache ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+            return max(0, cur.rowcount)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class OcrResultCache:
+    """Content-addressed OCR result cache.
+
+    Keys hash the image bytes together with the prompt, model and engine
+    parameters. Results live in an in-memory LRU bounded by ``max_bytes`` and,
+    if ``disk_path`` is set, in a SQLite file. Concurrent misses for the same
+    key are coalesced onto one engine call.
+    """
+
+    def __init__(self, enabled: bool, max_bytes: int, disk_path: str = "", disk_max_entries: int = 100_000):
+        self.enabled = enabled
+        self.max_bytes = max_bytes
+        self._disk_path = disk_path
+        self._disk_max_entries = disk_max_entries
+        self._disk: Optional[_DiskTier] = None
+        self._lru: "OrderedDict[str, CachedResult]" = OrderedDict()
+        self._bytes = 0
+        self._inflight: dict[str, _InFlight] = {}
+
+    @staticmethod
+    def key(image: bytes, prompt: str, extra_body: dict | None) -> str:
+        payload = {
+            "image": hashlib.sha256(image).hexdigest(),
+            "prompt": prompt,
+            "model": settings.LLM_MODEL,
+            "extra_body": extra_body or {},
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def _disk_tier(self) -> Optional[_DiskTier]:
+        if self._disk is None and self._disk_path:
+            self._disk = _DiskTier(self._disk_path, self._disk_max_entries)
+        return self._disk
+
+    def _remember(self, key: str, result: CachedResult) -> None:
+        if result.size > self.max_bytes:
+            return
+        old = self._lru.pop(key, None)
+        if old is not None:
+            self._bytes -= old.size
+        self._lru[key] = result
+        self._bytes += result.size
+        while self._bytes > self.max_bytes and self._lru:
+            _, evicted = self._lru.popitem(last=False)
+            self._bytes -= evicted.size
+            OCR_CACHE_EVICTIONS_TOTAL.labels(tier="memory").inc()
+        OCR_CACHE_BYTES.set(self._bytes)
+
+    async def get(self, key: str) -> Optional[CachedResult]:
+        result = self._lru.get(key)
+        if result is not None:
+            self._lru.move_to_end(key)
+            OCR_CACHE_HITS_TOTAL.labels(tier="memory").inc()
+            return result
+        disk = self._disk_tier()
+        if disk is not None:
+            result = await sync_to_async(disk.get, thread_sensitive=False)(key)
+            if result is not None:
+                self._remember(key, result)
+                OCR_CACHE_HITS_TOTAL.labels(tier="disk").inc()
+                return result
+        return None
+
+    async def put(self, key: str, result: CachedResult) -> None:
+        self._remember(key, result)
+        disk = self._disk_tier()
+        if disk is not None:
+            evicted = await sync_to_async(disk.put, thread_sensitive=False)(key, result)
+            if evicted:
+                OCR_CACHE_EVICTIONS_TOTAL.labels(tier="disk").inc(evicted)
+
+    async def stream(
+        self,
+        key: str,
+        produce: Callable[[dict], AsyncIterator[str]],
+        usage_ref: dict,
+        info: dict,
+    ) -> AsyncIterator[str]:
+        """Yield content deltas for ``key``, calling ``produce(usage)`` only on a miss.
+
+        ``info["cache"]`` is set to ``hit``, ``coalesced`` or ``miss``; ``usage_ref``
+        receives the token usage of the (possibly cached) result.
+        """
+        if not self.enabled:
+            async for piece in produce(usage_ref):
+                yield piece
+            return
+
+        cached = await self.get(key)
+        if cached is not None:
+            info["cache"] = "hit"
+            usage_ref.update(prompt_tokens=cached.prompt_tokens, completion_tokens=cached.completion_tokens)
+            if cached.text:
+                yield cached.text
+            return
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            info["cache"] = "coalesced"
+            OCR_CACHE_COALESCED_TOTAL.inc()
+        else:
+            info["cache"] = "miss"
+            OCR_CACHE_MISSES_TOTAL.inc()
+            inflight = self._inflight[key] = _InFlight()
+            inflight.task = asyncio.create_task(self._run(key, inflight, produce))
+
+        inflight.followers += 1
+        try:
+            async for piece in inflight.follow():
+                yield piece
+            usage_ref.update(inflight.usage)
+        finally:
+            inflight.followers -= 1
+            if inflight.followers == 0 and not inflight.done and inflight.task is not None:
+                # Nobody is listening any more; stop paying for the engine call.
+                inflight.task.cancel()
+                if self._inflight.get(key) is inflight:
+                    del self._inflight[key]
+
+    async def _run(self, key: str, inflight: _InFlight, produce: Callable[[dict], AsyncIterator[str]]) -> None:
+        try:
+            async for piece in produce(inflight.usage):
+                inflight.push(piece)
+            result = CachedResult(
+                text="".join(inflight.pieces),
+                prompt_tokens=int(inflight.usage.get("prompt_tokens") or 0),
+                completion_tokens=int(inflight.usage.get("completion_tokens") or 0),
+            )
+            inflight.finish()
+            try:
+                await self.put(key, result)
+            except Exception:
+                pass
+        except asyncio.CancelledError as exc:
+            inflight.finish(exc)
+            raise
+        except Exception as exc:
+            inflight.finish(exc)
+        finally:
+            if self._inflight.get(key) is inflight:
+                del self._inflight[key]
+
+    def close(self) -> None:
+        if self._disk is not None:
+            self._disk.close()
+            self._disk = None
+
+
+ocr_cache = OcrResultCache(
+    enabled=settings.OCR_CACHE_ENABLED,
+    max_bytes=settings.OCR_CACHE_MAX_BYTES,
+    disk_path=settings.OCR_CACHE_PATH,
+    disk_max_entries=settings.OCR_CACHE_DISK_MAX_ENTRIES,
+)
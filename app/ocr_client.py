@@ -1,13 +1,441 @@
-from typing import Optional
+"""Pool of OpenAI-compatible OCR engines (vLLM replicas).
+
+Each request goes to the available engine with the fewest in-flight requests
+(or, with ``ENGINE_ROUTING=tokens``, the fewest estimated completion tokens
+still to come). Every engine has a circuit breaker: ``ENGINE_FAILURE_THRESHOLD``
+consecutive failures eject it for ``ENGINE_EJECT_SECONDS``, after which a single
+trial request or a passing health probe lets it back in. A request that fails
+before the engine produced any output is retried on another engine; once
+output has been streamed, failures are passed on to the caller.
+"""
+import asyncio
+import functools
+import logging
+import random
+import time
+from typing import Any, AsyncIterator, Optional
+from urllib.parse import urlsplit
+
+import httpx
+import openai
 from openai import AsyncOpenAI
+
 from app.core.config import settings
+from app.metrics import (
+    ENGINE_AVAILABLE,
+    ENGINE_CONNECTIONS_OPENED_TOTAL,
+    ENGINE_EJECTIONS_TOTAL,
+    ENGINE_FAILOVERS_TOTAL,
+    ENGINE_FIRST_TOKEN_SECONDS,
+    ENGINE_IN_FLIGHT,
+    ENGINE_OUTSTANDING_TOKENS,
+    ENGINE_POOL_IN_USE,
+    ENGINE_POOL_MAX,
+    ENGINE_POOL_TIMEOUTS_TOTAL,
+    ENGINE_POOL_WAIT_SECONDS,
+    ENGINE_REQUEST_SECONDS,
+    ENGINE_REQUESTS_TOTAL,
+)
+
+
+logger = logging.getLogger(__name__)
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+# Completion tokens assumed per request until an engine has served some
+INITIAL_EXPECTED_TOKENS = 512.0
+EXPECTED_TOKENS_ALPHA = 0.2
+
+
+class EngineTimeout(Exception):
+    """The engine sent no first token, or no further output, in time."""
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Errors that say the engine (not the request) is at fault."""
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code >= 500 or exc.status_code == 429
+    return isinstance(exc, (EngineTimeout, openai.APIConnectionError, openai.APIError, httpx.TransportError))
+
+
+async def _within(awaitable, deadline: float, engine: "Engine", what: str):
+    timeout = deadline - time.monotonic()
+    try:
+        return await asyncio.wait_for(awaitable, max(timeout, 0))
+    except asyncio.TimeoutError:
+        raise EngineTimeout(f"No {what} from engine {engine.name} within the timeout") from None
+
+
+def _has_output(chunk) -> bool:
+    if getattr(chunk, "usage", None) is not None:
+        return True
+    for choice in chunk.choices or ():
+        if getattr(choice.delta, "content", None) or choice.finish_reason:
+            return True
+    return False
+
+
+def _content_tokens(chunk) -> int:
+    """Tokens in a chunk; vLLM streams one token per chunk unless it batches output."""
+    return sum(1 for choice in chunk.choices or () if getattr(choice.delta, "content", None))
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    def __init__(self, stream: httpx.AsyncByteStream, release):
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        async for part in self._stream:
+            yield part
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            self._release()
+
+
+class PooledTransport(httpx.AsyncHTTPTransport):
+    """httpx transport that hands out the engine's connections itself.
+
+    Requests wait here (up to the pool timeout) for one of ``max_connections``
+    slots, so the wait and the number of connections in use can be measured;
+    httpcore's own pool below never has to queue. A slot is held until the
+    response body is closed. New TCP connections are counted via httpcore's
+    trace hook. With HTTP/2 requests share connections and are not gated.
+    """
+
+    def __init__(self, name: str, limits: httpx.Limits, pool_timeout: float, http2: bool = False):
+        super().__init__(limits=limits, http2=http2)
+        self.name = name
+        self.pool_timeout = pool_timeout
+        self._slots = None if http2 else asyncio.Semaphore(limits.max_connections)
+        self._in_use = 0
+        ENGINE_POOL_MAX.labels(engine=name).set(limits.max_connections or 0)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started = time.perf_counter()
+        if self._slots is not None:
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.pool_timeout)
+            except asyncio.TimeoutError:
+                ENGINE_POOL_TIMEOUTS_TOTAL.labels(engine=self.name).inc()
+                raise httpx.PoolTimeout(f"No free connection to engine {self.name}", request=request) from None
+        ENGINE_POOL_WAIT_SECONDS.labels(engine=self.name).observe(time.perf_counter() - started)
+        self._in_use += 1
+        ENGINE_POOL_IN_USE.labels(engine=self.name).set(self._in_use)
+        released = False
+
+        def release() -> None:
+            nonlocal released
+            if not released:
+                released = True
+                self._in_use -= 1
+                ENGINE_POOL_IN_USE.labels(engine=self.name).set(self._in_use)
+                if self._slots is not None:
+                    self._slots.release()
+
+        request.extensions = {**request.extensions, "trace": self._trace}
+        try:
+            response = await super().handle_async_request(request)
+        except BaseException:
+            release()
+            raise
+        response.stream = _ReleasingStream(response.stream, release)
+        return response
+
+    async def _trace(self, event: str, info: dict) -> None:
+        if event == "connection.connect_tcp.complete":
+            ENGINE_CONNECTIONS_OPENED_TOTAL.labels(engine=self.name).inc()
+
+
+@functools.cache
+def _use_http2() -> bool:
+    """ENGINE_HTTP2, if the ``h2`` package it needs is installed (``pip install "httpx[http2]"``)."""
+    if not settings.ENGINE_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        logger.warning('ENGINE_HTTP2 needs the h2 package (pip install "httpx[http2]"); using HTTP/1.1')
+        return False
+    return True
+
+
+def build_http_client(name: str) -> httpx.AsyncClient:
+    limits = httpx.Limits(
+        max_connections=settings.ENGINE_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.ENGINE_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.ENGINE_KEEPALIVE_EXPIRY_SECONDS,
+    )
+    transport = PooledTransport(name, limits, settings.ENGINE_POOL_TIMEOUT_SECONDS, http2=_use_http2())
+    return httpx.AsyncClient(transport=transport, limits=limits)
+
+
+def engine_timeout() -> httpx.Timeout:
+    """Per-request httpx timeouts; first-token and between-chunk limits are enforced by the pool."""
+    read = max(settings.ENGINE_READ_TIMEOUT_SECONDS, settings.ENGINE_FIRST_TOKEN_TIMEOUT_SECONDS)
+    return httpx.Timeout(
+        connect=settings.ENGINE_CONNECT_TIMEOUT_SECONDS,
+        read=read,
+        write=read,
+        pool=settings.ENGINE_POOL_TIMEOUT_SECONDS,
+    )
+
+
+class Engine:
+    """One engine replica: its client, load and circuit-breaker state."""
+
+    def __init__(self, base_url: str, api_key: str):
+        self.base_url = base_url
+        self.name = urlsplit(base_url).netloc or base_url
+        # The pool retries across engines itself
+        self.client = AsyncOpenAI(
+            base_url=base_url,
+            api_key=api_key,
+            max_retries=0,
+            timeout=engine_timeout(),
+            http_client=build_http_client(self.name),
+        )
+        self.in_flight = 0
+        self.outstanding_tokens = 0.0
+        self.expected_tokens = INITIAL_EXPECTED_TOKENS
+        self.failures = 0
+        self.state = CLOSED
+        self.ejected_until = 0.0
+        self.trial_in_flight = False
+        ENGINE_AVAILABLE.labels(engine=self.name).set(1)
+
+    def available(self, now: float) -> bool:
+        if self.state == OPEN and now >= self.ejected_until:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN:
+            return not self.trial_in_flight
+        return self.state == CLOSED
+
+    def load(self, routing: str) -> float:
+        return self.outstanding_tokens if routing == "tokens" else self.in_flight
+
+    def _close(self) -> None:
+        if self.state != CLOSED:
+            logger.info("Engine %s is back in rotation", self.name)
+        self.state = CLOSED
+        self.failures = 0
+        ENGINE_AVAILABLE.labels(engine=self.name).set(1)
+
+    def _open(self, eject_seconds: float) -> None:
+        if self.state != OPEN:
+            logger.warning("Ejecting engine %s for %.0fs after %d failures", self.name, eject_seconds, self.failures)
+            ENGINE_EJECTIONS_TOTAL.labels(engine=self.name).inc()
+        self.state = OPEN
+        self.ejected_until = time.monotonic() + eject_seconds
+        ENGINE_AVAILABLE.labels(engine=self.name).set(0)
+
+    def record_success(self) -> None:
+        self._close()
+
+    def record_failure(self, threshold: int, eject_seconds: float) -> None:
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= threshold:
+            self._open(eject_seconds)
+
+    def record_completion(self, tokens: int) -> None:
+        self.expected_tokens += EXPECTED_TOKENS_ALPHA * (tokens - self.expected_tokens)
+
+
+class _Lease:
+    """Load one request puts on an engine until it is released."""
+
+    def __init__(self, engine: Engine, trial: bool):
+        self.engine = engine
+        self.trial = trial
+        self.remaining = engine.expected_tokens
+        self.tokens = 0
+        self.reported: Optional[int] = None  # completion tokens from the usage chunk, if the engine sent one
+        engine.in_flight += 1
+        engine.outstanding_tokens += self.remaining
+        if trial:
+            engine.trial_in_flight = True
+        self._publish()
+
+    def progress(self, tokens: int) -> None:
+        self.tokens += tokens
+        used = min(self.remaining, tokens)
+        self.remaining -= used
+        self.engine.outstanding_tokens -= used
+        ENGINE_OUTSTANDING_TOKENS.labels(engine=self.engine.name).set(self.engine.outstanding_tokens)
+
+    def release(self) -> None:
+        engine = self.engine
+        engine.in_flight -= 1
+        engine.outstanding_tokens = max(0.0, engine.outstanding_tokens - self.remaining)
+        self.remaining = 0
+        if self.trial:
+            engine.trial_in_flight = False
+        self._publish()
+
+    def _publish(self) -> None:
+        ENGINE_IN_FLIGHT.labels(engine=self.engine.name).set(self.engine.in_flight)
+        ENGINE_OUTSTANDING_TOKENS.labels(engine=self.engine.name).set(self.engine.outstanding_tokens)
+
+
+class EnginePool:
+    def __init__(
+        self,
+        base_urls: list[str],
+        api_key: str,
+        routing: str = "requests",
+        max_attempts: int = 3,
+        failure_threshold: int = 3,
+        eject_seconds: float = 30.0,
+        health_interval: float = 10.0,
+        health_timeout: float = 5.0,
+        first_token_timeout: float = 180.0,
+        read_timeout: float = 60.0,
+    ):
+        self.engines = [Engine(url, api_key) for url in dict.fromkeys(base_urls)]
+        self.routing = routing
+        self.max_attempts = max_attempts
+        self.failure_threshold = failure_threshold
+        self.eject_seconds = eject_seconds
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self.first_token_timeout = first_token_timeout
+        self.read_timeout = read_timeout
+        self._task: Optional[asyncio.Task] = None
+
+    def pick(self, tried: set[Engine]) -> Engine:
+        """Least-loaded available engine not tried yet for this request.
+
+        With none available, the untried engine whose ejection ends first is used
+        anyway: a request sent to a possibly recovered engine beats failing it here.
+        """
+        now = time.monotonic()
+        candidates = [e for e in self.engines if e not in tried] or self.engines
+        available = [e for e in candidates if e.available(now)]
+        if available:
+            return min(available, key=lambda e: (e.load(self.routing), random.random()))
+        return min(candidates, key=lambda e: (e.ejected_until, e.in_flight))
+
+    async def stream(self, prefer: Optional[Engine] = None, **request: Any) -> AsyncIterator[Any]:
+        """Chat completion chunks (``stream=True`` is implied), with failover before the first output.
+
+        ``prefer`` is tried first if it is available (micro-batches stay on one engine).
+        """
+        tried: set[Engine] = set()
+        for attempt in range(1, self.max_attempts + 1):
+            if attempt == 1 and prefer is not None and prefer.available(time.monotonic()):
+                engine = prefer
+            else:
+                engine = self.pick(tried)
+            if engine in tried:
+                await asyncio.sleep(min(0.1 * 2 ** (attempt - 1), 2.0))
+            tried.add(engine)
+            lease = _Lease(engine, trial=engine.state == HALF_OPEN)
+            started = time.perf_counter()
+            produced = False
+            outcome = "cancelled"
+            stream = None
+            try:
+                deadline = time.monotonic() + self.first_token_timeout
+                stream = await _within(
+                    engine.client.chat.completions.create(stream=True, **request), deadline, engine, "response"
+                )
+                chunks = stream.__aiter__()
+                pending = []
+                while True:
+                    limit = time.monotonic() + self.read_timeout if produced else deadline
+                    try:
+                        chunk = await _within(anext(chunks), limit, engine, "output" if produced else "first token")
+                    except StopAsyncIteration:
+                        break
+                    usage = getattr(chunk, "usage", None)
+                    if usage is not None and getattr(usage, "completion_tokens", None) is not None:
+                        lease.reported = int(usage.completion_tokens)
+                    if not produced:
+                        pending.append(chunk)
+                        if not _has_output(chunk):
+                            continue
+                        produced = True
+                        ENGINE_FIRST_TOKEN_SECONDS.labels(engine=engine.name).observe(time.perf_counter() - started)
+                        for buffered in pending:
+                            lease.progress(_content_tokens(buffered))
+                            yield buffered
+                        pending = []
+                        continue
+                    lease.progress(_content_tokens(chunk))
+                    yield chunk
+                for buffered in pending:
+                    yield buffered
+                outcome = "ok"
+            except Exception as exc:
+                if not is_retryable(exc):
+                    outcome = "client_error"
+                    raise
+                outcome = "error"
+                engine.record_failure(self.failure_threshold, self.eject_seconds)
+                if produced or attempt == self.max_attempts:
+                    raise
+                logger.warning("Engine %s failed before the first token (%s); retrying", engine.name, exc)
+                ENGINE_FAILOVERS_TOTAL.labels(engine=engine.name).inc()
+            finally:
+                lease.release()
+                ENGINE_REQUESTS_TOTAL.labels(engine=engine.name, outcome=outcome).inc()
+                ENGINE_REQUEST_SECONDS.labels(engine=engine.name).observe(time.perf_counter() - started)
+                if outcome == "ok" or (outcome == "cancelled" and produced):
+                    engine.record_success()
+                    if outcome == "ok":
+                        # Chunks can hold several tokens; the engine's own count is exact
+                        engine.record_completion(lease.reported if lease.reported is not None else lease.tokens)
+                if stream is not None and outcome != "ok":
+                    try:
+                        await stream.close()
+                    except Exception:
+                        pass
+            if outcome == "ok":
+                return
+
+    async def probe(self, engine: Engine) -> bool:
+        try:
+            await engine.client.with_options(timeout=self.health_timeout).models.list()
+        except Exception as exc:
+            logger.debug("Health probe of %s failed: %s", engine.name, exc)
+            engine.record_failure(self.failure_threshold, self.eject_seconds)
+            return False
+        # Lets an ejected engine back in once its ejection is over; healthy ones keep their failure count
+        if engine.state != CLOSED and engine.available(time.monotonic()):
+            engine.record_success()
+        return True
+
+    async def start(self) -> None:
+        if self._task is None and self.health_interval > 0:
+            self._task = asyncio.create_task(self._probe_loop())
 
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        # Closes every engine's connection pool
+        for engine in self.engines:
+            await engine.client.close()
 
-_client: Optional[AsyncOpenAI] = None
+    async def _probe_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.health_interval)
+            await asyncio.gather(*(self.probe(engine) for engine in self.engines))
 
 
-def get_client() -> AsyncOpenAI:
-    global _client
-    if _client is None:
-        _client = AsyncOpenAI(base_url=str(settings.LLM_BASE_URL), api_key=settings.LLM_API_KEY)
-    return _client
+engine_pool = EnginePool(
+    settings.engine_base_urls,
+    settings.LLM_API_KEY,
+    routing=settings.ENGINE_ROUTING,
+    max_attempts=settings.ENGINE_MAX_ATTEMPTS,
+    failure_threshold=settings.ENGINE_FAILURE_THRESHOLD,
+    eject_seconds=settings.ENGINE_EJECT_SECONDS,
+    health_interval=settings.ENGINE_HEALTH_INTERVAL_SECONDS,
+    health_timeout=settings.ENGINE_HEALTH_TIMEOUT_SECONDS,
+    first_token_timeout=settings.ENGINE_FIRST_TOKEN_TIMEOUT_SECONDS,
+    read_timeout=settings.ENGINE_READ_TIMEOUT_SECONDS,
+)
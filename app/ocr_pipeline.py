@@ -0,0 +1,267 @@
+"""Talking to the OCR engine: request construction, streaming, caching and usage accounting.
+
+Shared by the streaming endpoints in ``app.routers.ocr`` and the background job runner.
+"""
+import binascii
+import logging
+import math
+import time
+from contextlib import aclosing
+from typing import AsyncGenerator, Optional
+
+from app.admission import admission
+from app.batching import batch_dispatcher
+from app.core.config import settings
+from app.imaging import PageEncoding, image_pixels, normalize_image, run_cpu
+from app.metrics import OCR_PROMPT_TOKENS_PER_MEGAPIXEL, OCR_USAGE_SOURCE_TOTAL, observe_image_prep
+from app.ocr_cache import ocr_cache
+from app.ocr_client import engine_pool
+from app.timings import Timings
+from app.tokens import token_counter
+from app.usage_writer import usage_writer
+
+
+logger = logging.getLogger(__name__)
+
+
+def engine_extra_body() -> dict:
+    """vLLM sampling extras sent with every OCR request."""
+    return {
+        "vllm_xargs": {"ngram_size": 30, "window_size": 90},
+        "skip_special_tokens": False,
+    }
+
+
+def _prefix_key(messages) -> str:
+    """Text that leads the request (the prompt): requests sharing it can share the engine's prefix cache."""
+    parts = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+            continue
+        for part in content or []:
+            if part.get("type") != "text":
+                return "\0".join(parts)
+            parts.append(part.get("text") or "")
+    return "\0".join(parts)
+
+
+def _text_parts(messages) -> str:
+    parts = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+            continue
+        parts.extend(part.get("text") or "" for part in content or [] if part.get("type") == "text")
+    return "\n".join(parts)
+
+
+def _reported_usage(chunk) -> Optional[tuple[int, int]]:
+    """(prompt, completion) tokens of the ``include_usage`` chunk; None for other chunks."""
+    usage = getattr(chunk, "usage", None)
+    if usage is None:
+        return None
+    try:
+        return int(getattr(usage, "prompt_tokens", 0) or 0), int(getattr(usage, "completion_tokens", 0) or 0)
+    except (TypeError, ValueError):
+        return None
+
+
+async def stream_chat(
+    messages,
+    extra_body=None,
+    usage_ref: dict | None = None,
+    flow: str = "default",
+    timings: Optional[Timings] = None,
+    image_tokens: int = 0,
+) -> AsyncGenerator[str, None]:
+    """Async generator yielding content deltas via OpenAI streaming.
+
+    Fills ``usage_ref`` with the token usage the engine reports in its last
+    chunk (``include_usage``), counted with TOKENIZER when the engine sends
+    none; ``usage_ref["source"]`` says which (no counts at all: the caller
+    estimates). A tokenizer cannot count images, so ``image_tokens``, the
+    estimate for the images in ``messages``, is added to its prompt count.
+
+    Waits for its micro-batch to be released, then for an admission slot in
+    ``flow``; raises AdmissionRejected if none frees up in time. Adds the
+    queue, ttft and decode phases to ``timings``.
+    """
+    queued = time.perf_counter()
+    first_token = None
+    reported = None
+    # Completion text is only kept when it may have to be counted locally
+    pieces: Optional[list[str]] = [] if token_counter.enabled else None
+    # The batch window is waited out before admission, so it never holds a slot
+    engine = await batch_dispatcher.join(_prefix_key(messages))
+    async with admission.slot(flow):
+        sent = time.perf_counter()
+        if timings is not None:
+            timings.add("queue", sent - queued)
+        # Closed on early exit too, so the replica lease and the engine request end with the consumer
+        async with aclosing(engine_pool.stream(
+            prefer=engine,
+            model=settings.LLM_MODEL,
+            messages=messages,
+            temperature=0.0,
+            stream_options={"include_usage": True},
+            extra_body=extra_body or {},
+        )) as stream:
+            async for chunk in stream:
+                # The usage chunk has no choices, so it is read before anything else
+                reported = _reported_usage(chunk) or reported
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta  # type: ignore[attr-defined]
+                if hasattr(delta, "content") and delta.content:
+                    if first_token is None:
+                        first_token = time.perf_counter()
+                        if timings is not None:
+                            timings.add("ttft", first_token - sent)
+                    if pieces is not None:
+                        pieces.append(delta.content)
+                    yield delta.content
+    if timings is not None and first_token is not None:
+        timings.add("decode", time.perf_counter() - first_token)
+    source = "estimate"
+    if reported is not None:
+        source = "engine"
+    elif pieces is not None:
+        counts = await token_counter.count(_text_parts(messages), "".join(pieces))
+        if counts is not None:
+            source, reported = "tokenizer", (counts[0] + image_tokens, counts[1])
+    OCR_USAGE_SOURCE_TOTAL.labels(source=source).inc()
+    if reported is not None:
+        if usage_ref is not None:
+            usage_ref.update(prompt_tokens=reported[0], completion_tokens=reported[1], source=source)
+        if timings is not None:
+            timings.decoded(reported[1])
+
+
+# Multiple of 3 so chunk encodings concatenate without padding in between
+_B64_CHUNK = 3 * 64 * 1024
+
+
+def data_url(media_type: str, data: bytes) -> str:
+    """``data:`` URL for ``data``, base64-encoded chunk by chunk into one preallocated buffer.
+
+    The naive ``f"data:...;base64,{b64encode(data).decode()}"`` holds three
+    full-size copies at once (bytes, str, formatted str); this holds one buffer
+    plus the final string.
+    """
+    prefix = f"data:{media_type};base64,".encode("ascii")
+    out = bytearray(len(prefix) + 4 * ((len(data) + 2) // 3))
+    out[: len(prefix)] = prefix
+    pos = len(prefix)
+    view = memoryview(data)
+    for start in range(0, len(data), _B64_CHUNK):
+        encoded = binascii.b2a_base64(view[start : start + _B64_CHUNK], newline=False)
+        out[pos : pos + len(encoded)] = encoded
+        pos += len(encoded)
+    return out.decode("ascii")
+
+
+def image_messages(prompt_text: str, media_type: str, image: bytes) -> list[dict]:
+    return [
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": prompt_text},
+                {"type": "image_url", "image_url": {"url": data_url(media_type, image)}},
+            ],
+        }
+    ]
+
+
+def _image_tokens(image: bytes) -> int:
+    """Estimated prompt tokens of an encoded image (TOKENIZER_IMAGE_PIXELS_PER_TOKEN)."""
+    pixels = image_pixels(image)
+    return math.ceil(pixels / settings.TOKENIZER_IMAGE_PIXELS_PER_TOKEN) if pixels else 0
+
+
+async def ocr_stream(
+    image: bytes,
+    media_type: str,
+    prompt_text: str,
+    extra_body: dict,
+    usage_ref: dict,
+    flow: str,
+    info: dict,
+    timings: Optional[Timings] = None,
+) -> AsyncGenerator[str, None]:
+    """Content deltas for one image, replayed from the result cache when possible.
+    ``info["cache"]`` tells whether the result was a cache hit, coalesced or a miss.
+    """
+
+    def produce(usage: dict):
+        messages = image_messages(prompt_text, media_type, image)
+        return stream_chat(
+            messages,
+            extra_body=extra_body,
+            usage_ref=usage,
+            flow=flow,
+            timings=timings,
+            image_tokens=_image_tokens(image) if token_counter.enabled else 0,
+        )
+
+    key = ocr_cache.key(image, prompt_text, extra_body)
+    async for piece in ocr_cache.stream(key, produce, usage_ref, info):
+        yield piece
+    # Coalesced followers share the leader's usage; it is observed once, by the leader
+    if usage_ref.get("source") == "engine" and usage_ref.get("prompt_tokens") and info.get("cache") != "coalesced":
+        pixels = image_pixels(image)
+        if pixels:
+            OCR_PROMPT_TOKENS_PER_MEGAPIXEL.observe(usage_ref["prompt_tokens"] / (pixels / 1e6))
+
+
+async def prepare_image(image: bytes, media_type: str, timings: Optional[Timings] = None) -> tuple[bytes, str]:
+    """An uploaded image as the engine should get it (IMAGE_NORMALIZE); undecodable uploads pass through."""
+    if not settings.IMAGE_NORMALIZE:
+        return image, media_type
+    encoding = PageEncoding(
+        format=settings.IMAGE_FORMAT,
+        png_compress_level=settings.PAGE_PNG_COMPRESS_LEVEL,
+        jpeg_quality=settings.IMAGE_JPEG_QUALITY,
+        grayscale=settings.IMAGE_GRAYSCALE,
+    )
+    try:
+        result = await run_cpu(normalize_image, image, media_type, settings.IMAGE_MAX_SIDE, encoding)
+    except Exception:
+        logger.debug("Image normalization failed; sending the upload as it is", exc_info=True)
+        observe_image_prep("failed", {}, len(image), len(image))
+        return image, media_type
+    observe_image_prep(
+        "normalized" if result.changed else "kept",
+        {"decode": result.decode_seconds, "transform": result.transform_seconds, "encode": result.encode_seconds},
+        len(image),
+        len(result.data),
+    )
+    if timings is not None:
+        timings.add("render", result.decode_seconds + result.transform_seconds)
+        timings.add("encode", result.encode_seconds)
+    return result.data, result.media_type
+
+
+def record_usage(
+    user_id: int,
+    kind: str,
+    prompt_chars: int,
+    completion_chars: int,
+    prompt_tokens: int = 0,
+    completion_tokens: int = 0,
+    input_bytes: int = 0,
+    meta: Optional[str] = None,
+):
+    """Queue a usage event; it is written in bulk by the background usage writer."""
+    usage_writer.submit(
+        user_id=user_id,
+        kind=kind,
+        prompt_chars=prompt_chars,
+        completion_chars=completion_chars,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        input_bytes=input_bytes,
+        meta=meta,
+    )
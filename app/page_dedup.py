@@ -0,0 +1,148 @@
+"""Pre-OCR page triage for PDFs: blank pages and near-duplicate pages skip the engine.
+
+Works on the :class:`~app.imaging.PageSignature` computed next to rendering.
+A page is blank when almost none of it is ink. A page is a duplicate of an
+earlier one (in the same stream or a recent one of the same user, prompt and
+render policy) when their ink bitmaps are identical, or in ``perceptual`` mode
+when their difference hashes are within a few bits and no cell of their 32x32
+gray-level grids differs by much. Perceptual matching also catches rescans of
+the same sheet, but cannot see a single changed digit, hence opt-in.
+Duplicates get the earlier page's text, waiting for it if it is an earlier
+page of the same stream that is still being OCR'd. Pages without any ink (blank skipping off) are never duplicates:
+their bitmaps are all equal whatever the page shows.
+"""
+import asyncio
+import itertools
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from app.core.config import settings
+from app.imaging import PageSignature
+from app.metrics import OCR_ENGINE_SECONDS_SAVED_TOTAL, OCR_PAGE_INK_RATIO, OCR_PAGES_SKIPPED_TOTAL
+
+
+# Weight of the latest page in the running average of engine time per page
+_SECONDS_ALPHA = 0.1
+
+
+@dataclass(frozen=True)
+class PageResult:
+    text: str
+    page: int
+    stream_id: int
+    engine_seconds: float
+
+
+# Tells a duplicate within the same stream from one of an earlier stream
+new_stream_id = itertools.count(1).__next__
+
+
+class _Entry:
+    def __init__(self, key: int, scope: tuple, signature: PageSignature, stream_id: int, page: int):
+        self.key = key
+        self.scope = scope
+        self.signature = signature
+        self.stream_id = stream_id
+        self.page = page
+        self.result: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+def _similar(a: PageSignature, b: PageSignature, max_distance: int, max_tile_diff: int) -> bool:
+    if a.digest == b.digest:
+        return True
+    if (a.dhash ^ b.dhash).bit_count() > max_distance:
+        return False
+    return max(abs(x - y) for x, y in zip(a.tiles, b.tiles)) <= max_tile_diff
+
+
+class PageTriage:
+    def __init__(self, blank_ink_ratio: float, dedup: str, max_distance: int, max_tile_diff: int, max_entries: int):
+        self.blank_ink_ratio = blank_ink_ratio
+        self.dedup = dedup
+        self.max_distance = max_distance
+        self.max_tile_diff = max_tile_diff
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[int, _Entry]" = OrderedDict()
+        self._next_key = 0
+        self.page_seconds = 0.0  # running average of engine time per OCR'd page
+
+    @property
+    def enabled(self) -> bool:
+        return self.blank_ink_ratio > 0 or self.dedup != "off"
+
+    def _matches(self, a: PageSignature, b: PageSignature) -> bool:
+        if self.dedup == "exact":
+            return a.digest == b.digest
+        return _similar(a, b, self.max_distance, self.max_tile_diff)
+
+    def is_blank(self, signature: PageSignature) -> bool:
+        OCR_PAGE_INK_RATIO.observe(signature.ink_ratio)
+        if signature.ink_ratio < self.blank_ink_ratio:
+            OCR_PAGES_SKIPPED_TOTAL.labels(reason="blank").inc()
+            OCR_ENGINE_SECONDS_SAVED_TOTAL.labels(reason="blank").inc(self.page_seconds)
+            return True
+        return False
+
+    async def duplicate_of(
+        self, scope: tuple, signature: PageSignature, stream_id: int, page: int
+    ) -> Optional[PageResult]:
+        """Result of an earlier matching page; None if there is none.
+
+        Only an earlier page of the same stream is waited for while it is still
+        running. A later page may be held back behind this one (page order), so
+        waiting for it could deadlock; pages of other streams are used once done.
+        """
+        if self.dedup == "off" or not signature.ink_ratio:
+            return None
+        for key, entry in reversed(self._entries.items()):
+            if entry.scope != scope or not self._matches(entry.signature, signature):
+                continue
+            if not entry.result.done() and (entry.stream_id != stream_id or entry.page >= page):
+                continue
+            self._entries.move_to_end(key)
+            try:
+                result = await asyncio.shield(entry.result)
+            except Exception:
+                return None  # that page failed; OCR this one
+            OCR_PAGES_SKIPPED_TOTAL.labels(reason="duplicate").inc()
+            OCR_ENGINE_SECONDS_SAVED_TOTAL.labels(reason="duplicate").inc(result.engine_seconds)
+            return result
+        return None
+
+    def claim(self, scope: tuple, signature: PageSignature, stream_id: int, page: int) -> Optional[_Entry]:
+        """Announce a page about to be OCR'd so later duplicates wait for it; settle with finish() or fail()."""
+        if self.dedup == "off" or not signature.ink_ratio:
+            return None
+        entry = _Entry(self._next_key, scope, signature, stream_id, page)
+        self._next_key += 1
+        self._entries[entry.key] = entry
+        while len(self._entries) > self.max_entries:
+            _, old = self._entries.popitem(last=False)
+            if not old.result.done():
+                old.result.set_exception(LookupError("evicted"))
+                old.result.exception()  # retrieved: nobody may be waiting
+        return entry
+
+    def finish(self, entry: Optional[_Entry], result: PageResult) -> None:
+        if result.engine_seconds > 0:
+            self.page_seconds += _SECONDS_ALPHA * (result.engine_seconds - self.page_seconds)
+        if entry is not None and not entry.result.done():
+            entry.result.set_result(result)
+
+    def fail(self, entry: Optional[_Entry]) -> None:
+        if entry is None:
+            return
+        self._entries.pop(entry.key, None)
+        if not entry.result.done():
+            entry.result.set_exception(RuntimeError("page failed"))
+            entry.result.exception()
+
+
+page_triage = PageTriage(
+    blank_ink_ratio=settings.PDF_BLANK_INK_RATIO,
+    dedup=settings.PDF_PAGE_DEDUP,
+    max_distance=settings.PDF_PAGE_DEDUP_MAX_DISTANCE,
+    max_tile_diff=settings.PDF_PAGE_DEDUP_MAX_TILE_DIFF,
+    max_entries=settings.PDF_PAGE_DEDUP_MAX_ENTRIES,
+)
@@ -0,0 +1,57 @@
+import math
+from dataclasses import dataclass
+from typing import Optional
+
+from app.core.config import settings
+
+
+# PDF user space is 1/72 inch, so scale=1 renders at 72 DPI.
+POINTS_PER_INCH = 72.0
+RENDER_MODES = ("scale", "dpi", "pixels")
+
+
+@dataclass(frozen=True)
+class RenderPolicy:
+    """How to pick the rasterization scale for a PDF page.
+
+    - ``scale:<s>``   fixed pdfium scale factor (the old behaviour was ``scale:8``)
+    - ``dpi:<d>``     fixed resolution in dots per inch
+    - ``pixels:<n>``  largest scale whose bitmap stays within ``n`` pixels, so every
+                      page lands near the resolution the vision encoder actually uses
+    """
+
+    mode: str
+    value: float
+
+    def scale_for(self, width_pt: float, height_pt: float) -> float:
+        if self.mode == "scale":
+            scale = self.value
+        elif self.mode == "dpi":
+            scale = self.value / POINTS_PER_INCH
+        else:
+            area = max(1.0, width_pt * height_pt)
+            scale = math.sqrt(self.value / area)
+        return min(settings.PDF_RENDER_MAX_SCALE, max(settings.PDF_RENDER_MIN_SCALE, scale))
+
+    def __str__(self) -> str:
+        value = int(self.value) if self.value.is_integer() else self.value
+        return f"{self.mode}:{value}"
+
+
+def parse_render_policy(spec: Optional[str]) -> RenderPolicy:
+    """Parse ``mode:value`` (e.g. ``dpi:150``); empty falls back to ``PDF_RENDER_POLICY``.
+
+    Raises ValueError on malformed input.
+    """
+    spec = (spec or "").strip() or settings.PDF_RENDER_POLICY
+    mode, sep, raw = spec.partition(":")
+    mode = mode.strip().lower()
+    if not sep or mode not in RENDER_MODES:
+        raise ValueError(f"render policy must be one of {', '.join(m + ':<n>' for m in RENDER_MODES)}")
+    try:
+        value = float(raw)
+    except ValueError:
+        raise ValueError(f"invalid render policy value: {raw!r}") from None
+    if not math.isfinite(value) or value <= 0:
+        raise ValueError("render policy value must be positive")
+    return RenderPolicy(mode=mode, value=value)
@@ -6,7 +6,8 @@ from jose import jwt, JWTError
 from asgiref.sync import sync_to_async
 
 from app.core.config import settings
-from app.db import get_db
+from app.db import AsyncSessionLocal, get_db
+from app.identity_cache import identity_cache
 from app.models import User
 from app.schemas import Token, UserCreate, UserOut
 from app.security import create_access_token, verify_password, get_password_hash
@@ -23,14 +24,17 @@ async def get_user_by_username(db: AsyncSession, username: str) -> User | None:
     return result.scalar_one_or_none()
 
 
-async def get_current_user(db: AsyncSession = Depends(get_db), token: str | None = Depends(oauth2_scheme)) -> User:
-    # If auth is disabled, return or create an anonymous user
-    if not settings.AUTH_ENABLED:
-        from sqlalchemy.exc import IntegrityError
+async def ensure_anonymous_user() -> User:
+    """Resolve (creating if needed) the user every request runs as when auth is disabled; cached for the process."""
+    if identity_cache.anonymous is not None:
+        return identity_cache.anonymous
+    from sqlalchemy.exc import IntegrityError
+    async with AsyncSessionLocal() as db:
         anon = await get_user_by_username(db, settings.ANON_USERNAME)
         if not anon:
             try:
-                anon = User(username=settings.ANON_USERNAME, password_hash=get_password_hash(""))
+                password_hash = await sync_to_async(get_password_hash, thread_sensitive=False)("")
+                anon = User(username=settings.ANON_USERNAME, password_hash=password_hash)
                 db.add(anon)
                 await db.commit()
                 await db.refresh(anon)
@@ -39,7 +43,19 @@ async def get_current_user(db: AsyncSession = Depends(get_db), token: str | None
                 anon = await get_user_by_username(db, settings.ANON_USERNAME)
                 if not anon:
                     raise
-        return anon
+    identity_cache.anonymous = anon
+    return anon
+
+
+async def get_current_user(token: str | None = Depends(oauth2_scheme)) -> User:
+    return await user_from_token(token)
+
+
+async def user_from_token(token: str | None) -> User:
+    """The user a bearer token belongs to; raises 401. Also used where the dependency cannot run (WebSockets)."""
+    # If auth is disabled, every request runs as the anonymous user
+    if not settings.AUTH_ENABLED:
+        return await ensure_anonymous_user()
 
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -55,9 +71,15 @@ async def get_current_user(db: AsyncSession = Depends(get_db), token: str | None
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    user = await get_user_by_username(db, username=username)
+    # The JWT is verified above; the cache only saves the user lookup.
+    user = identity_cache.get(username)
+    if user is not None:
+        return user
+    async with AsyncSessionLocal() as db:
+        user = await get_user_by_username(db, username=username)
     if user is None:
         raise credentials_exception
+    identity_cache.put(user)
     return user
 
 
@@ -0,0 +1,264 @@
+import asyncio
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
+from fastapi import APIRouter, Depends, File, Form, HTTPException, Query, Response, UploadFile, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.blob_store import blob_lock, blob_store, release_blob
+from app.core.config import settings
+from app.db import AsyncSessionLocal, get_db
+from app.imaging import pdf_page_count, run_cpu
+from app.jobs import TERMINAL_STATUSES, dedup_key, job_runner, job_usage, new_job_id, page_events
+from app.metrics import OCR_JOBS_SUBMITTED_TOTAL
+from app.models import OcrJob, OcrJobPage, User
+from app.render_policy import parse_render_policy
+from app.routers.auth import get_current_user
+from app.schemas import OcrJobOut, OcrJobPageOut
+from app.streaming import NDJSON_MEDIA_TYPE, ndjson_line
+
+
+router = APIRouter(prefix="/ocr/jobs", tags=["jobs"])
+
+IMAGE_TYPES = ("image/png", "image/jpeg", "image/jpg", "image/webp")
+
+
+async def _get_job(db: AsyncSession, job_id: str, user: User) -> OcrJob:
+    job = await db.get(OcrJob, job_id)
+    if job is None or job.user_id != user.id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    return job
+
+
+@router.post("", response_model=OcrJobOut, status_code=status.HTTP_202_ACCEPTED)
+async def create_job(
+    response: Response,
+    file: UploadFile = File(...),
+    prompt: str | None = Form(default=None),
+    render: str | None = Form(default=None),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    if file.content_type in IMAGE_TYPES:
+        kind, limit, render = "image", settings.MAX_IMAGE_UPLOAD_BYTES, None
+    elif file.content_type == "application/pdf":
+        kind, limit = "pdf", settings.MAX_PDF_UPLOAD_BYTES
+        try:
+            render = str(parse_render_policy(render))
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail=str(exc))
+    else:
+        raise HTTPException(status_code=400, detail="Only PNG/JPEG/WEBP images and PDF are supported")
+    if file.size is not None and file.size > limit:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds the {limit} byte limit")
+    prompt_text = (prompt or "").strip() or settings.LLM_PROMPT
+
+    file.file.seek(0)
+    staged, content_hash, size = await sync_to_async(blob_store.stage_file, thread_sensitive=False)(file.file)
+    key = dedup_key(kind, content_hash, prompt_text, render)
+    existing = await db.scalar(
+        select(OcrJob)
+        .where(
+            OcrJob.user_id == current_user.id,
+            OcrJob.dedup_key == key,
+            OcrJob.status.in_(("queued", "running", "succeeded")),
+        )
+        .order_by(OcrJob.created_at.desc())
+        .limit(1)
+    )
+    if existing is not None:
+        # The existing job has (or had) its own copy of the upload
+        await sync_to_async(blob_store.discard, thread_sensitive=False)(staged)
+        OCR_JOBS_SUBMITTED_TOTAL.labels(kind=kind, deduplicated="true").inc()
+        response.status_code = status.HTTP_200_OK
+        return OcrJobOut.model_validate(existing).model_copy(update={"deduplicated": True})
+
+    async with blob_lock(content_hash):
+        await sync_to_async(blob_store.commit, thread_sensitive=False)(staged, content_hash)
+        total_pages = 1
+        if kind == "pdf":
+            total_pages = await run_cpu(pdf_page_count, blob_store.path(content_hash))
+            if not total_pages:
+                await release_blob(content_hash, locked=True)
+                raise HTTPException(
+                    status_code=400, detail="PDF parsing failed: pypdfium2 not available or could not render pages."
+                )
+
+        job = OcrJob(
+            id=new_job_id(),
+            user_id=current_user.id,
+            kind=kind,
+            status="queued",
+            content_hash=content_hash,
+            media_type=file.content_type,
+            filename=(file.filename or "")[:256] or None,
+            prompt=prompt_text,
+            render=render,
+            dedup_key=key,
+            input_bytes=size,
+            total_pages=total_pages,
+            done_pages=0,
+            failed_pages=0,
+            attempts=0,
+        )
+        db.add(job)
+        await db.commit()
+    OCR_JOBS_SUBMITTED_TOTAL.labels(kind=kind, deduplicated="false").inc()
+    job_runner.notify()
+    return job
+
+
+@router.get("", response_model=list[OcrJobOut])
+async def list_jobs(
+    limit: int = Query(50, ge=1, le=500),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    result = await db.scalars(
+        select(OcrJob).where(OcrJob.user_id == current_user.id).order_by(OcrJob.created_at.desc()).limit(limit)
+    )
+    return result.all()
+
+
+@router.get("/{job_id}", response_model=OcrJobOut)
+async def get_job(job_id: str, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    return await _get_job(db, job_id, current_user)
+
+
+@router.get("/{job_id}/pages", response_model=list[OcrJobPageOut])
+async def get_job_pages(
+    job_id: str,
+    from_page: int = Query(1, ge=1),
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    await _get_job(db, job_id, current_user)
+    result = await db.scalars(
+        select(OcrJobPage)
+        .where(OcrJobPage.job_id == job_id, OcrJobPage.page >= from_page)
+        .order_by(OcrJobPage.page)
+        .limit(limit)
+    )
+    return result.all()
+
+
+@router.delete("/{job_id}", response_model=OcrJobOut)
+async def cancel_job(job_id: str, current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    job = await _get_job(db, job_id, current_user)
+    if job.status in TERMINAL_STATUSES:
+        return job
+    was_queued = job.status == "queued"
+    await db.execute(
+        update(OcrJob)
+        .where(OcrJob.id == job_id, OcrJob.status.in_(("queued", "running")))
+        .values(status="cancelled", finished_at=datetime.utcnow(), lease_owner=None, lease_expires_at=None)
+    )
+    await db.commit()
+    await db.refresh(job)
+    # A running job is stopped here or, if another process runs it, at its next lease renewal
+    job_runner.cancel(job_id)
+    if was_queued:
+        await release_blob(job.content_hash)
+        job_runner.events.publish(job_id, {"type": "end", "status": "cancelled"})
+    return job
+
+
+@router.get("/{job_id}/events")
+async def job_events(
+    job_id: str,
+    offset: int = Query(0, ge=0, description="Finished pages already received; they are not replayed"),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """NDJSON stream of a job: stored pages first (in completion order), then live events until it ends."""
+    job = await _get_job(db, job_id, current_user)
+    kind = job.kind
+
+    async def stored_pages(final: dict[int, str]) -> list[dict]:
+        """Events for stored pages not yet sent in their current state; ``final`` maps page -> status sent."""
+        async with AsyncSessionLocal() as session:
+            rows = (
+                await session.scalars(
+                    select(OcrJobPage)
+                    .where(OcrJobPage.job_id == job_id)
+                    .order_by(OcrJobPage.finished_at, OcrJobPage.page)
+                    .offset(offset)
+                )
+            ).all()
+        events = []
+        for row in rows:
+            if final.get(row.page) == row.status:
+                continue
+            final[row.page] = row.status
+            events.extend(page_events(row))
+        return events
+
+    async def current_state():
+        async with AsyncSessionLocal() as session:
+            current = await session.get(OcrJob, job_id)
+            return current, await job_usage(session, current)
+
+    async def generator_ndjson():
+        queue, partial = job_runner.events.subscribe(job_id)
+        try:
+            final: dict[int, str] = {}
+            streaming: set[int] = set()
+            current, _ = await current_state()
+            yield ndjson_line({"type": "start", "kind": kind, "pages": current.total_pages, "job_id": job_id,
+                               "status": current.status})
+            for event in await stored_pages(final):
+                yield ndjson_line(event)
+            # Pages in progress when we attached: their text so far, then live deltas
+            for page, text in sorted(partial.items()):
+                if final.get(page) == "done":
+                    continue
+                streaming.add(page)
+                yield ndjson_line({"type": "page_start", "page": page})
+                if text:
+                    yield ndjson_line({"type": "page_delta", "page": page, "delta": text})
+
+            while True:
+                if current.status in TERMINAL_STATUSES and queue.empty():
+                    for event in await stored_pages(final):
+                        yield ndjson_line(event)
+                    current, usage = await current_state()
+                    end = {"type": "end", "status": current.status, "usage": usage}
+                    if current.error:
+                        end["error"] = current.error
+                    yield ndjson_line(end)
+                    return
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=settings.JOB_POLL_INTERVAL_SECONDS)
+                except asyncio.TimeoutError:
+                    # Nothing live (the job may be running in another process): catch up from the database
+                    for stored in await stored_pages(final):
+                        yield ndjson_line(stored)
+                    current, _ = await current_state()
+                    continue
+                etype, page = event["type"], event.get("page")
+                if etype == "end":
+                    current, _ = await current_state()
+                    continue
+                if etype == "status":
+                    yield ndjson_line(event)
+                    continue
+                if final.get(page) == "done":
+                    continue
+                if etype == "page_start":
+                    if page in streaming:
+                        continue
+                    streaming.add(page)
+                elif etype == "page_delta" and page not in streaming:
+                    streaming.add(page)
+                    yield ndjson_line({"type": "page_start", "page": page})
+                elif etype == "page_end":
+                    streaming.discard(page)
+                    final[page] = "failed" if event.get("error") else "done"
+                yield ndjson_line(event)
+        finally:
+            job_runner.events.unsubscribe(job_id, queue)
+
+    return StreamingResponse(generator_ndjson(), media_type=NDJSON_MEDIA_TYPE)
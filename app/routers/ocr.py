@@ -1,292 +1,1186 @@
-import base64
-import io
-import json
-from typing import AsyncGenerator, Optional
+import os
+import shutil
+import tempfile
 import asyncio
+import json
+import logging
+import time
+from typing import AsyncIterator, Callable, Literal, Optional
 
-from fastapi import APIRouter, Depends, File, Form, HTTPException, UploadFile
+from fastapi import APIRouter, Depends, File, Form, HTTPException, Request, UploadFile, WebSocket, status
 from fastapi.responses import StreamingResponse
-from sqlalchemy.ext.asyncio import AsyncSession
 from asgiref.sync import sync_to_async
 
+from app.admission import AdmissionRejected, admission
+from app.blob_store import blob_lock, blob_store, release_blob
+from app.checkpoints import checkpoints_enabled, get_document, load_checkpoints, open_document, save_checkpoint
 from app.core.config import settings
-from app.db import get_db
-from app.models import UsageEvent, User
-from app.ocr_client import get_client
-from app.routers.auth import get_current_user
-from app.metrics import approx_tokens_from_chars, ocr_metrics_span
+from app.image_batch import BatchTooLarge, ImageBatch, build_batch
+from app.imaging import (
+    PageEncoding,
+    pdf_page_count,
+    pdf_page_text,
+    release_pdf,
+    render_pdf_page,
+    run_cpu,
+    split_image,
+    usable_text_layer,
+)
+from app.models import User
+from app.ocr_pipeline import engine_extra_body, ocr_stream, prepare_image, record_usage
+from app.page_dedup import PageResult, new_stream_id, page_triage
+from app.render_policy import parse_render_policy
+from app.routers.auth import get_current_user, user_from_token
+from app.metrics import (
+    OCR_PDF_PAGE_SOURCE_TOTAL,
+    OCR_TEXT_LAYER_SECONDS,
+    approx_tokens_from_chars,
+    observe_page_encoding,
+    ocr_metrics_span,
+)
+from app.streaming import (
+    NDJSON_MEDIA_TYPE,
+    SSE_MEDIA_TYPE,
+    Encoder,
+    PageStream,
+    ndjson_line,
+    sse_event,
+    wants_sse,
+)
+from app.tiling import stitch
+from app.timings import Timings
+
 
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix="/ocr", tags=["ocr"])
 
+IMAGE_TYPES = ("image/png", "image/jpeg", "image/jpg", "image/webp")
+StreamOrder = Literal["completion", "page"]
+TextLayerMode = Literal["auto", "ocr", "text"]
+TilingMode = Literal["off", "auto", "on"]
+# An event stream waiting for its encoder: NDJSON, SSE or WebSocket frames
+EventStream = Callable[[Encoder], AsyncIterator[bytes]]
 
-async def _stream_openai_chat(messages, extra_body=None, usage_ref: dict | None = None) -> AsyncGenerator[str, None]:
-    """Async generator yielding content deltas via OpenAI streaming.
-    Attempts to fill usage_ref with real token usage from the SDK.
-    """
-    client = get_client()
-    stream = await client.chat.completions.create(
-        model=settings.LLM_MODEL,
-        messages=messages,
-        stream=True,
-        temperature=0.0,
-        stream_options={"include_usage": True},
-        extra_body=extra_body or {},
-    )
-    async for chunk in stream:
-        if not chunk.choices:
-            continue
-        delta = chunk.choices[0].delta  # type: ignore[attr-defined]
-        if hasattr(delta, "content") and delta.content:
-            yield delta.content
-        # If usage is present on the chunk (when include_usage enabled), capture it
-        if usage_ref is not None and hasattr(chunk, "usage") and getattr(chunk, "usage") is not None:  # type: ignore[attr-defined]
-            try:
-                u = getattr(chunk, "usage")
-                pt = int(getattr(u, "prompt_tokens", 0) or 0)
-                ct = int(getattr(u, "completion_tokens", 0) or 0)
-                usage_ref["prompt_tokens"] = pt
-                usage_ref["completion_tokens"] = ct
-            except Exception:
-                pass
-    # After stream ends, try to get final response usage if SDK supports it
-    if usage_ref is not None and hasattr(stream, "get_final_response"):
+
+def _check_admission() -> None:
+    try:
+        admission.check()
+    except AdmissionRejected as exc:
+        raise HTTPException(status_code=exc.status_code, detail=exc.detail, headers=exc.headers)
+
+
+def _check_upload_size(file: UploadFile, limit: int) -> None:
+    # The middleware already caps the whole request body; this is the exact per-file check.
+    if file.size is not None and file.size > limit:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds the {limit} byte limit")
+
+
+def _stream_response(request: Request, events: EventStream) -> StreamingResponse:
+    """NDJSON by default; Server-Sent Events when the client accepts ``text/event-stream``."""
+    if wants_sse(request.headers.get("accept")):
+        # no-cache and X-Accel-Buffering keep proxies (nginx) from buffering the stream
+        return StreamingResponse(
+            events(sse_event), media_type=SSE_MEDIA_TYPE, headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+    return StreamingResponse(events(ndjson_line), media_type=NDJSON_MEDIA_TYPE)
+
+
+def _show_timings(requested: bool | None) -> bool:
+    return settings.OCR_EVENT_TIMINGS if requested is None else requested
+
+
+def _timed(event: dict, unit: Timings, show: bool) -> dict:
+    """Finish ``unit``'s timings; the event carries them as ``timings`` if the request asked for them."""
+    block = unit.finish()
+    if show:
+        event["timings"] = block
+    return event
+
+
+def _finishing(events: EventStream, timings: Timings) -> EventStream:
+    """``events``, finishing the request's timings however the stream ends (e.g. the client going away)."""
+
+    async def generator(encode: Encoder):
         try:
-            final = await stream.get_final_response()  # type: ignore[attr-defined]
-            if final is not None and getattr(final, "usage", None) is not None:
-                u = final.usage
-                usage_ref["prompt_tokens"] = int(getattr(u, "prompt_tokens", 0) or 0)
-                usage_ref["completion_tokens"] = int(getattr(u, "completion_tokens", 0) or 0)
-        except Exception:
-            pass
-
-
-async def _record_usage(
-    db: AsyncSession,
-    user: User,
-    kind: str,
-    prompt_chars: int,
-    completion_chars: int,
-    prompt_tokens: int = 0,
-    completion_tokens: int = 0,
-    input_bytes: int = 0,
-    meta: Optional[str] = None,
-):
-    evt = UsageEvent(
-        user_id=user.id,
-        kind=kind,
-        prompt_chars=prompt_chars,
-        completion_chars=completion_chars,
-        prompt_tokens=prompt_tokens,
-        completion_tokens=completion_tokens,
-        input_bytes=input_bytes,
-        meta=meta,
-    )
-    db.add(evt)
-    await db.commit()
+            async for chunk in events(encode):
+                yield chunk
+        finally:
+            timings.finish()
+
+    return generator
+
+
+def _page_error_event(page: int, error, completion_chars: int = 0) -> dict:
+    """``page_end`` event for a page that failed, so the stream still accounts for every page."""
+    return {
+        "type": "page_end",
+        "page": page,
+        "error": str(error) or type(error).__name__,
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "completion_chars": completion_chars},
+    }
 
 
 @router.post("/image")
 async def ocr_image(
+    request: Request,
     file: UploadFile = File(...),
     prompt: str | None = Form(default=None),
+    tiling: TilingMode | None = Form(default=None),
+    timings: bool | None = Form(default=None),
     current_user: User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db),
 ):
-    if file.content_type not in ("image/png", "image/jpeg", "image/jpg", "image/webp"):
+    if file.content_type not in IMAGE_TYPES:
         raise HTTPException(status_code=400, detail="Only PNG/JPEG/WEBP images are supported")
-    content = await file.read()
-    input_b64 = base64.b64encode(content).decode("utf-8")
-    media_type = file.content_type
+    _check_upload_size(file, settings.MAX_IMAGE_UPLOAD_BYTES)
+    _check_admission()
+    request_timings = Timings("image", "ocr.image")
+    with request_timings.measure("upload"):
+        content = await file.read()
     prompt_text = (prompt or "").strip() or settings.LLM_PROMPT
+    return _stream_response(
+        request,
+        _image_stream(
+            current_user, content, file.content_type, prompt_text, tiling, _show_timings(timings), request_timings
+        ),
+    )
 
-    messages = [
-        {
-            "role": "user",
-            "content": [
-                {"type": "text", "text": prompt_text},
-                {"type": "image_url", "image_url": {"url": f"data:{media_type};base64,{input_b64}"}},
-            ],
-        }
-    ]
-
-    extra_body = {
-        "vllm_xargs": {"ngram_size": 30, "window_size": 90},
-        "skip_special_tokens": False,
-    }
+
+def _image_stream(
+    current_user: User,
+    content: bytes,
+    media_type: str,
+    prompt_text: str,
+    tiling: str | None = None,
+    show_timings: bool = False,
+    timings: Optional[Timings] = None,
+) -> EventStream:
+    extra_body = engine_extra_body()
+    tiling = tiling or settings.IMAGE_TILING
+    timings = timings or Timings("image", "ocr.image")
 
     prompt_chars = len(prompt_text)
     completion_chars_acc = 0
 
+    flow = f"{current_user.id}:image"
     span = ocr_metrics_span("image")
 
-    async def generator_ndjson():
+    async def generator(encode: Encoder):
         nonlocal completion_chars_acc
         usage: dict = {}
-        yield json.dumps({"type": "start", "kind": "image"}) + "\n"
-        async for piece in _stream_openai_chat(messages, extra_body=extra_body, usage_ref=usage):
-            completion_chars_acc += len(piece)
-            yield json.dumps({"type": "delta", "delta": piece}) + "\n"
-        prompt_tokens = int(usage.get("prompt_tokens") or 0) or approx_tokens_from_chars(prompt_chars)
-        completion_tokens = int(usage.get("completion_tokens") or 0) or approx_tokens_from_chars(completion_chars_acc)
-        await _record_usage(
-            db,
-            current_user,
+        info: dict = {}
+        try:
+            if tiling != "off":
+                try:
+                    with timings.measure("render"):
+                        tiles = await run_cpu(
+                            split_image,
+                            content,
+                            settings.IMAGE_TILE_SIZE,
+                            settings.IMAGE_TILE_OVERLAP,
+                            settings.IMAGE_MAX_TILES,
+                            settings.IMAGE_TILING_MIN_PIXELS if tiling == "auto" else None,
+                            PageEncoding.from_settings(),
+                        )
+                except Exception:
+                    tiles = []  # not decodable here; the engine gets the upload as it is
+                if len(tiles) > 1:
+                    async for chunk in tiled(encode, tiles):
+                        yield chunk
+                    return
+            yield encode({"type": "start", "kind": "image"})
+            image, image_type = await prepare_image(content, media_type, timings)
+            try:
+                async for piece in ocr_stream(image, image_type, prompt_text, extra_body, usage, flow, info, timings):
+                    completion_chars_acc += len(piece)
+                    yield encode({"type": "delta", "delta": piece})
+            except AdmissionRejected as exc:
+                yield encode({"type": "error", "error": exc.detail, "retry_after": exc.retry_after})
+                return
+            prompt_tokens = int(usage.get("prompt_tokens") or 0) or approx_tokens_from_chars(prompt_chars)
+            completion_tokens = int(usage.get("completion_tokens") or 0) or approx_tokens_from_chars(completion_chars_acc)
+            record_usage(
+                current_user.id,
+                kind="image",
+                prompt_chars=prompt_chars,
+                completion_chars=completion_chars_acc,
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                input_bytes=len(content),
+            )
+            span.finish(
+                input_bytes=len(content),
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+            )
+            end: dict = {
+                "type": "end",
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "prompt_chars": prompt_chars,
+                    "completion_chars": completion_chars_acc,
+                    "input_bytes": len(content),
+                },
+            }
+            if "cache" in info:
+                end["cache"] = info["cache"]
+            yield encode(_timed(end, timings, show_timings))
+        finally:
+            # Rejected, failed or abandoned by the client: what was streamed so far (no-op after a normal end)
+            span.finish(
+                input_bytes=len(content),
+                prompt_tokens=int(usage.get("prompt_tokens") or 0),
+                completion_tokens=int(usage.get("completion_tokens") or 0) or approx_tokens_from_chars(completion_chars_acc),
+            )
+
+    async def tiled(encode: Encoder, tiles: list):
+        """Tiles OCR'd concurrently and streamed as tile events; the stitched text follows as one delta."""
+        slots = asyncio.Semaphore(settings.IMAGE_TILES_IN_FLIGHT)
+        texts: dict[int, str] = {}
+        totals = {"prompt_tokens": 0, "completion_tokens": 0, "completion_chars": 0}
+        failed = 0
+        out = PageStream(
+            [t.box.index for t in tiles],
+            coalesce_chars=settings.STREAM_COALESCE_CHARS,
+            coalesce_seconds=settings.STREAM_COALESCE_MS / 1000,
+            max_buffer_bytes=settings.STREAM_BUFFER_MAX_BYTES,
+            encode=encode,
+            unit="tile",
+        )
+
+        async def worker(tile):
+            nonlocal failed
+            box = tile.box
+            pieces: list[str] = []
+            unit = Timings("image", "ocr.tile", parent=timings, tile=box.index)
+            try:
+                async with slots:
+                    await out.start(box.index, row=box.row, col=box.col, box=[box.left, box.top, box.right, box.bottom])
+                    usage: dict = {}
+                    async for piece in ocr_stream(
+                        tile.data, tile.media_type, prompt_text, extra_body, usage, flow, {}, unit
+                    ):
+                        pieces.append(piece)
+                        await out.delta(box.index, piece)
+            except asyncio.CancelledError:
+                unit.finish()
+                raise
+            except Exception as exc:
+                failed += 1
+                # Streamed before the failure: counted in the totals, so reported here as well
+                partial_chars = sum(len(p) for p in pieces)
+                totals["completion_chars"] += partial_chars
+                await out.end(box.index, _timed({
+                    "type": "tile_end",
+                    "tile": box.index,
+                    "error": str(exc) or type(exc).__name__,
+                    "usage": {"prompt_tokens": 0, "completion_tokens": 0, "completion_chars": partial_chars},
+                }, unit, show_timings))
+                return
+            text = "".join(pieces)
+            texts[box.index] = text
+            tile_usage = {
+                "prompt_tokens": int(usage.get("prompt_tokens") or 0) or approx_tokens_from_chars(prompt_chars),
+                "completion_tokens": int(usage.get("completion_tokens") or 0) or approx_tokens_from_chars(len(text)),
+                "completion_chars": len(text),
+            }
+            for key, value in tile_usage.items():
+                totals[key] += value
+            await out.end(box.index, _timed({"type": "tile_end", "tile": box.index, "usage": tile_usage}, unit, show_timings))
+
+        input_bytes = len(content)
+        rows = max(t.box.row for t in tiles) + 1
+        yield encode({"type": "start", "kind": "image", "tiles": len(tiles), "grid": [rows, len(tiles) // rows]})
+        tasks = [asyncio.create_task(worker(tile)) for tile in tiles]
+        try:
+            async for chunk in out.chunks():
+                yield chunk
+        finally:
+            for t in tasks:
+                if not t.done():
+                    t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            span.finish(
+                input_bytes=input_bytes,
+                prompt_tokens=totals["prompt_tokens"],
+                completion_tokens=totals["completion_tokens"],
+            )
+
+        text = stitch([t.box for t in tiles], texts)
+        if text:
+            yield encode({"type": "delta", "delta": text})
+        record_usage(
+            current_user.id,
             kind="image",
-            prompt_chars=prompt_chars,
-            completion_chars=completion_chars_acc,
-            prompt_tokens=prompt_tokens,
-            completion_tokens=completion_tokens,
-            input_bytes=len(content),
+            prompt_chars=prompt_chars * len(tiles),
+            completion_chars=totals["completion_chars"],
+            prompt_tokens=totals["prompt_tokens"],
+            completion_tokens=totals["completion_tokens"],
+            input_bytes=input_bytes,
+            meta=f"tiles={len(tiles)}",
+        )
+        yield encode(_timed({
+            "type": "end",
+            "usage": {**totals, "prompt_chars": prompt_chars * len(tiles), "input_bytes": input_bytes},
+            "tiles": len(tiles),
+            "failed_tiles": failed,
+        }, timings, show_timings))
+
+    return _finishing(generator, timings)
+
+
+@router.post("/images")
+async def ocr_images(
+    request: Request,
+    files: list[UploadFile] = File(...),
+    prompt: str | None = Form(default=None),
+    order: StreamOrder | None = Form(default=None),
+    timings: bool | None = Form(default=None),
+    current_user: User = Depends(get_current_user),
+):
+    """OCR many images in one request: image files and/or zip archives of images.
+
+    Items are numbered in upload order (zip entries in archive order) and
+    streamed like the pages of a PDF, with the item's ``name`` on its
+    ``page_start`` and ``page_end``; usage is recorded once for the batch.
+    """
+    _check_admission()
+    started = time.perf_counter()
+    uploads = [(f.filename, f.content_type, f.file) for f in files]
+    try:
+        batch = await sync_to_async(build_batch, thread_sensitive=False)(
+            uploads, settings.MAX_BATCH_UPLOAD_BYTES, settings.MAX_BATCH_ITEMS, settings.MAX_IMAGE_UPLOAD_BYTES
         )
-        span.finish(
-            input_bytes=len(content),
-            prompt_tokens=prompt_tokens,
-            completion_tokens=completion_tokens,
+    except BatchTooLarge as exc:
+        raise HTTPException(status_code=413, detail=exc.detail)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    if not batch.items:
+        await sync_to_async(batch.discard, thread_sensitive=False)()
+        raise HTTPException(status_code=400, detail="No images in the upload")
+    request_timings = Timings("images", "ocr.images", started=started, items=len(batch.items))
+    request_timings.add("upload", time.perf_counter() - started)
+    prompt_text = (prompt or "").strip() or settings.LLM_PROMPT
+    return _stream_response(
+        request, _images_stream(current_user, batch, prompt_text, order, _show_timings(timings), request_timings)
+    )
+
+
+def _images_stream(
+    current_user: User,
+    batch: ImageBatch,
+    prompt_text: str,
+    order: str | None,
+    show_timings: bool,
+    timings: Timings,
+) -> EventStream:
+    extra_body = engine_extra_body()
+    flow = f"{current_user.id}:image"
+    span = ocr_metrics_span("images")
+    items = batch.items
+
+    async def generator(encode: Encoder):
+        slots = asyncio.Semaphore(settings.BATCH_MAX_IMAGES_IN_FLIGHT)
+        tasks: set[asyncio.Task] = set()
+        totals = {"prompt_tokens": 0, "completion_tokens": 0, "completion_chars": 0}
+        ocr_items = 0
+        cached_items = 0
+        out = PageStream(
+            list(range(1, len(items) + 1)),
+            ordered=(order or settings.PDF_STREAM_ORDER) == "page",
+            coalesce_chars=settings.STREAM_COALESCE_CHARS,
+            coalesce_seconds=settings.STREAM_COALESCE_MS / 1000,
+            max_buffer_bytes=settings.STREAM_BUFFER_MAX_BYTES,
+            encode=encode,
         )
-        yield json.dumps({
+
+        async def worker(idx: int):
+            nonlocal ocr_items, cached_items
+            item = items[idx - 1]
+            completion_chars = 0
+            unit = Timings("images", "ocr.item", parent=timings, item=idx)
+            try:
+                await out.start(idx, name=item.name)
+                content = await sync_to_async(batch.read, thread_sensitive=False)(item)
+                image, image_type = await prepare_image(content, item.media_type, unit)
+                usage: dict = {}
+                info: dict = {}
+                ocr_items += 1
+                async for piece in ocr_stream(image, image_type, prompt_text, extra_body, usage, flow, info, unit):
+                    completion_chars += len(piece)
+                    await out.delta(idx, piece)
+                pt = int(usage.get("prompt_tokens") or 0) or approx_tokens_from_chars(len(prompt_text))
+                ct = int(usage.get("completion_tokens") or 0) or approx_tokens_from_chars(completion_chars)
+                totals["prompt_tokens"] += pt
+                totals["completion_tokens"] += ct
+                totals["completion_chars"] += completion_chars
+                if info.get("cache") == "hit":
+                    cached_items += 1
+                page_end = {
+                    "type": "page_end",
+                    "page": idx,
+                    "name": item.name,
+                    "usage": {"prompt_tokens": pt, "completion_tokens": ct, "completion_chars": completion_chars},
+                }
+                if "cache" in info:
+                    page_end["cache"] = info["cache"]
+                await out.end(idx, _timed(page_end, unit, show_timings))
+            except Exception as exc:
+                totals["completion_chars"] += completion_chars
+                await out.end(idx, _timed(
+                    {**_page_error_event(idx, exc, completion_chars), "name": item.name}, unit, show_timings
+                ))
+            finally:
+                unit.finish()
+                slots.release()
+
+        async def producer():
+            for idx, item in enumerate(items, start=1):
+                if item.error is not None:
+                    await out.start(idx, name=item.name)
+                    await out.end(idx, {**_page_error_event(idx, item.error), "name": item.name})
+                    continue
+                await slots.acquire()
+                task = asyncio.create_task(worker(idx))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+
+        producer_task = asyncio.create_task(producer())
+        try:
+            yield encode({"type": "start", "kind": "images", "items": len(items)})
+            async for chunk in out.chunks():
+                yield chunk
+        finally:
+            waiting = [producer_task, *tasks]
+            for t in waiting:
+                if not t.done():
+                    t.cancel()
+            await asyncio.gather(*waiting, return_exceptions=True)
+            await sync_to_async(batch.discard, thread_sensitive=False)()
+            span.finish(
+                input_bytes=batch.total_bytes,
+                prompt_tokens=totals["prompt_tokens"],
+                completion_tokens=totals["completion_tokens"],
+            )
+
+        prompt_chars = len(prompt_text) * ocr_items
+        if ocr_items:
+            record_usage(
+                current_user.id,
+                kind="images",
+                prompt_chars=prompt_chars,
+                completion_chars=totals["completion_chars"],
+                prompt_tokens=totals["prompt_tokens"],
+                completion_tokens=totals["completion_tokens"],
+                input_bytes=batch.total_bytes,
+                meta=f"items={ocr_items}" if ocr_items == len(items) else f"items={ocr_items}/{len(items)}",
+            )
+        yield encode(_timed({
             "type": "end",
             "usage": {
-                "prompt_tokens": prompt_tokens,
-                "completion_tokens": completion_tokens,
+                **totals,
                 "prompt_chars": prompt_chars,
-                "completion_chars": completion_chars_acc,
-                "input_bytes": len(content),
+                "input_bytes": batch.total_bytes,
+                "items": len(items),
+                "cached_items": cached_items,
             },
-        }) + "\n"
+        }, timings, show_timings))
 
-    return StreamingResponse(generator_ndjson(), media_type="application/x-ndjson; charset=utf-8")
+    return _finishing(generator, timings)
 
 
-def _pdf_to_images_sync(file_bytes: bytes):
-    """Sync conversion: PDF bytes -> list of PIL Images via pypdfium2. Returns [] if not available."""
-    try:
-        import pypdfium2 as pdfium  # type: ignore
-    except Exception:
-        return []
+def _write_temp_pdf(upload) -> tuple[str, int]:
+    """Copy the (spooled) upload to a named temp file in chunks; render workers open it by path.
 
-    pdf = pdfium.PdfDocument(io.BytesIO(file_bytes))
-    images = []
-    for page_index in range(len(pdf)):
-        page = pdf.get_page(page_index)
-        pil_image = page.render(scale=8).to_pil()
-        images.append(pil_image)
-        page.close()
-    pdf.close()
-    return images
+    Returns the path and the number of bytes written.
+    """
+    upload.seek(0)
+    with tempfile.NamedTemporaryFile(prefix="ocr-", suffix=".pdf", delete=False) as f:
+        shutil.copyfileobj(upload, f, 1024 * 1024)
+        return f.name, f.tell()
 
 
-async def _pdf_to_images(file_bytes: bytes):
-    return await sync_to_async(_pdf_to_images_sync, thread_sensitive=False)(file_bytes)
+def _discard_temp_pdf(path: str) -> None:
+    release_pdf(path)
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
 
 
 @router.post("/pdf")
 async def ocr_pdf(
+    request: Request,
     file: UploadFile = File(...),
     prompt: str | None = Form(default=None),
+    render: str | None = Form(default=None),
+    order: StreamOrder | None = Form(default=None),
+    text_layer: TextLayerMode | None = Form(default=None),
+    timings: bool | None = Form(default=None),
     current_user: User = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db),
 ):
     if file.content_type not in ("application/pdf",):
         raise HTTPException(status_code=400, detail="Only PDF is supported")
+    policy = _render_policy(render)
+    _check_upload_size(file, settings.MAX_PDF_UPLOAD_BYTES)
+    _check_admission()
+    stream = await _pdf_upload_stream(
+        current_user, file.file, prompt, policy, order, text_layer, show_timings=_show_timings(timings)
+    )
+    return _stream_response(request, stream)
 
-    content = await file.read()
-    images = await _pdf_to_images(content)
-    if not images:
-        # Backend does not support direct PDF input; conversion failed
-        raise HTTPException(status_code=400, detail="PDF parsing failed: pypdfium2 not available or could not render pages.")
 
+def _render_policy(render: str | None):
+    try:
+        return parse_render_policy(render)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+
+async def _pdf_upload_stream(
+    current_user: User,
+    upload,
+    prompt: str | None,
+    policy,
+    order: str | None,
+    text_layer: str | None,
+    control=None,
+    show_timings: bool = False,
+):
+    """Store an uploaded PDF and count its pages; the event stream that OCRs it."""
+    started = time.perf_counter()
+    upload.seek(0)
     prompt_text = (prompt or "").strip() or settings.LLM_PROMPT
-    extra_body = {
-        "vllm_xargs": {"ngram_size": 30, "window_size": 90},
-        "skip_special_tokens": False,
-    }
+    text_layer = text_layer or settings.PDF_TEXT_LAYER
+    document = None
+    if checkpoints_enabled():
+        # Kept in the blob store so the stream can be resumed without uploading again
+        staged, content_hash, input_bytes = await sync_to_async(blob_store.stage_file, thread_sensitive=False)(upload)
+        uploaded = time.perf_counter()
+        async with blob_lock(content_hash):
+            await sync_to_async(blob_store.commit, thread_sensitive=False)(staged, content_hash)
+            pdf_path, temporary = blob_store.path(content_hash), False
+            total_pages = await run_cpu(pdf_page_count, pdf_path)
+            if not total_pages:
+                await release_blob(content_hash, locked=True)
+                raise HTTPException(
+                    status_code=400, detail="PDF parsing failed: pypdfium2 not available or could not render pages."
+                )
+            document = await open_document(
+                current_user.id, content_hash, prompt_text, str(policy), text_layer, total_pages, input_bytes
+            )
+    else:
+        pdf_path, input_bytes = await sync_to_async(_write_temp_pdf, thread_sensitive=False)(upload)
+        temporary = True
+        uploaded = time.perf_counter()
+        total_pages = await run_cpu(pdf_page_count, pdf_path)
+        if not total_pages:
+            await sync_to_async(_discard_temp_pdf, thread_sensitive=False)(pdf_path)
+            # Backend does not support direct PDF input; conversion failed
+            raise HTTPException(
+                status_code=400, detail="PDF parsing failed: pypdfium2 not available or could not render pages."
+            )
+    timings = Timings("pdf", "ocr.pdf", started=started, pages=total_pages)
+    timings.add("upload", uploaded - started)
+    return _pdf_stream(
+        current_user, pdf_path, temporary, total_pages, input_bytes, policy, prompt_text, document,
+        order=order, text_layer=text_layer, control=control, show_timings=show_timings, timings=timings,
+    )
+
+
+@router.post("/pdf/resume")
+async def resume_pdf(
+    request: Request,
+    document_id: str = Form(...),
+    offset: int = Form(default=0, ge=0),
+    after_page: int = Form(default=0, ge=0),
+    order: StreamOrder | None = Form(default=None),
+    timings: bool | None = Form(default=None),
+    current_user: User = Depends(get_current_user),
+):
+    """Resume an interrupted ``/ocr/pdf`` stream by its ``document_id``.
+
+    Finished pages are replayed from their checkpoints, in the order they
+    originally finished, except the first ``offset`` of them and any page up
+    to ``after_page``, which the client already has; only the missing pages
+    are sent to the engine.
+    """
+    stream = await _pdf_resume_stream(
+        current_user, document_id, offset, after_page, order, show_timings=_show_timings(timings)
+    )
+    return _stream_response(request, stream)
+
+
+async def _pdf_resume_stream(
+    current_user: User,
+    document_id: str,
+    offset: int,
+    after_page: int,
+    order: str | None,
+    control=None,
+    show_timings: bool = False,
+):
+    document = await get_document(document_id, current_user.id)
+    if document is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired document")
+    pdf_path = blob_store.path(document.content_hash)
+    if not await sync_to_async(blob_store.exists, thread_sensitive=False)(document.content_hash):
+        raise HTTPException(status_code=410, detail="The document is no longer stored; upload it again")
+    _check_admission()
+    return _pdf_stream(
+        current_user,
+        pdf_path,
+        False,
+        document.total_pages,
+        document.input_bytes,
+        parse_render_policy(document.render),
+        document.prompt,
+        document,
+        offset=offset,
+        after_page=after_page,
+        resumed=True,
+        order=order,
+        text_layer=document.text_layer,
+        control=control,
+        show_timings=show_timings,
+    )
+
+
+def _checkpoint_events(row) -> list[dict]:
+    events = [{"type": "page_start", "page": row.page}]
+    if row.text:
+        events.append({"type": "page_delta", "page": row.page, "delta": row.text})
+    events.append({
+        "type": "page_end",
+        "page": row.page,
+        "usage": {
+            "prompt_tokens": row.prompt_tokens,
+            "completion_tokens": row.completion_tokens,
+            "completion_chars": row.completion_chars,
+        },
+        "checkpoint": True,
+    })
+    return events
+
 
+class PageControl:
+    """Cancels single pages of a running PDF stream (used by the WebSocket transport)."""
+
+    def __init__(self):
+        self.cancelled: set[int] = set()
+        self.tasks: dict[int, asyncio.Task] = {}
+
+    def cancel(self, page: int) -> None:
+        self.cancelled.add(page)
+        task = self.tasks.get(page)
+        if task is not None:
+            task.cancel()
+
+
+def _pdf_stream(
+    current_user: User,
+    pdf_path: str,
+    temporary: bool,
+    total_pages: int,
+    input_bytes: int,
+    policy,
+    prompt_text: str,
+    document,
+    offset: int = 0,
+    after_page: int = 0,
+    resumed: bool = False,
+    order: str | None = None,
+    text_layer: str = "ocr",
+    control: Optional[PageControl] = None,
+    show_timings: bool = False,
+    timings: Optional[Timings] = None,
+) -> EventStream:
+    extra_body = engine_extra_body()
+    timings = timings or Timings("pdf", "ocr.pdf", pages=total_pages, resumed=resumed)
+    encoding = PageEncoding.from_settings()
+    flow = f"{current_user.id}:pdf"
     span = ocr_metrics_span("pdf")
+    analyze = page_triage.enabled
+    # Pages only count as duplicates of pages OCR'd with the same user, prompt and render policy
+    scope = (current_user.id, prompt_text, str(policy), settings.LLM_MODEL)
+    stream_id = new_stream_id()
 
-    async def generator_pages_parallel_ndjson():
-        queue: asyncio.Queue = asyncio.Queue(maxsize=64)
-        pages = list(enumerate(images, start=1))
+    async def generator_pages_parallel(encode: Encoder):
+        # At most PDF_MAX_PAGES_IN_FLIGHT pages are rendered or being OCR'd at any time,
+        # so peak memory is bounded by that cap rather than by the page count.
+        slots = asyncio.Semaphore(settings.PDF_MAX_PAGES_IN_FLIGHT)
+        tasks: set[asyncio.Task] = set()
         total_completion_chars = 0
         total_prompt_tokens = 0
         total_completion_tokens = 0
+        cached_pages = 0
+        skipped_pages = 0
+        text_layer_pages = 0
 
-        async def worker(idx: int, img):
-            nonlocal total_completion_chars, total_prompt_tokens, total_completion_tokens
-            await queue.put({"type": "page_start", "page": idx})
-            buf = io.BytesIO()
-            await sync_to_async(img.save, thread_sensitive=False)(buf, "PNG")
-            b64 = base64.b64encode(buf.getvalue()).decode("utf-8")
-            messages = [
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt_text},
-                        {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{b64}"}},
-                    ],
-                }
-            ]
-            usage: dict = {}
+        checkpoints = await load_checkpoints(document.id) if document is not None else []
+        finished = {row.page for row in checkpoints}
+        replay = [row for i, row in enumerate(checkpoints) if i >= offset and row.page > after_page]
+        pending = [idx for idx in range(1, total_pages + 1) if idx not in finished]
+        # Usage of checkpointed pages is reported in the end event but not billed again
+        replay_usage = {"prompt_tokens": 0, "completion_tokens": 0, "completion_chars": 0}
+        for row in checkpoints:
+            replay_usage["prompt_tokens"] += row.prompt_tokens
+            replay_usage["completion_tokens"] += row.completion_tokens
+            replay_usage["completion_chars"] += row.completion_chars
+        out = PageStream(
+            [row.page for row in replay] + pending,
+            ordered=(order or settings.PDF_STREAM_ORDER) == "page",
+            coalesce_chars=settings.STREAM_COALESCE_CHARS,
+            coalesce_seconds=settings.STREAM_COALESCE_MS / 1000,
+            max_buffer_bytes=settings.STREAM_BUFFER_MAX_BYTES,
+            encode=encode,
+        )
+
+        async def checkpoint(idx: int, unit: Timings, text: str, page_usage: dict, cached: bool) -> None:
+            if document is not None:
+                with unit.measure("db"):
+                    await save_checkpoint(document.id, idx, text, page_usage, cached)
+
+        async def skip_page(idx: int, unit: Timings, reason: str, original: Optional[PageResult] = None) -> None:
+            """Answer a page without the engine: nothing for a blank page, the original's text for a duplicate."""
+            nonlocal skipped_pages
+            skipped_pages += 1
+            text = original.text if original is not None else ""
+            if text:
+                await out.delta(idx, text)
+            page_usage = {"prompt_tokens": 0, "completion_tokens": 0, "completion_chars": len(text)}
+            await checkpoint(idx, unit, text, page_usage, False)
+            page_end = {"type": "page_end", "page": idx, "usage": page_usage, "skipped": reason}
+            if original is not None:
+                page_end["duplicate_of"] = {"page": original.page, "same_document": original.stream_id == stream_id}
+            await out.end(idx, _timed(page_end, unit, show_timings))
+
+        async def text_layer_of(idx: int, unit: Timings) -> Optional[str]:
+            """The page's embedded text if the mode says to use it; None if the page goes to the engine."""
+            try:
+                with unit.measure("extract"):
+                    page_text = await run_cpu(pdf_page_text, pdf_path, idx - 1)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                if text_layer == "text":
+                    raise ValueError("text layer could not be read")
+                return None
+            OCR_TEXT_LAYER_SECONDS.observe(page_text.extract_seconds)
+            if text_layer == "auto" and not usable_text_layer(page_text, settings.PDF_TEXT_LAYER_MIN_CHARS):
+                return None
+            return page_text.text
+
+        async def text_page(idx: int, unit: Timings, text: str) -> None:
+            nonlocal text_layer_pages
+            OCR_PDF_PAGE_SOURCE_TOTAL.labels(source="text_layer").inc()
+            text_layer_pages += 1
+            if text:
+                await out.delta(idx, text)
+            page_usage = {"prompt_tokens": 0, "completion_tokens": 0, "completion_chars": len(text)}
+            await checkpoint(idx, unit, text, page_usage, False)
+            page_end = {"type": "page_end", "page": idx, "usage": page_usage, "source": "text_layer"}
+            await out.end(idx, _timed(page_end, unit, show_timings))
+
+        async def worker(idx: int):
+            nonlocal total_completion_chars, total_prompt_tokens, total_completion_tokens, cached_pages
             local_completion = 0
-            async for piece in _stream_openai_chat(messages, extra_body=extra_body, usage_ref=usage):
-                local_completion += len(piece)
-                await queue.put({"type": "page_delta", "page": idx, "delta": piece})
-            pt = int(usage.get("prompt_tokens") or 0) or approx_tokens_from_chars(len(prompt_text))
-            ct = int(usage.get("completion_tokens") or 0) or approx_tokens_from_chars(local_completion)
-            total_prompt_tokens += pt
-            total_completion_tokens += ct
-            total_completion_chars += local_completion
-            await queue.put({"type": "page_end", "page": idx, "usage": {"prompt_tokens": pt, "completion_tokens": ct, "completion_chars": local_completion}})
-
-        tasks = [asyncio.create_task(worker(idx, img)) for idx, img in pages]
-
-        done_pages = 0
-        yield json.dumps({"type": "start", "kind": "pdf", "pages": len(pages)}) + "\n"
+            started = False
+            claim = None
+            unit = Timings("pdf", "ocr.page", parent=timings, page=idx)
+            try:
+                if text_layer != "ocr":
+                    text = await text_layer_of(idx, unit)
+                    if text is not None:
+                        await out.start(idx)
+                        started = True
+                        await text_page(idx, unit, text)
+                        return
+                try:
+                    page = await run_cpu(render_pdf_page, pdf_path, idx - 1, policy, encoding, analyze)
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    page = None
+                await out.start(idx)
+                started = True
+                if page is None:
+                    await out.end(idx, _timed(_page_error_event(idx, "page could not be rendered"), unit, show_timings))
+                    return
+                unit.add("render", page.render_seconds)
+                unit.add("encode", page.encode_seconds)
+                observe_page_encoding(encoding.format, page.encode_seconds, len(page.data))
+                if page.signature is not None:
+                    if page_triage.is_blank(page.signature):
+                        await skip_page(idx, unit, "blank")
+                        return
+                    original = await page_triage.duplicate_of(scope, page.signature, stream_id, idx)
+                    if original is not None:
+                        await skip_page(idx, unit, "duplicate", original)
+                        return
+                    claim = page_triage.claim(scope, page.signature, stream_id, idx)
+                usage: dict = {}
+                info: dict = {}
+                pieces: list[str] = []
+                OCR_PDF_PAGE_SOURCE_TOTAL.labels(source="engine").inc()
+                engine_started = time.perf_counter()
+                async for piece in ocr_stream(
+                    page.data, page.media_type, prompt_text, extra_body, usage, flow, info, unit
+                ):
+                    local_completion += len(piece)
+                    pieces.append(piece)
+                    await out.delta(idx, piece)
+                pt = int(usage.get("prompt_tokens") or 0) or approx_tokens_from_chars(len(prompt_text))
+                ct = int(usage.get("completion_tokens") or 0) or approx_tokens_from_chars(local_completion)
+                total_prompt_tokens += pt
+                total_completion_tokens += ct
+                total_completion_chars += local_completion
+                if info.get("cache") == "hit":
+                    cached_pages += 1
+                page_usage = {"prompt_tokens": pt, "completion_tokens": ct, "completion_chars": local_completion}
+                text = "".join(pieces)
+                engine_seconds = 0.0 if info.get("cache") == "hit" else time.perf_counter() - engine_started
+                page_triage.finish(claim, PageResult(text, idx, stream_id, engine_seconds))
+                claim = None
+                await checkpoint(idx, unit, text, page_usage, info.get("cache") == "hit")
+                page_end = {"type": "page_end", "page": idx, "usage": page_usage}
+                if "cache" in info:
+                    page_end["cache"] = info["cache"]
+                await out.end(idx, _timed(page_end, unit, show_timings))
+            except asyncio.CancelledError:
+                page_triage.fail(claim)
+                if control is None or idx not in control.cancelled:
+                    raise
+                # The client cancelled this page only; the rest of the document goes on
+                total_completion_chars += local_completion
+                if not started:
+                    await out.start(idx)
+                await out.end(idx, _timed(_page_error_event(idx, "cancelled", local_completion), unit, show_timings))
+            except Exception as exc:
+                page_triage.fail(claim)
+                total_completion_chars += local_completion
+                if not started:
+                    await out.start(idx)
+                await out.end(idx, _timed(_page_error_event(idx, exc, local_completion), unit, show_timings))
+            finally:
+                unit.finish()
+                slots.release()
+
+        async def producer():
+            # Pages are rendered lazily: a page is only rasterized once a slot frees up.
+            for idx in pending:
+                if control is not None and idx in control.cancelled:
+                    await out.start(idx)
+                    await out.end(idx, _page_error_event(idx, "cancelled"))
+                    continue
+                await slots.acquire()
+                task = asyncio.create_task(worker(idx))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                if control is not None:
+                    control.tasks[idx] = task
+                    task.add_done_callback(lambda _, idx=idx: control.tasks.pop(idx, None))
+
+        for row in replay:
+            out.replay(row.page, _checkpoint_events(row))
+        producer_task = asyncio.create_task(producer())
+
+        start = {"type": "start", "kind": "pdf", "pages": total_pages, "render": str(policy), "text_layer": text_layer}
+        if document is not None:
+            start.update(document_id=document.id, checkpointed_pages=len(checkpoints))
+        if resumed:
+            start["resumed"] = True
         try:
-            while done_pages < len(pages):
-                item = await queue.get()
-                if isinstance(item, dict):
-                    yield json.dumps(item) + "\n"
-                    if item.get("type") == "page_end":
-                        done_pages += 1
+            yield encode(start)
+            async for chunk in out.chunks():
+                yield chunk
         finally:
-            for t in tasks:
+            waiting = [producer_task, *tasks]
+            for t in waiting:
                 if not t.done():
                     t.cancel()
-            await asyncio.gather(*tasks, return_exceptions=True)
+            await asyncio.gather(*waiting, return_exceptions=True)
+            if temporary:
+                await sync_to_async(_discard_temp_pdf, thread_sensitive=False)(pdf_path)
+            else:
+                await sync_to_async(release_pdf, thread_sensitive=False)(pdf_path)
+            ocr_pages = len(pending) - skipped_pages - text_layer_pages
+            prompt_chars_total = len(prompt_text) * max(1, ocr_pages)
+            prompt_tokens = total_prompt_tokens or approx_tokens_from_chars(prompt_chars_total)
+            completion_tokens = total_completion_tokens or approx_tokens_from_chars(total_completion_chars)
+            span.finish(
+                input_bytes=0 if resumed else input_bytes,
+                prompt_tokens=prompt_tokens if ocr_pages > 0 else 0,
+                completion_tokens=completion_tokens if ocr_pages > 0 else 0,
+            )
 
-        prompt_chars_total = len(prompt_text) * max(1, len(images))
-        prompt_tokens = total_prompt_tokens or approx_tokens_from_chars(prompt_chars_total)
-        completion_tokens = total_completion_tokens or approx_tokens_from_chars(total_completion_chars)
-        await _record_usage(
-            db,
-            current_user,
-            kind="pdf",
-            prompt_chars=prompt_chars_total,
-            completion_chars=total_completion_chars,
-            prompt_tokens=prompt_tokens,
-            completion_tokens=completion_tokens,
-            input_bytes=len(content),
-            meta=f"pages={len(images)}",
-        )
-        span.finish(
-            input_bytes=len(content),
-            prompt_tokens=prompt_tokens,
-            completion_tokens=completion_tokens,
-        )
-        yield json.dumps({
+        if ocr_pages > 0:
+            record_usage(
+                current_user.id,
+                kind="pdf",
+                prompt_chars=prompt_chars_total,
+                completion_chars=total_completion_chars,
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                input_bytes=0 if resumed else input_bytes,
+                meta=f"pages={ocr_pages}" if ocr_pages == total_pages else f"pages={ocr_pages}/{total_pages}",
+            )
+        yield encode(_timed({
             "type": "end",
             "usage": {
-                "prompt_tokens": prompt_tokens,
-                "completion_tokens": completion_tokens,
-                "prompt_chars": prompt_chars_total,
-                "completion_chars": total_completion_chars,
-                "input_bytes": len(content),
-                "pages": len(pages),
+                "prompt_tokens": (prompt_tokens if ocr_pages > 0 else 0) + replay_usage["prompt_tokens"],
+                "completion_tokens": (completion_tokens if ocr_pages > 0 else 0) + replay_usage["completion_tokens"],
+                "prompt_chars": len(prompt_text) * total_pages,
+                "completion_chars": total_completion_chars + replay_usage["completion_chars"],
+                "input_bytes": input_bytes,
+                "pages": total_pages,
+                "cached_pages": cached_pages,
+                "skipped_pages": skipped_pages,
+                "text_layer_pages": text_layer_pages,
+                "checkpointed_pages": len(checkpoints),
             },
-        }) + "\n"
+        }, timings, show_timings))
 
-    return StreamingResponse(
-        generator_pages_parallel_ndjson(),
-        media_type="application/x-ndjson; charset=utf-8",
-    )
+    return _finishing(generator_pages_parallel, timings)
+
+
+# ---- WebSocket transport ---------------------------------------------------------------
+
+
+class _WsDocument:
+    def __init__(self, doc_id: str, window: int):
+        self.id = doc_id
+        self.window = window  # events (NDJSON lines) the client lets us send before it acks; 0 = no limit
+        self.credit = window
+        self.credit_changed = asyncio.Event()
+        self.control = PageControl()
+        self.cancelled = False
+        self.task: Optional[asyncio.Task] = None
+
+    def encode(self, event: dict) -> bytes:
+        return ndjson_line({"id": self.id, **event})
+
+    def ack(self, events: int) -> None:
+        self.credit += events
+        self.credit_changed.set()
+
+    async def take_credit(self, events: int) -> int:
+        """Wait for credit and take it for up to ``events`` events; returns how many may be sent."""
+        if not self.window:
+            return events
+        while self.credit <= 0:
+            self.credit_changed.clear()
+            await self.credit_changed.wait()
+        granted = min(events, self.credit)
+        self.credit -= granted
+        return granted
+
+
+class _WsSession:
+    """One WebSocket connection: uploads arrive one after another, their streams run concurrently."""
+
+    def __init__(self, websocket: WebSocket, user: User):
+        self.websocket = websocket
+        self.user = user
+        self.documents: dict[str, _WsDocument] = {}
+        self._send_lock = asyncio.Lock()
+
+    async def run(self) -> None:
+        try:
+            while True:
+                message = await self.websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    return
+                if message.get("text") is None:
+                    await self.websocket.close(code=status.WS_1003_UNSUPPORTED_DATA, reason="Expected a JSON command")
+                    return
+                if not await self._command(message["text"]):
+                    return
+        finally:
+            tasks = [doc.task for doc in self.documents.values() if doc.task is not None]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _command(self, text: str, uploading: bool = False) -> bool:
+        """Parse and carry out one JSON command; False once the connection is gone."""
+        try:
+            command = json.loads(text)
+            if not isinstance(command, dict):
+                raise ValueError
+        except ValueError:
+            await self.websocket.close(code=status.WS_1003_UNSUPPORTED_DATA, reason="Expected a JSON command")
+            return False
+        doc_id = str(command.get("id") or "")
+        try:
+            if uploading and command.get("type") == "submit":
+                # Its data would be mixed into the current upload's binary messages
+                raise HTTPException(status_code=409, detail="Finish the current upload before submitting another")
+            return await self._handle(command, doc_id)
+        except HTTPException as exc:
+            await self._send_error(doc_id, exc.status_code, exc.detail)
+        except (TypeError, ValueError) as exc:
+            await self._send_error(doc_id, 400, f"Invalid command: {exc}")
+        return True
+
+    async def _handle(self, command: dict, doc_id: str) -> bool:
+        """Carry out one command; False once the connection is gone."""
+        kind = command.get("type")
+        if kind == "ack":
+            doc = self.documents.get(doc_id)
+            if doc is not None:
+                doc.ack(max(0, int(command.get("messages") or 0)))
+            return True
+        if kind == "cancel":
+            doc = self.documents.get(doc_id)
+            if doc is not None:
+                if command.get("page") is not None:
+                    doc.control.cancel(int(command["page"]))
+                elif doc.task is not None:
+                    doc.cancelled = True
+                    doc.task.cancel()
+            return True
+        if kind not in ("submit", "resume"):
+            raise HTTPException(status_code=400, detail=f"Unknown command {kind!r}")
+
+        upload = None
+        if kind == "submit":
+            # The file follows as binary messages; read it even if the submit is refused
+            size = int(command.get("size") or 0)
+            upload = await self._receive_upload(size)
+            if upload is None:
+                return False
+        try:
+            if not doc_id or doc_id in self.documents:
+                raise HTTPException(status_code=400, detail="Every document needs an id not in use on this connection")
+            if len(self.documents) >= settings.WS_MAX_DOCUMENTS:
+                raise HTTPException(status_code=429, detail="Too many documents in progress on this connection")
+            doc = _WsDocument(doc_id, max(0, int(command.get("window") or 0)))
+            events = await self._events(kind, command, upload, doc)
+        finally:
+            if upload is not None:
+                upload.close()
+        self.documents[doc_id] = doc
+        doc.task = asyncio.create_task(self._pump(doc, events))
+        return True
+
+    async def _events(self, kind: str, command: dict, upload, doc: _WsDocument) -> EventStream:
+        order = command.get("order")
+        if order not in (None, "completion", "page"):
+            raise HTTPException(status_code=400, detail="order must be completion or page")
+        text_layer = command.get("text_layer")
+        if text_layer not in (None, "auto", "ocr", "text"):
+            raise HTTPException(status_code=400, detail="text_layer must be auto, ocr or text")
+        tiling = command.get("tiling")
+        if tiling not in (None, "off", "auto", "on"):
+            raise HTTPException(status_code=400, detail="tiling must be off, auto or on")
+        timings = command.get("timings")
+        if timings not in (None, True, False):
+            raise HTTPException(status_code=400, detail="timings must be true or false")
+        show_timings = _show_timings(timings)
+        if kind == "resume":
+            return await _pdf_resume_stream(
+                self.user,
+                str(command.get("document_id") or ""),
+                max(0, int(command.get("offset") or 0)),
+                max(0, int(command.get("after_page") or 0)),
+                order,
+                control=doc.control,
+                show_timings=show_timings,
+            )
+        media_type = command.get("media_type")
+        size = upload.tell()
+        if media_type == "application/pdf":
+            if size > settings.MAX_PDF_UPLOAD_BYTES:
+                raise HTTPException(status_code=413, detail=f"Upload exceeds the {settings.MAX_PDF_UPLOAD_BYTES} byte limit")
+            policy = _render_policy(command.get("render"))
+            _check_admission()
+            return await _pdf_upload_stream(
+                self.user, upload, command.get("prompt"), policy, order, text_layer,
+                control=doc.control, show_timings=show_timings,
+            )
+        if media_type in IMAGE_TYPES:
+            if size > settings.MAX_IMAGE_UPLOAD_BYTES:
+                raise HTTPException(status_code=413, detail=f"Upload exceeds the {settings.MAX_IMAGE_UPLOAD_BYTES} byte limit")
+            _check_admission()
+            upload.seek(0)
+            # Past UPLOAD_SPOOL_MAX_BYTES the upload is on disk
+            content = await sync_to_async(upload.read, thread_sensitive=False)()
+            prompt_text = (command.get("prompt") or "").strip() or settings.LLM_PROMPT
+            return _image_stream(self.user, content, media_type, prompt_text, tiling, show_timings)
+        raise HTTPException(status_code=400, detail="Only PNG/JPEG/WEBP images and PDF are supported")
+
+    async def _receive_upload(self, size: int):
+        """The next ``size`` bytes of binary messages, spooled to disk past UPLOAD_SPOOL_MAX_BYTES; None on disconnect.
+
+        Anything beyond the largest allowed upload is read but not kept. Text
+        messages in between are commands for the other documents (``ack``,
+        ``cancel``, ``resume``) and are carried out as they arrive.
+        """
+        limit = max(settings.MAX_IMAGE_UPLOAD_BYTES, settings.MAX_PDF_UPLOAD_BYTES)
+        upload = tempfile.SpooledTemporaryFile(max_size=settings.UPLOAD_SPOOL_MAX_BYTES)
+        received = 0
+        while received < size:
+            message = await self.websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                upload.close()
+                return None
+            data = message.get("bytes")
+            if data is None:
+                text = message.get("text")
+                if text is not None and await self._command(text, uploading=True):
+                    continue
+                upload.close()
+                if text is None:
+                    await self.websocket.close(code=status.WS_1003_UNSUPPORTED_DATA, reason="Expected file data")
+                return None
+            received += len(data)
+            if upload.tell() <= limit:
+                await sync_to_async(upload.write, thread_sensitive=False)(data)
+        return upload
+
+    async def _pump(self, doc: _WsDocument, events: EventStream) -> None:
+        try:
+            async for chunk in events(doc.encode):
+                # A coalesced chunk holds several events; send as many as the window allows at a time
+                lines = chunk.splitlines(keepends=True)
+                while lines:
+                    granted = await doc.take_credit(len(lines))
+                    await self._send(b"".join(lines[:granted]))
+                    del lines[:granted]
+        except asyncio.CancelledError:
+            if not doc.cancelled:
+                raise
+            await self._send(doc.encode({"type": "cancelled"}))
+        except Exception:
+            logger.exception("WebSocket stream for document %s failed", doc.id)
+        finally:
+            self.documents.pop(doc.id, None)
+
+    async def _send_error(self, doc_id: str, status_code: int, detail) -> None:
+        await self._send(ndjson_line({"id": doc_id, "type": "error", "status": status_code, "error": detail}))
+
+    async def _send(self, chunk: bytes) -> None:
+        async with self._send_lock:
+            await self.websocket.send_text(chunk.decode("utf-8"))
+
+
+@router.websocket("/ws")
+async def ocr_websocket(websocket: WebSocket):
+    """Several documents over one connection, their events multiplexed by document ``id``.
+
+    Authenticates with ``?token=`` or an ``Authorization: Bearer`` header. See
+    the README for the commands (``submit``, ``resume``, ``ack``, ``cancel``).
+    """
+    token = websocket.query_params.get("token")
+    authorization = websocket.headers.get("authorization") or ""
+    if not token and authorization.lower().startswith("bearer "):
+        token = authorization[7:]
+    try:
+        user = await user_from_token(token)
+    except HTTPException:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    await websocket.accept()
+    await _WsSession(websocket, user).run()
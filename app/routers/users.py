@@ -1,11 +1,14 @@
-from fastapi import APIRouter, Depends
-from sqlalchemy import func, select
+from datetime import datetime
+from typing import Literal, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from sqlalchemy import and_, or_, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.db import get_db
-from app.models import UsageEvent, User
+from app.models import UsageBucket, UsageEvent, UsageTotal, User
 from app.routers.auth import get_current_user
-from app.schemas import UserOut, UsageEventOut, UsageSummary
+from app.schemas import UserOut, UsageBucketOut, UsageEventOut, UsageSummary
 
 
 router = APIRouter(prefix="/users", tags=["users"])
@@ -16,39 +19,69 @@ async def read_me(current_user: User = Depends(get_current_user)):
     return current_user
 
 
+def _encode_cursor(event: UsageEvent) -> str:
+    return f"{event.created_at.isoformat()}|{event.id}"
+
+
+def _decode_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        created_at, event_id = cursor.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(event_id)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
 @router.get("/me/usage", response_model=list[UsageEventOut])
-async def my_usage(current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
-    stmt = (
-        select(UsageEvent)
-        .where(UsageEvent.user_id == current_user.id)
-        .order_by(UsageEvent.created_at.desc())
-        .limit(200)
-    )
+async def my_usage(
+    response: Response,
+    limit: int = Query(200, ge=1, le=1000),
+    before: Optional[str] = Query(None, description="Cursor from the X-Next-Cursor header of the previous page"),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    # Keyset pagination over (created_at, id), served by ix_usage_events_user_id_created_at
+    stmt = select(UsageEvent).where(UsageEvent.user_id == current_user.id)
+    if before:
+        created_at, event_id = _decode_cursor(before)
+        stmt = stmt.where(
+            or_(
+                UsageEvent.created_at < created_at,
+                and_(UsageEvent.created_at == created_at, UsageEvent.id < event_id),
+            )
+        )
+    stmt = stmt.order_by(UsageEvent.created_at.desc(), UsageEvent.id.desc()).limit(limit)
     result = await db.execute(stmt)
     rows = result.scalars().all()
+    if len(rows) == limit:
+        response.headers["X-Next-Cursor"] = _encode_cursor(rows[-1])
     return rows
 
 
 @router.get("/me/usage/summary", response_model=UsageSummary)
 async def my_usage_summary(current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    total = await db.get(UsageTotal, current_user.id)
+    return UsageSummary(
+        total_events=int(total.events) if total else 0,
+        total_input_bytes=int(total.input_bytes) if total else 0,
+        total_prompt_tokens=int(total.prompt_tokens) if total else 0,
+        total_completion_tokens=int(total.completion_tokens) if total else 0,
+        total_prompt_chars=int(total.prompt_chars) if total else 0,
+        total_completion_chars=int(total.completion_chars) if total else 0,
+    )
+
+
+@router.get("/me/usage/buckets", response_model=list[UsageBucketOut])
+async def my_usage_buckets(
+    granularity: Literal["hour", "day"] = "day",
+    limit: int = Query(30, ge=1, le=1000),
+    current_user: User = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
     stmt = (
-        select(
-            func.count(UsageEvent.id),
-            func.coalesce(func.sum(UsageEvent.input_bytes), 0),
-            func.coalesce(func.sum(UsageEvent.prompt_tokens), 0),
-            func.coalesce(func.sum(UsageEvent.completion_tokens), 0),
-            func.coalesce(func.sum(UsageEvent.prompt_chars), 0),
-            func.coalesce(func.sum(UsageEvent.completion_chars), 0),
-        )
-        .where(UsageEvent.user_id == current_user.id)
+        select(UsageBucket)
+        .where(UsageBucket.user_id == current_user.id, UsageBucket.granularity == granularity)
+        .order_by(UsageBucket.bucket_start.desc())
+        .limit(limit)
     )
     result = await db.execute(stmt)
-    agg = result.one()
-    return UsageSummary(
-        total_events=int(agg[0] or 0),
-        total_input_bytes=int(agg[1] or 0),
-        total_prompt_tokens=int(agg[2] or 0),
-        total_completion_tokens=int(agg[3] or 0),
-        total_prompt_chars=int(agg[4] or 0),
-        total_completion_chars=int(agg[5] or 0),
-    )
+    return result.scalars().all()
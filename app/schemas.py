@@ -52,3 +52,53 @@ class UsageSummary(BaseModel):
     total_prompt_chars: int
     total_completion_chars: int
 
+
+class UsageBucketOut(BaseModel):
+    granularity: str
+    bucket_start: datetime
+    events: int
+    input_bytes: int
+    prompt_tokens: int
+    completion_tokens: int
+    prompt_chars: int
+    completion_chars: int
+
+    class Config:
+        from_attributes = True
+
+
+class OcrJobOut(BaseModel):
+    id: str
+    kind: str
+    status: str
+    filename: Optional[str] = None
+    content_hash: str
+    render: Optional[str] = None
+    input_bytes: int
+    total_pages: Optional[int] = None
+    done_pages: int
+    failed_pages: int
+    attempts: int
+    error: Optional[str] = None
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    deduplicated: bool = False
+
+    class Config:
+        from_attributes = True
+
+
+class OcrJobPageOut(BaseModel):
+    page: int
+    status: str
+    text: str
+    error: Optional[str] = None
+    cached: bool
+    prompt_tokens: int
+    completion_tokens: int
+    completion_chars: int
+    finished_at: datetime
+
+    class Config:
+        from_attributes = True
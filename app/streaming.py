@@ -0,0 +1,181 @@
+"""Event encoding for the OCR streams and the output stage of the page-parallel PDF stream.
+
+Events are dicts with a ``type``; an encoder turns one into wire bytes: NDJSON
+lines by default, Server-Sent Events for clients that ask for
+``text/event-stream``.
+
+Page workers hand their events to a :class:`PageStream`; the response body
+iterates :meth:`PageStream.chunks`. Along the way:
+
+- deltas of a page are coalesced into one ``page_delta`` until
+  ``coalesce_chars`` of text or ``coalesce_seconds`` have built up,
+- every line that is ready when the client can take more is sent as one chunk,
+- in ``page`` order mode a page's events are only sent once all earlier pages
+  have ended; later pages are held back meanwhile,
+- workers wait while more than ``max_buffer_bytes`` are queued for the client
+  (or held back), so a slow client stops engine reads instead of growing memory.
+"""
+import asyncio
+import json
+import time
+from collections import deque
+from typing import AsyncIterator, Callable, Optional
+
+
+Encoder = Callable[[dict], bytes]
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson; charset=utf-8"
+SSE_MEDIA_TYPE = "text/event-stream; charset=utf-8"
+
+
+def _dumps(event: dict) -> bytes:
+    return json.dumps(event, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def ndjson_line(event: dict) -> bytes:
+    return _dumps(event) + b"\n"
+
+
+def sse_event(event: dict) -> bytes:
+    """One SSE message; the event type doubles as the SSE event name."""
+    return b"event: " + event["type"].encode("ascii") + b"\ndata: " + _dumps(event) + b"\n\n"
+
+
+def wants_sse(accept: Optional[str]) -> bool:
+    return "text/event-stream" in (accept or "")
+
+
+class PageStream:
+    def __init__(
+        self,
+        pages: list[int],
+        ordered: bool = False,
+        coalesce_chars: int = 2048,
+        coalesce_seconds: float = 0.02,
+        max_buffer_bytes: int = 1024 * 1024,
+        encode: Encoder = ndjson_line,
+        unit: str = "page",
+    ):
+        self.encode = encode
+        self.unit = unit  # events are <unit>_start / <unit>_delta, keyed by a <unit> field
+        self.ordered = ordered
+        self.coalesce_chars = coalesce_chars
+        self.coalesce_seconds = coalesce_seconds
+        self.max_buffer_bytes = max_buffer_bytes
+        self._order = sorted(pages) if ordered else list(pages)
+        self._head = 0  # index into _order of the page being sent (page order mode)
+        self._remaining = len(self._order)
+        self._ended: set[int] = set()
+        self._out: deque[bytes] = deque()
+        self._out_bytes = 0
+        self._held: dict[int, list[bytes]] = {}
+        self._held_bytes = 0
+        # page -> (pieces, chars, deadline) of deltas not sent yet
+        self._deltas: dict[int, tuple[list[str], int, float]] = {}
+        self._ready = asyncio.Event()
+        self._space = asyncio.Event()
+
+    # ---- producer side (page workers) -------------------------------------------------
+
+    async def start(self, page: int, **fields) -> None:
+        self._emit(page, self.encode({"type": f"{self.unit}_start", self.unit: page, **fields}))
+        await self._wait_for_space(page)
+
+    async def delta(self, page: int, text: str) -> None:
+        buffered = self._deltas.get(page)
+        if buffered is None:
+            buffered = ([], 0, time.monotonic() + self.coalesce_seconds)
+            self._ready.set()  # the consumer has a new flush deadline to wait for
+        pieces, size, deadline = buffered
+        pieces.append(text)
+        size += len(text)
+        self._deltas[page] = (pieces, size, deadline)
+        if size >= self.coalesce_chars or self.coalesce_seconds <= 0:
+            self._flush(page)
+        await self._wait_for_space(page)
+
+    async def end(self, page: int, event: dict) -> None:
+        """``page_end`` (or a page error event); the page's pending deltas go out first."""
+        self._flush(page)
+        self._emit(page, self.encode(event))
+        self._ended.add(page)
+        self._remaining -= 1
+        self._advance()
+        self._ready.set()
+
+    def replay(self, page: int, events: list[dict]) -> None:
+        """Events of a page that is already finished (a checkpoint)."""
+        for event in events:
+            self._emit(page, self.encode(event))
+        self._ended.add(page)
+        self._remaining -= 1
+        self._advance()
+
+    # ---- consumer side (response body) ------------------------------------------------
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        """Everything ready, one chunk per client write, until every page has ended."""
+        while True:
+            if self._out:
+                chunk = b"".join(self._out)
+                self._out.clear()
+                self._out_bytes = 0
+                self._space.set()
+                yield chunk
+                continue
+            if self._remaining == 0 and not self._deltas:
+                return
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), self._next_deadline())
+            except asyncio.TimeoutError:
+                now = time.monotonic()
+                for page, (_, _, deadline) in list(self._deltas.items()):
+                    if deadline <= now:
+                        self._flush(page)
+
+    # ---- internals --------------------------------------------------------------------
+
+    def _is_head(self, page: int) -> bool:
+        return not self.ordered or (self._head < len(self._order) and self._order[self._head] == page)
+
+    def _emit(self, page: int, line: bytes) -> None:
+        if self._is_head(page):
+            self._out.append(line)
+            self._out_bytes += len(line)
+            self._ready.set()
+        else:
+            self._held.setdefault(page, []).append(line)
+            self._held_bytes += len(line)
+
+    def _flush(self, page: int) -> None:
+        pending = self._deltas.pop(page, None)
+        if pending:
+            self._emit(page, self.encode({"type": f"{self.unit}_delta", self.unit: page, "delta": "".join(pending[0])}))
+
+    def _advance(self) -> None:
+        """Page order mode: move past ended pages, releasing what the new head page held back."""
+        if not self.ordered:
+            return
+        while self._head < len(self._order) and self._order[self._head] in self._ended:
+            self._head += 1
+            if self._head < len(self._order):
+                lines = self._held.pop(self._order[self._head], [])
+                self._held_bytes -= sum(len(line) for line in lines)
+                self._out.extend(lines)
+                self._out_bytes += sum(len(line) for line in lines)
+        self._ready.set()
+        self._space.set()
+
+    def _next_deadline(self) -> Optional[float]:
+        if not self._deltas:
+            return None
+        return max(0.0, min(deadline for _, _, deadline in self._deltas.values()) - time.monotonic())
+
+    async def _wait_for_space(self, page: int) -> None:
+        # The page being sent never waits on held-back pages, so it always makes progress
+        while self._out_bytes > self.max_buffer_bytes or (
+            not self._is_head(page) and self._held_bytes > self.max_buffer_bytes
+        ):
+            self._space.clear()
+            await self._space.wait()
@@ -0,0 +1,108 @@
+"""Tiling of oversized images for ``/ocr/image``: tile layout and stitching of tile texts.
+
+An image is cut into a grid of equally sized tiles that overlap by a margin, so
+a line cut by one tile edge is whole in the neighbouring tile. Each tile is
+OCR'd on its own; the texts are stitched back in reading order (rows top to
+bottom, tiles left to right), dropping what the overlap made two tiles read:
+
+- the first lines of a tile that repeat the last lines of the tile above,
+- lines of a tile that the tile to its left already read in full (text lying
+  inside the vertical overlap band).
+"""
+import math
+import re
+from dataclasses import dataclass
+from difflib import SequenceMatcher
+
+
+# Lines shorter than this are not dropped on a match alone ("1", "Total"), they repeat legitimately
+_MIN_DEDUP_LINE_CHARS = 8
+# Lines this similar count as the same line read twice (OCR of a cut line varies slightly)
+_SIMILAR_LINE_RATIO = 0.9
+# How many lines at a tile edge are compared with its neighbour
+_MAX_OVERLAP_LINES = 12
+
+
+@dataclass(frozen=True)
+class TileBox:
+    index: int  # 1-based, reading order
+    row: int
+    col: int
+    left: int
+    top: int
+    right: int
+    bottom: int
+
+
+def _starts(length: int, tile: int, overlap: int) -> list[int]:
+    overlap = min(overlap, tile // 2)
+    if length <= tile:
+        return [0]
+    count = math.ceil((length - overlap) / (tile - overlap))
+    step = (length - tile) / (count - 1)
+    return [round(i * step) for i in range(count)]
+
+
+def tile_boxes(width: int, height: int, tile: int, overlap: int) -> list[TileBox]:
+    """Grid of ``tile``-sized boxes covering the image, neighbours overlapping by at least ``overlap``."""
+    boxes = []
+    for row, top in enumerate(_starts(height, tile, overlap)):
+        for col, left in enumerate(_starts(width, tile, overlap)):
+            boxes.append(TileBox(
+                index=len(boxes) + 1,
+                row=row,
+                col=col,
+                left=left,
+                top=top,
+                right=min(width, left + tile),
+                bottom=min(height, top + tile),
+            ))
+    return boxes
+
+
+def grid_size(width: int, height: int, tile: int, overlap: int) -> int:
+    return len(_starts(width, tile, overlap)) * len(_starts(height, tile, overlap))
+
+
+def _norm(line: str) -> str:
+    return re.sub(r"\s+", " ", line).strip().lower()
+
+
+def _same(a: str, b: str) -> bool:
+    return a == b or SequenceMatcher(None, a, b, autojunk=False).ratio() >= _SIMILAR_LINE_RATIO
+
+
+def _repeated_head(above: list[str], below: list[str]) -> int:
+    """Number of leading lines of ``below`` that repeat the trailing lines of ``above``."""
+    a = [_norm(line) for line in above[-_MAX_OVERLAP_LINES:]]
+    b = [_norm(line) for line in below[:_MAX_OVERLAP_LINES]]
+    for k in range(min(len(a), len(b)), 0, -1):
+        tail, head = a[-k:], b[:k]
+        if sum(len(line) for line in head) < _MIN_DEDUP_LINE_CHARS:
+            break
+        if all(_same(x, y) for x, y in zip(tail, head)):
+            return k
+    return 0
+
+
+def stitch(boxes: list[TileBox], texts: dict[int, str]) -> str:
+    """Join tile texts in reading order, dropping text the overlaps made two tiles read."""
+    by_pos = {(box.row, box.col): box.index for box in boxes}
+    lines: dict[int, list[str]] = {i: texts.get(i, "").strip("\n").split("\n") for i in by_pos.values()}
+    kept: dict[int, list[str]] = {}
+    for box in boxes:
+        current = lines[box.index]
+        above = by_pos.get((box.row - 1, box.col))
+        if above is not None:
+            current = current[_repeated_head(lines[above], current):]
+        left = by_pos.get((box.row, box.col - 1))
+        if left is not None:
+            seen = {_norm(line) for line in lines[left]}
+            current = [line for line in current if len(_norm(line)) < _MIN_DEDUP_LINE_CHARS or _norm(line) not in seen]
+        kept[box.index] = current
+    rows: dict[int, list[str]] = {}
+    for box in boxes:
+        text = "\n".join(kept[box.index]).strip()
+        if text:
+            rows.setdefault(box.row, []).append(text)
+    return "\n\n".join("\n".join(parts) for _, parts in sorted(rows.items()))
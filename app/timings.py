@@ -0,0 +1,114 @@
+"""Where the time of an OCR request goes, phase by phase.
+
+Phases:
+
+- ``upload``: copying the upload out of the request (temp file, blob store, batch spool)
+- ``extract``: reading a PDF page's text layer
+- ``render``: rasterizing a PDF page, or decoding and resizing an uploaded image
+- ``encode``: encoding the page or image for the engine request
+- ``queue``: waiting for an admission slot and the micro-batch window
+- ``ttft``: engine request sent to its first content token
+- ``decode``: first to last content token
+- ``db``: writing the page checkpoint
+
+Every page, tile or batch item has its own ``Timings``, a child of the
+request's; a single image is its own unit. When a unit finishes its phases are
+observed in ``ocr_phase_seconds{kind,phase}`` and its decode speed in
+``ocr_decode_tokens_per_second{kind}``, and they are added to the request's,
+whose ``timings`` block therefore sums the work of concurrent pages (it can
+exceed ``total``, the request's wall time). With TRACING_EXPORTER set, the
+request, its units and their phases are exported as nested spans.
+"""
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+from app.metrics import OCR_DECODE_TOKENS_PER_SECOND, OCR_PHASE_SECONDS
+from app.tracing import tracing
+
+
+PHASES = ("upload", "extract", "render", "encode", "queue", "ttft", "decode", "db")
+
+
+class Timings:
+    def __init__(
+        self, kind: str, name: str, parent: Optional["Timings"] = None, started: Optional[float] = None, **attributes
+    ):
+        """``started``: ``time.perf_counter()`` when the request began, if before this object was made."""
+        self.kind = kind
+        self.parent = parent
+        self.phases: dict[str, float] = {}
+        self.decode_tokens = 0  # completion tokens of requests whose decode time is in phases["decode"]
+        self.finished = False
+        self._total = 0.0
+        # Phases and decode tokens of finished child units
+        self._units: dict[str, float] = {}
+        self._units_decode_tokens = 0
+        now = time.perf_counter()
+        self._started = now if started is None else started
+        self._span = tracing.span(
+            name,
+            time.time_ns() - int((now - self._started) * 1e9),
+            parent._span if parent is not None else None,
+            {"ocr.kind": kind, **attributes},
+        )
+
+    def add(self, phase: str, seconds: float) -> None:
+        seconds = max(0.0, seconds)
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+        if self._span is not None:
+            # Phases are measured as durations (some in worker processes), so the span ends now
+            end = time.time_ns()
+            tracing.span(phase, end - int(seconds * 1e9), self._span).end(end_time=end)
+
+    @contextmanager
+    def measure(self, phase: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - started)
+
+    def decoded(self, completion_tokens: int) -> None:
+        """Counted completion tokens (engine or tokenizer) of the request whose decode time was just added."""
+        if "decode" in self.phases:
+            self.decode_tokens += completion_tokens
+
+    def finish(self) -> dict:
+        """Observe the phases, roll them into the parent and end the span; the ``timings`` event block.
+
+        Only the first call observes anything, so error paths may call it again safely.
+        """
+        if not self.finished:
+            self.finished = True
+            self._total = time.perf_counter() - self._started
+            for phase, seconds in self.phases.items():
+                OCR_PHASE_SECONDS.labels(kind=self.kind, phase=phase).observe(seconds)
+            rate = _rate(self.phases, self.decode_tokens)
+            if rate is not None:
+                OCR_DECODE_TOKENS_PER_SECOND.labels(kind=self.kind).observe(rate)
+            if self.parent is not None and not self.parent.finished:
+                for phase, seconds in self.phases.items():
+                    self.parent._units[phase] = self.parent._units.get(phase, 0.0) + seconds
+                self.parent._units_decode_tokens += self.decode_tokens
+            if self._span is not None:
+                self._span.end()
+        return self.block()
+
+    def block(self) -> dict:
+        phases = dict(self._units)
+        for phase, seconds in self.phases.items():
+            phases[phase] = phases.get(phase, 0.0) + seconds
+        block = {phase: round(phases[phase], 4) for phase in PHASES if phase in phases}
+        rate = _rate(phases, self.decode_tokens + self._units_decode_tokens)
+        if rate is not None:
+            block["tokens_per_second"] = round(rate, 1)
+        block["total"] = round(self._total if self.finished else time.perf_counter() - self._started, 4)
+        return block
+
+
+def _rate(phases: dict[str, float], decode_tokens: int) -> Optional[float]:
+    decode = phases.get("decode", 0.0)
+    if decode <= 0 or not decode_tokens:
+        return None
+    return decode_tokens / decode
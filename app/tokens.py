@@ -0,0 +1,66 @@
+"""Token counts for engine responses that came without usage (TOKENIZER).
+
+The engine's own count, sent in the final ``include_usage`` chunk, is what
+usage is recorded with. When it is missing (an engine or proxy that drops it)
+and TOKENIZER names a Hugging Face tokenizer (hub id or path to a
+``tokenizer.json``), the prompt and completion text are counted with it; this
+needs ``pip install tokenizers``. Image tokens cannot be counted from text;
+callers add an estimate from the image size (TOKENIZER_IMAGE_PIXELS_PER_TOKEN).
+Without either, callers fall back to ``approx_tokens_from_chars``.
+"""
+import logging
+import os
+import threading
+from typing import Optional
+
+from asgiref.sync import sync_to_async
+
+from app.core.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class TokenCounter:
+    def __init__(self, name: str):
+        self.name = name
+        self._tokenizer = None
+        self._failed = False
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.name) and not self._failed
+
+    def _load(self):
+        with self._lock:
+            if self._tokenizer is None and not self._failed:
+                try:
+                    from tokenizers import Tokenizer
+
+                    if os.path.isfile(self.name):
+                        self._tokenizer = Tokenizer.from_file(self.name)
+                    else:
+                        self._tokenizer = Tokenizer.from_pretrained(self.name)
+                except Exception:
+                    # ImportError without the package; hub or file errors otherwise
+                    logger.warning("Tokenizer %r could not be loaded; token counts fall back to estimates",
+                                   self.name, exc_info=True)
+                    self._failed = True
+            return self._tokenizer
+
+    def _count(self, texts: tuple[str, ...]) -> Optional[list[int]]:
+        tokenizer = self._load()
+        if tokenizer is None:
+            return None
+        encodings = tokenizer.encode_batch(list(texts), add_special_tokens=False)
+        return [len(encoding.ids) for encoding in encodings]
+
+    async def count(self, *texts: str) -> Optional[list[int]]:
+        """Tokens in each text, counted off the event loop; None if no tokenizer is available."""
+        if not self.enabled:
+            return None
+        return await sync_to_async(self._count, thread_sensitive=False)(texts)
+
+
+token_counter = TokenCounter(settings.TOKENIZER)
@@ -0,0 +1,71 @@
+"""Optional OpenTelemetry export of OCR request spans (TRACING_EXPORTER).
+
+Needs ``pip install opentelemetry-sdk`` (plus ``opentelemetry-exporter-otlp-proto-http``
+for ``otlp``); without them, or with ``TRACING_EXPORTER=off``, every call here
+is a no-op. ``otlp`` sends spans to a collector over OTLP/HTTP, ``file`` appends
+them to ``TRACING_FILE`` as JSON.
+"""
+import logging
+import os
+from typing import Any, Optional
+
+from app.core.config import settings
+
+
+logger = logging.getLogger(__name__)
+
+
+class _Tracing:
+    def __init__(self):
+        self._tracer = None
+        self._provider = None
+        self._file = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._tracer is not None
+
+    def start(self) -> None:
+        if settings.TRACING_EXPORTER == "off" or self._tracer is not None:
+            return
+        try:
+            from opentelemetry.sdk.resources import Resource
+            from opentelemetry.sdk.trace import TracerProvider
+            from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+
+            if settings.TRACING_EXPORTER == "otlp":
+                from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+
+                exporter = OTLPSpanExporter(endpoint=settings.TRACING_OTLP_ENDPOINT)
+            else:
+                os.makedirs(os.path.dirname(settings.TRACING_FILE) or ".", exist_ok=True)
+                self._file = open(settings.TRACING_FILE, "a", encoding="utf-8")
+                exporter = ConsoleSpanExporter(
+                    out=self._file, formatter=lambda span: span.to_json(indent=None) + "\n"
+                )
+        except ImportError:
+            logger.warning("TRACING_EXPORTER=%s needs the OpenTelemetry SDK; tracing is off", settings.TRACING_EXPORTER)
+            return
+        provider = TracerProvider(resource=Resource.create({"service.name": settings.TRACING_SERVICE_NAME}))
+        provider.add_span_processor(BatchSpanProcessor(exporter))
+        self._provider = provider
+        self._tracer = provider.get_tracer("app.ocr")
+
+    def stop(self) -> None:
+        if self._provider is not None:
+            self._provider.shutdown()
+        if self._file is not None:
+            self._file.close()
+        self._provider = self._tracer = self._file = None
+
+    def span(self, name: str, start_ns: int, parent: Any = None, attributes: Optional[dict] = None) -> Any:
+        """A started span (None when tracing is off); the caller ends it with ``end(end_time=...)``."""
+        if self._tracer is None:
+            return None
+        from opentelemetry import trace
+
+        context = trace.set_span_in_context(parent) if parent is not None else None
+        return self._tracer.start_span(name, context=context, start_time=start_ns, attributes=attributes or {})
+
+
+tracing = _Tracing()
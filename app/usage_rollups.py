@@ -0,0 +1,102 @@
+from collections import defaultdict
+from datetime import datetime
+from typing import Iterable
+
+from sqlalchemy import delete, exists, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import UsageBucket, UsageEvent, UsageTotal
+
+
+COUNTERS = ("events", "input_bytes", "prompt_tokens", "completion_tokens", "prompt_chars", "completion_chars")
+GRANULARITIES = ("hour", "day")
+
+
+def bucket_start(ts: datetime, granularity: str) -> datetime:
+    if granularity == "hour":
+        return ts.replace(minute=0, second=0, microsecond=0)
+    return ts.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+class _Rollup:
+    """Accumulates events into per-user totals and hourly/daily buckets."""
+
+    def __init__(self):
+        self.totals: dict[int, dict] = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+        self.buckets: dict[tuple, dict] = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+
+    def add(self, evt) -> None:
+        targets = [self.totals[evt["user_id"]]]
+        for granularity in GRANULARITIES:
+            targets.append(self.buckets[(evt["user_id"], granularity, bucket_start(evt["created_at"], granularity))])
+        for agg in targets:
+            agg["events"] += 1
+            for name in COUNTERS[1:]:
+                agg[name] += int(evt.get(name) or 0)
+
+    async def write(self, session: AsyncSession) -> None:
+        total_rows = [{"user_id": user_id, **agg} for user_id, agg in self.totals.items()]
+        bucket_rows = [
+            {"user_id": user_id, "granularity": granularity, "bucket_start": start, **agg}
+            for (user_id, granularity, start), agg in self.buckets.items()
+        ]
+        await _upsert_add(session, UsageTotal, ("user_id",), total_rows)
+        await _upsert_add(session, UsageBucket, ("user_id", "granularity", "bucket_start"), bucket_rows)
+
+
+async def _upsert_add(session: AsyncSession, model, keys: tuple[str, ...], rows: list[dict]) -> None:
+    """Insert rows, adding the counters onto existing rows with the same key."""
+    if not rows:
+        return
+    dialect = session.bind.dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        stmt = (sqlite_insert if dialect == "sqlite" else pg_insert)(model)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={name: getattr(model, name) + stmt.excluded[name] for name in COUNTERS},
+        )
+        await session.execute(stmt, rows)
+        return
+    for row in rows:
+        result = await session.execute(
+            update(model)
+            .where(*(getattr(model, k) == row[k] for k in keys))
+            .values({name: getattr(model, name) + row[name] for name in COUNTERS})
+        )
+        if result.rowcount == 0:
+            session.add(model(**row))
+    await session.flush()
+
+
+async def apply_rollups(session: AsyncSession, events: Iterable[dict]) -> None:
+    """Fold a batch of new usage events into the totals and buckets (caller commits)."""
+    rollup = _Rollup()
+    for evt in events:
+        rollup.add(evt)
+    await rollup.write(session)
+
+
+async def rebuild_rollups(session: AsyncSession, batch_size: int = 5000) -> None:
+    """Recompute all rollups from usage_events in one transaction."""
+    rollup = _Rollup()
+    columns = [UsageEvent.user_id, UsageEvent.created_at, *(getattr(UsageEvent, n) for n in COUNTERS[1:])]
+    result = await session.stream(select(*columns).execution_options(yield_per=batch_size))
+    async for partition in result.mappings().partitions(batch_size):
+        for row in partition:
+            rollup.add(row)
+    await session.execute(delete(UsageTotal))
+    await session.execute(delete(UsageBucket))
+    await rollup.write(session)
+    await session.commit()
+
+
+async def ensure_rollups(session: AsyncSession) -> None:
+    """Backfill rollups for databases that have events but no totals yet (e.g. right after the migration)."""
+    has_totals = await session.scalar(select(exists().where(UsageTotal.user_id.isnot(None))))
+    if has_totals:
+        return
+    has_events = await session.scalar(select(exists().where(UsageEvent.id.isnot(None))))
+    if has_events:
+        await rebuild_rollups(session)
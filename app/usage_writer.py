@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import insert
+
+from app.core.config import settings
+from app.db import AsyncSessionLocal
+from app.metrics import (
+    USAGE_EVENTS_DROPPED_TOTAL,
+    USAGE_EVENTS_WRITTEN_TOTAL,
+    USAGE_WRITER_BACKLOG,
+    USAGE_WRITER_FLUSH_SECONDS,
+)
+from app.models import UsageEvent
+from app.usage_rollups import apply_rollups
+
+
+logger = logging.getLogger(__name__)
+
+
+class UsageWriter:
+    """Buffers usage events in memory and writes them in bulk from a background task.
+
+    A flush happens once ``batch_size`` events are pending or ``flush_interval``
+    seconds have passed, whichever comes first, so the request path never waits
+    on a commit. Each batch updates the usage rollups in the same transaction.
+    Pending events are flushed on ``stop()``.
+    """
+
+    def __init__(self, batch_size: int, flush_interval: float, max_backlog: int):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_backlog = max_backlog
+        self._pending: deque[dict] = deque()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def backlog(self) -> int:
+        return len(self._pending)
+
+    def submit(self, **fields) -> None:
+        fields.setdefault("created_at", datetime.utcnow())
+        self._pending.append(fields)
+        while len(self._pending) > self.max_backlog:
+            self._pending.popleft()
+            USAGE_EVENTS_DROPPED_TOTAL.inc()
+        USAGE_WRITER_BACKLOG.set(len(self._pending))
+        if self._wakeup is not None and len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        while self._pending:
+            if not await self.flush():
+                break
+
+    async def _run(self) -> None:
+        assert self._wakeup is not None
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            while self._pending:
+                if not await self.flush() or len(self._pending) < self.batch_size:
+                    break
+
+    async def flush(self) -> bool:
+        """Write up to one batch; returns False (and keeps the events) if the write failed."""
+        if not self._pending:
+            return True
+        batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+        started = time.perf_counter()
+        try:
+            async with AsyncSessionLocal() as session:
+                await session.execute(insert(UsageEvent), batch)
+                await apply_rollups(session, batch)
+                await session.commit()
+        except Exception:
+            logger.exception("Failed to write %d usage events; will retry", len(batch))
+            self._pending.extendleft(reversed(batch))
+            return False
+        finally:
+            USAGE_WRITER_FLUSH_SECONDS.observe(time.perf_counter() - started)
+            USAGE_WRITER_BACKLOG.set(len(self._pending))
+        USAGE_EVENTS_WRITTEN_TOTAL.inc(len(batch))
+        return True
+
+
+usage_writer = UsageWriter(
+    batch_size=settings.USAGE_FLUSH_BATCH_SIZE,
+    flush_interval=settings.USAGE_FLUSH_INTERVAL_SECONDS,
+    max_backlog=settings.USAGE_MAX_BACKLOG,
+)
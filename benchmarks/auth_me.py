@@ -0,0 +1,71 @@
+"""Requests/sec for GET /api/users/me with the identity cache disabled vs enabled.
+
+Usage:
+    python -m benchmarks.auth_me [--requests 2000] [--concurrency 32]
+
+Runs the app in-process against a throwaway SQLite database with auth enabled,
+so "disabled" is the old path: a user lookup in the database on every request.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+_db_dir = tempfile.mkdtemp(prefix="bench-auth-")
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{_db_dir}/bench.db")
+os.environ["AUTH_ENABLED"] = "true"
+
+import httpx  # noqa: E402
+
+from app.identity_cache import identity_cache  # noqa: E402
+from app.main import app  # noqa: E402
+
+
+async def measure(client: httpx.AsyncClient, headers: dict, requests: int, concurrency: int) -> float:
+    remaining = requests
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            r = await client.get("/api/users/me", headers=headers)
+            r.raise_for_status()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return requests / (time.perf_counter() - started)
+
+
+async def run(requests: int, concurrency: int) -> dict:
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            await client.post("/api/auth/register", json={"username": "bench", "password": "bench-pass"})
+            r = await client.post("/api/auth/token", data={"username": "bench", "password": "bench-pass"})
+            headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+            results = {}
+            ttl = identity_cache.ttl
+            for label, cache_ttl in (("cache_disabled", 0), ("cache_enabled", ttl or 60)):
+                identity_cache.ttl = cache_ttl
+                identity_cache.clear()
+                await measure(client, headers, min(200, requests), concurrency)  # warm-up
+                results[label] = await measure(client, headers, requests, concurrency)
+            identity_cache.ttl = ttl
+            return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+    results = asyncio.run(run(args.requests, args.concurrency))
+    for label, rps in results.items():
+        print(f"{label:<16}{rps:>10.0f} req/s")
+    print(f"{'speedup':<16}{results['cache_enabled'] / results['cache_disabled']:>10.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,443 @@
+"""Load generator for /api/ocr/image and /api/ocr/pdf against a mock (or real) engine.
+
+Usage:
+    python -m benchmarks.loadgen [--workload image|pdf|mixed] [--concurrency 16] [--requests 200]
+                                 [--pages 4] [--engines 1] [--json results.json] [--compare baseline.json]
+                                 [mock engine options, see benchmarks.mock_engine]
+    python -m benchmarks.loadgen --target http://localhost:9000 --server-pid 1234 ...
+
+By default it starts ``--engines`` copies of ``benchmarks.mock_engine`` and the
+API (uvicorn, throwaway SQLite database, auth disabled) as subprocesses on free
+ports, so results only depend on this tree and the options. With ``--target`` it drives an already
+running API instead (pass ``--server-pid`` to still get peak RSS).
+
+Reports throughput, time to first byte, time to first delta, request and
+per-page latency percentiles, error counts, server peak RSS and event-loop lag
+(from the ``event_loop_lag_seconds`` histogram). ``--json`` writes the results
+with the git revision; ``--compare`` prints the relative change of every
+numeric field against an earlier results file.
+"""
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+import httpx
+from PIL import Image, ImageDraw
+from prometheus_client.parser import text_string_to_metric_families
+
+from benchmarks.mock_engine import add_engine_arguments
+
+
+# ---- synthetic inputs -------------------------------------------------------
+
+def _text_page(label: str, size: tuple[int, int], lines: int) -> Image.Image:
+    img = Image.new("RGB", size, "white")
+    draw = ImageDraw.Draw(img)
+    for line in range(lines):
+        draw.text((20, 20 + line * 18), f"{label} line {line + 1}: the quick brown fox jumps over the lazy dog", fill="black")
+    return img
+
+
+def synthetic_png(n: int) -> bytes:
+    buf = io.BytesIO()
+    _text_page(f"Image {n}", (800, 600), 30).save(buf, "PNG")
+    return buf.getvalue()
+
+
+def synthetic_pdf(n: int, pages: int) -> bytes:
+    images = [_text_page(f"Doc {n} page {p + 1}", (612, 792), 40) for p in range(pages)]
+    buf = io.BytesIO()
+    images[0].save(buf, "PDF", resolution=72.0, save_all=True, append_images=images[1:])
+    return buf.getvalue()
+
+
+# ---- statistics ---------------------------------------------------------------
+
+def percentile(values: list[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = q / 100 * (len(ordered) - 1)
+    lo, hi = math.floor(rank), math.ceil(rank)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (rank - lo)
+
+
+def summarize(values: list[float]) -> dict:
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values) if values else None,
+        "p50": percentile(values, 50),
+        "p90": percentile(values, 90),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else None,
+    }
+
+
+def histogram_snapshot(metrics_text: str, name: str) -> dict:
+    """Cumulative bucket counts plus sum/count for one Prometheus histogram."""
+    snap = {"buckets": {}, "sum": 0.0, "count": 0.0}
+    for family in text_string_to_metric_families(metrics_text):
+        if family.name != name:
+            continue
+        for sample in family.samples:
+            if sample.name.endswith("_bucket"):
+                snap["buckets"][float(sample.labels["le"])] = sample.value
+            elif sample.name.endswith("_sum"):
+                snap["sum"] = sample.value
+            elif sample.name.endswith("_count"):
+                snap["count"] = sample.value
+    return snap
+
+
+def histogram_delta(before: dict, after: dict) -> dict:
+    """Mean and bucket-upper-bound quantiles of the observations made between two snapshots."""
+    count = after["count"] - before["count"]
+    if count <= 0:
+        return {"samples": 0, "mean": None, "p50_le": None, "p99_le": None, "max_le": None}
+    cumulative = sorted((le, after["buckets"][le] - before["buckets"].get(le, 0.0)) for le in after["buckets"])
+
+    def upper_bound(q: float) -> Optional[float]:
+        for le, seen in cumulative:
+            if seen >= q * count:
+                return le if math.isfinite(le) else None
+        return None
+
+    return {
+        "samples": int(count),
+        "mean": (after["sum"] - before["sum"]) / count,
+        "p50_le": upper_bound(0.5),
+        "p99_le": upper_bound(0.99),
+        "max_le": upper_bound(1.0),
+    }
+
+
+# ---- server processes -----------------------------------------------------------
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _status_kib(pid: int, field: str) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _children(pid: int) -> list[int]:
+    pids = []
+    try:
+        for tid in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{tid}/children") as f:
+                pids.extend(int(p) for p in f.read().split())
+    except OSError:
+        pass
+    return pids
+
+
+def peak_rss(pid: int) -> dict:
+    """Peak RSS (VmHWM) of the API process and the sum over its children (render workers). Linux only."""
+    own = _status_kib(pid, "VmHWM")
+    children = [_status_kib(child, "VmHWM") or 0 for child in _children(pid)]
+    return {
+        "peak_rss_bytes": own * 1024 if own is not None else None,
+        "children_peak_rss_bytes": sum(children) * 1024 if own is not None else None,
+        "children": len(children),
+    }
+
+
+async def wait_ready(url: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while True:
+            try:
+                if (await client.get(url)).status_code < 500:
+                    return
+            except httpx.TransportError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{url} did not become ready within {timeout}s")
+            await asyncio.sleep(0.1)
+
+
+def engine_argv(args: argparse.Namespace, port: int) -> list[str]:
+    argv = [sys.executable, "-m", "benchmarks.mock_engine", "--port", str(port)]
+    for name in ("ttft", "tokens_per_second", "completion_tokens", "chunk_tokens", "jitter",
+                 "max_running", "failure_rate", "abort_rate", "image_tokens", "seed",
+                 "step_overhead", "prefix_prefill"):
+        argv += ["--" + name.replace("_", "-"), str(getattr(args, name))]
+    if args.no_prefix_cache:
+        argv.append("--no-prefix-cache")
+    return argv
+
+
+# ---- load ---------------------------------------------------------------------------
+
+class Recorder:
+    def __init__(self):
+        self.ttfb: list[float] = []
+        self.ttft: list[float] = []
+        self.latency: list[float] = []
+        self.page_latency: list[float] = []
+        self.pages = 0
+        self.ok = 0
+        self.errors: dict[str, int] = {}
+
+    def error(self, kind: str) -> None:
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def report(self, elapsed: float) -> dict:
+        return {
+            "requests_ok": self.ok,
+            "errors": dict(sorted(self.errors.items())),
+            "throughput_rps": self.ok / elapsed if elapsed else None,
+            "pages_per_second": self.pages / elapsed if elapsed and self.pages else None,
+            "ttfb_s": summarize(self.ttfb),
+            "ttft_s": summarize(self.ttft),
+            "latency_s": summarize(self.latency),
+            "page_latency_s": summarize(self.page_latency),
+        }
+
+
+async def one_request(client: httpx.AsyncClient, kind: str, payload: bytes, rec: Recorder) -> None:
+    path, filename, media_type = {
+        "image": ("/api/ocr/image", "bench.png", "image/png"),
+        "pdf": ("/api/ocr/pdf", "bench.pdf", "application/pdf"),
+    }[kind]
+    started = time.perf_counter()
+    first_delta = None
+    page_started: dict[int, float] = {}
+    failed = None
+    try:
+        async with client.stream("POST", path, files={"file": (filename, payload, media_type)}) as response:
+            if response.status_code != 200:
+                await response.aread()
+                rec.error(f"http_{response.status_code}")
+                return
+            first_byte = None
+            async for line in response.aiter_lines():
+                now = time.perf_counter()
+                if first_byte is None:
+                    first_byte = now
+                    rec.ttfb.append(now - started)
+                if not line:
+                    continue
+                evt = json.loads(line)
+                etype = evt.get("type")
+                if etype in ("delta", "page_delta") and first_delta is None:
+                    first_delta = now
+                    rec.ttft.append(now - started)
+                elif etype == "page_start":
+                    page_started[evt["page"]] = now
+                elif etype == "page_end":
+                    if evt.get("error"):
+                        failed = failed or "page_error"
+                    else:
+                        rec.pages += 1
+                        rec.page_latency.append(now - page_started.get(evt["page"], started))
+                elif etype == "error":
+                    failed = "stream_error"
+    except httpx.HTTPError as exc:
+        rec.error(type(exc).__name__)
+        return
+    if failed:
+        rec.error(failed)
+        return
+    rec.ok += 1
+    rec.latency.append(time.perf_counter() - started)
+
+
+async def drive(args: argparse.Namespace, base_url: str) -> dict:
+    kinds = ["image", "pdf"] if args.workload == "mixed" else [args.workload]
+    # Unique inputs (unless --repeat-inputs) so the OCR result cache does not short-circuit the engine
+    distinct = 1 if args.repeat_inputs else args.requests
+    payloads = {
+        "image": [synthetic_png(n) for n in range(distinct)] if "image" in kinds else [],
+        "pdf": [synthetic_pdf(n, args.pages) for n in range(distinct)] if "pdf" in kinds else [],
+    }
+    recorders = {kind: Recorder() for kind in kinds}
+    timeout = httpx.Timeout(args.request_timeout, connect=10.0)
+    limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        lag_before = histogram_snapshot((await client.get("/metrics")).text, "event_loop_lag_seconds")
+        next_index = 0
+
+        async def worker():
+            nonlocal next_index
+            while next_index < args.requests:
+                n = next_index
+                next_index += 1
+                kind = kinds[n % len(kinds)]
+                await one_request(client, kind, payloads[kind][n % distinct], recorders[kind])
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+        lag_after = histogram_snapshot((await client.get("/metrics")).text, "event_loop_lag_seconds")
+
+    results = {kind: rec.report(elapsed) for kind, rec in recorders.items()}
+    results["elapsed_s"] = elapsed
+    results["event_loop_lag_s"] = histogram_delta(lag_before, lag_after)
+    return results
+
+
+async def engine_stats(ports: list[int]) -> dict:
+    """Prefill steps the mock engines took, summed over replicas."""
+    totals = {"prefill_steps": 0, "requests_prefilled": 0, "prefix_prefills": 0}
+    async with httpx.AsyncClient(timeout=10.0) as client:
+        for port in ports:
+            stats = (await client.get(f"http://127.0.0.1:{port}/stats")).json()
+            for key in totals:
+                totals[key] += stats[key]
+    totals["requests_per_step"] = totals["requests_prefilled"] / totals["prefill_steps"] if totals["prefill_steps"] else None
+    return totals
+
+
+async def run(args: argparse.Namespace) -> dict:
+    procs: list[subprocess.Popen] = []
+    server_pid = args.server_pid
+    base_url = args.target
+    try:
+        if not base_url:
+            engine_ports, api_port = [free_port() for _ in range(args.engines)], free_port()
+            for port in engine_ports:
+                procs.append(subprocess.Popen(engine_argv(args, port)))
+            for port in engine_ports:
+                await wait_ready(f"http://127.0.0.1:{port}/health")
+            db_dir = tempfile.mkdtemp(prefix="bench-load-")
+            env = {
+                **os.environ,
+                "LLM_BASE_URLS": ",".join(f"http://127.0.0.1:{port}/v1" for port in engine_ports),
+                "DATABASE_URL": f"sqlite+aiosqlite:///{db_dir}/bench.db",
+                "AUTH_ENABLED": "false",
+            }
+            api = subprocess.Popen(
+                [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1",
+                 "--port", str(api_port), "--log-level", "warning", "--no-access-log"],
+                env=env,
+            )
+            procs.append(api)
+            server_pid = api.pid
+            base_url = f"http://127.0.0.1:{api_port}"
+        await wait_ready(f"{base_url}/metrics")
+        results = await drive(args, base_url)
+        if not args.target:
+            results["engine"] = await engine_stats(engine_ports)
+        if server_pid:
+            results["server"] = peak_rss(server_pid)
+        return results
+    finally:
+        for proc in reversed(procs):
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _flatten(prefix: str, value, out: dict) -> None:
+    if isinstance(value, dict):
+        for key, sub in value.items():
+            _flatten(f"{prefix}.{key}" if prefix else key, sub, out)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        out[prefix] = value
+
+
+def compare(baseline: dict, current: dict) -> None:
+    old, new = {}, {}
+    _flatten("", baseline.get("results", {}), old)
+    _flatten("", current["results"], new)
+    print(f"\nvs {baseline.get('meta', {}).get('git_revision') or 'baseline'}:")
+    for key in sorted(new.keys() & old.keys()):
+        if old[key]:
+            print(f"  {key:<40}{old[key]:>12.4g} -> {new[key]:<12.4g}{(new[key] - old[key]) / old[key] * 100:>+8.1f}%")
+
+
+def _fmt(value: Optional[float], scale: float = 1000.0) -> str:
+    return f"{value * scale:.0f}" if value is not None else "-"
+
+
+def print_report(results: dict) -> None:
+    for kind in ("image", "pdf"):
+        r = results.get(kind)
+        if not r:
+            continue
+        throughput = f"{r['throughput_rps']:.2f} req/s" if r["throughput_rps"] else "-"
+        print(f"[{kind}] ok={r['requests_ok']} errors={r['errors'] or 0} throughput={throughput}")
+        for label, key in (("ttfb", "ttfb_s"), ("first delta", "ttft_s"), ("request", "latency_s"), ("page", "page_latency_s")):
+            s = r[key]
+            if s["count"]:
+                print(f"  {label:<12} ms  p50={_fmt(s['p50'])} p90={_fmt(s['p90'])} p99={_fmt(s['p99'])} max={_fmt(s['max'])}")
+    lag = results["event_loop_lag_s"]
+    print(f"event loop lag: samples={lag['samples']} mean={_fmt(lag['mean'], 1000)}ms p99<={_fmt(lag['p99_le'])}ms")
+    engine = results.get("engine")
+    if engine and engine["prefill_steps"]:
+        print(f"engine prefill: steps={engine['prefill_steps']} requests/step={engine['requests_per_step']:.2f} "
+              f"prefix prefills={engine['prefix_prefills']}")
+    server = results.get("server")
+    if server and server["peak_rss_bytes"] is not None:
+        print(f"server peak RSS: {server['peak_rss_bytes'] / 2**20:.0f} MiB "
+              f"(+{server['children_peak_rss_bytes'] / 2**20:.0f} MiB in {server['children']} workers)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workload", choices=("image", "pdf", "mixed"), default="mixed")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--pages", type=int, default=4, help="pages per synthetic PDF")
+    parser.add_argument("--repeat-inputs", action="store_true", help="send the same file every time (exercises the result cache)")
+    parser.add_argument("--request-timeout", type=float, default=300.0)
+    parser.add_argument("--engines", type=int, default=1, help="mock engine replicas behind the API's engine pool")
+    parser.add_argument("--target", help="base URL of an already running API (skips starting the mock engine and API)")
+    parser.add_argument("--server-pid", type=int, help="PID of the --target API process, for peak RSS")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--compare", help="earlier --json results to diff against")
+    add_engine_arguments(parser)
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print_report(results)
+    document = {
+        "meta": {
+            "git_revision": git_revision(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), document)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(document, f, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""Local stand-in for vLLM's OpenAI-compatible ``/v1/chat/completions`` streaming endpoint.
+
+Usage:
+    python -m benchmarks.mock_engine [--port 8100] [--ttft 0.2] [--tokens-per-second 60]
+                                     [--completion-tokens 200] [--max-running 32]
+                                     [--failure-rate 0.0] [--abort-rate 0.0]
+                                     [--step-overhead 0.0] [--prefix-prefill 0.0] [--no-prefix-cache]
+
+Point the API at it with ``LLM_BASE_URL=http://127.0.0.1:8100/v1``. Each request
+waits for one of ``--max-running`` sequence slots (like the engine's batch
+size), then ``--ttft`` seconds (prefill), then streams ``--completion-tokens``
+tokens at ``--tokens-per-second``. ``--failure-rate`` answers 500 before
+streaming; ``--abort-rate`` cuts the stream off half way through.
+
+With ``--step-overhead`` or ``--prefix-prefill`` set, prefill is scheduled in
+steps like a continuous-batching engine: each step takes every request queued
+so far and lasts ``--step-overhead`` + ``--ttft`` + ``--prefix-prefill`` per
+prompt prefix (the text parts of the messages) not yet in the prefix cache.
+Requests that arrive together share a step and their prompt; requests that
+trickle in pay a step each. ``--no-prefix-cache`` charges the prefix for every
+request. ``GET /stats`` reports the prefill steps taken.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from dataclasses import dataclass
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+WORDS = ("the", "quick", "brown", "fox", "jumps", "over", "lazy", "dog", "lorem", "ipsum", "|", "#", "\n")
+
+
+@dataclass
+class EngineConfig:
+    ttft: float = 0.2
+    tokens_per_second: float = 60.0
+    completion_tokens: int = 200
+    chunk_tokens: int = 1
+    jitter: float = 0.1
+    max_running: int = 32
+    failure_rate: float = 0.0
+    abort_rate: float = 0.0
+    image_tokens: int = 256
+    seed: int = 0
+    step_overhead: float = 0.0
+    prefix_prefill: float = 0.0
+    prefix_cache: bool = True
+
+    @property
+    def stepped(self) -> bool:
+        return self.step_overhead > 0 or self.prefix_prefill > 0
+
+
+def _prompt_tokens(body: dict, config: EngineConfig) -> int:
+    tokens = 0
+    for message in body.get("messages", []):
+        content = message.get("content")
+        parts = content if isinstance(content, list) else [{"type": "text", "text": content or ""}]
+        for part in parts:
+            if part.get("type") == "image_url":
+                tokens += config.image_tokens
+            else:
+                tokens += max(1, len(part.get("text") or "") // 4)
+    return tokens
+
+
+def _prefix_key(body: dict) -> str:
+    texts = []
+    for message in body.get("messages", []):
+        content = message.get("content")
+        parts = content if isinstance(content, list) else [{"type": "text", "text": content or ""}]
+        texts.extend(part.get("text") or "" for part in parts if part.get("type") != "image_url")
+    return "\n".join(texts)
+
+
+def _chunk(completion_id: str, model: str, delta: dict, finish_reason=None) -> str:
+    payload = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(payload)}\n\n"
+
+
+def create_app(config: EngineConfig) -> FastAPI:
+    app = FastAPI(title="mock OCR engine")
+    slots = asyncio.Semaphore(config.max_running)
+    rng = random.Random(config.seed)
+
+    def jittered(seconds: float) -> float:
+        return max(0.0, seconds * (1 + rng.uniform(-config.jitter, config.jitter)))
+
+    prefill_queue: asyncio.Queue = asyncio.Queue()
+    cached_prefixes: set[str] = set()
+    stats = {"prefill_steps": 0, "requests_prefilled": 0, "prefix_prefills": 0}
+    scheduler: list[asyncio.Task] = []
+
+    async def prefill_scheduler():
+        while True:
+            step = [await prefill_queue.get()]
+            while not prefill_queue.empty():
+                step.append(prefill_queue.get_nowait())
+            if config.prefix_cache:
+                uncached = {key for key, _ in step} - cached_prefixes
+                cached_prefixes.update(uncached)
+                prefills = len(uncached)
+            else:
+                prefills = len(step)
+            await asyncio.sleep(config.step_overhead + jittered(config.ttft) + prefills * config.prefix_prefill)
+            stats["prefill_steps"] += 1
+            stats["requests_prefilled"] += len(step)
+            stats["prefix_prefills"] += prefills
+            for _, done in step:
+                if not done.done():
+                    done.set_result(None)
+
+    async def prefill(body: dict) -> None:
+        if not config.stepped:
+            await asyncio.sleep(jittered(config.ttft))
+            return
+        if not scheduler:
+            scheduler.append(asyncio.create_task(prefill_scheduler()))
+        done = asyncio.get_running_loop().create_future()
+        prefill_queue.put_nowait((_prefix_key(body), done))
+        await done
+
+    @app.get("/stats")
+    async def engine_stats():
+        return stats
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok"}
+
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": "mock", "object": "model"}]}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        model = body.get("model", "mock")
+        if rng.random() < config.failure_rate:
+            return JSONResponse({"error": {"message": "injected failure", "type": "server_error"}}, status_code=500)
+        prompt_tokens = _prompt_tokens(body, config)
+        include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+        abort_at = config.completion_tokens // 2 if rng.random() < config.abort_rate else None
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+        async def stream():
+            async with slots:
+                await prefill(body)
+                yield _chunk(completion_id, model, {"role": "assistant", "content": ""})
+                interval = config.chunk_tokens / config.tokens_per_second
+                sent = 0
+                while sent < config.completion_tokens:
+                    if abort_at is not None and sent >= abort_at:
+                        raise RuntimeError("injected mid-stream abort")
+                    n = min(config.chunk_tokens, config.completion_tokens - sent)
+                    text = "".join(" " + rng.choice(WORDS) for _ in range(n))
+                    yield _chunk(completion_id, model, {"content": text})
+                    sent += n
+                    await asyncio.sleep(jittered(interval))
+                yield _chunk(completion_id, model, {}, finish_reason="stop")
+                if include_usage:
+                    usage = {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": sent,
+                        "total_tokens": prompt_tokens + sent,
+                    }
+                    payload = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                               "model": model, "choices": [], "usage": usage}
+                    yield f"data: {json.dumps(payload)}\n\n"
+                yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return app
+
+
+def add_engine_arguments(parser: argparse.ArgumentParser) -> None:
+    defaults = EngineConfig()
+    parser.add_argument("--ttft", type=float, default=defaults.ttft, help="seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=defaults.tokens_per_second, help="decode rate per sequence")
+    parser.add_argument("--completion-tokens", type=int, default=defaults.completion_tokens)
+    parser.add_argument("--chunk-tokens", type=int, default=defaults.chunk_tokens, help="tokens per streamed chunk")
+    parser.add_argument("--jitter", type=float, default=defaults.jitter, help="relative +/- jitter on all delays")
+    parser.add_argument("--max-running", type=int, default=defaults.max_running, help="concurrent sequences (others queue)")
+    parser.add_argument("--failure-rate", type=float, default=defaults.failure_rate, help="fraction answered with HTTP 500")
+    parser.add_argument("--abort-rate", type=float, default=defaults.abort_rate, help="fraction cut off mid-stream")
+    parser.add_argument("--image-tokens", type=int, default=defaults.image_tokens, help="prompt tokens reported per image")
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    parser.add_argument("--step-overhead", type=float, default=defaults.step_overhead,
+                        help="fixed seconds per prefill step (enables step scheduling)")
+    parser.add_argument("--prefix-prefill", type=float, default=defaults.prefix_prefill,
+                        help="seconds to prefill a prompt prefix missing from the prefix cache")
+    parser.add_argument("--no-prefix-cache", action="store_true", help="prefill the prompt prefix for every request")
+
+
+def engine_config_from_args(args: argparse.Namespace) -> EngineConfig:
+    return EngineConfig(
+        ttft=args.ttft,
+        tokens_per_second=args.tokens_per_second,
+        completion_tokens=args.completion_tokens,
+        chunk_tokens=max(1, args.chunk_tokens),
+        jitter=args.jitter,
+        max_running=max(1, args.max_running),
+        failure_rate=args.failure_rate,
+        abort_rate=args.abort_rate,
+        image_tokens=args.image_tokens,
+        seed=args.seed,
+        step_overhead=args.step_overhead,
+        prefix_prefill=args.prefix_prefill,
+        prefix_cache=not args.no_prefix_cache,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    add_engine_arguments(parser)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    uvicorn.run(create_app(engine_config_from_args(args)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""Compare PDF render policies: bytes sent, render/encode time and (optionally) engine latency.
+
+Usage:
+    python -m benchmarks.render_policies [--pdf doc.pdf] [--policy scale:8 --policy pixels:2457600 ...]
+                                         [--engine-url http://localhost:8000/v1] [--json out.json]
+
+Without ``--pdf`` a synthetic text document is generated. Without ``--engine-url``
+only the local render + encode cost is measured. Page encoding follows the
+PAGE_IMAGE_FORMAT / PAGE_* settings, so set them in the environment to compare formats.
+"""
+import argparse
+import asyncio
+import base64
+import io
+import json
+import statistics
+import time
+
+import os
+import tempfile
+
+from PIL import Image, ImageDraw
+
+from app.core.config import settings
+from app.imaging import PageEncoding, pdf_page_count, render_pdf_page
+from app.render_policy import parse_render_policy
+
+
+DEFAULT_POLICIES = ["scale:8", "dpi:300", "dpi:150", settings.PDF_RENDER_POLICY]
+
+
+def synthetic_pdf(pages: int = 4) -> bytes:
+    images = []
+    for n in range(pages):
+        img = Image.new("RGB", (612, 792), "white")
+        draw = ImageDraw.Draw(img)
+        for line in range(40):
+            draw.text((40, 30 + line * 18), f"Page {n + 1} line {line + 1}: the quick brown fox jumps over the lazy dog", fill="black")
+        images.append(img)
+    buf = io.BytesIO()
+    images[0].save(buf, "PDF", resolution=72.0, save_all=True, append_images=images[1:])
+    return buf.getvalue()
+
+
+def render_pages(pdf_path: str, spec: str) -> list[dict]:
+    policy = parse_render_policy(spec)
+    encoding = PageEncoding.from_settings()
+    pages = []
+    for index in range(pdf_page_count(pdf_path) or 0):
+        page = render_pdf_page(pdf_path, index, policy, encoding)
+        pages.append({
+            "scale": page.scale,
+            "pixels": page.width * page.height,
+            "render_s": page.render_seconds,
+            "encode_s": page.encode_seconds,
+            "data": page.data,
+        })
+    return pages
+
+
+async def engine_latency(engine_url: str, data: bytes) -> float:
+    media_type = PageEncoding.from_settings().media_type
+    from openai import AsyncOpenAI
+
+    client = AsyncOpenAI(base_url=engine_url, api_key=settings.LLM_API_KEY)
+    b64 = base64.b64encode(data).decode("utf-8")
+    started = time.perf_counter()
+    stream = await client.chat.completions.create(
+        model=settings.LLM_MODEL,
+        messages=[{
+            "role": "user",
+            "content": [
+                {"type": "text", "text": settings.LLM_PROMPT},
+                {"type": "image_url", "image_url": {"url": f"data:{media_type};base64,{b64}"}},
+            ],
+        }],
+        stream=True,
+        temperature=0.0,
+        extra_body={"vllm_xargs": {"ngram_size": 30, "window_size": 90}, "skip_special_tokens": False},
+    )
+    async for _ in stream:
+        pass
+    await client.close()
+    return time.perf_counter() - started
+
+
+async def run(args) -> list[dict]:
+    pdf_path = args.pdf
+    if not pdf_path:
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+            f.write(synthetic_pdf(args.pages))
+            pdf_path = f.name
+    try:
+        return await _run_policies(args, pdf_path)
+    finally:
+        if not args.pdf:
+            os.unlink(pdf_path)
+
+
+async def _run_policies(args, pdf_path: str) -> list[dict]:
+    results = []
+    for spec in args.policy or DEFAULT_POLICIES:
+        pages = render_pages(pdf_path, spec)
+        row = {
+            "policy": spec,
+            "pages": len(pages),
+            "avg_scale": statistics.fmean(p["scale"] for p in pages),
+            "avg_pixels": statistics.fmean(p["pixels"] for p in pages),
+            "render_s_total": sum(p["render_s"] for p in pages),
+            "encode_s_total": sum(p["encode_s"] for p in pages),
+            "encoded_bytes_total": sum(len(p["data"]) for p in pages),
+            # What actually goes over the wire: base64 inflates the PNG by 4/3.
+            "bytes_sent_total": sum(4 * ((len(p["data"]) + 2) // 3) for p in pages),
+        }
+        if args.engine_url:
+            latencies = [await engine_latency(args.engine_url, p["data"]) for p in pages]
+            row["e2e_s_p50"] = statistics.median(latencies)
+            row["e2e_s_total"] = sum(latencies) + row["render_s_total"] + row["encode_s_total"]
+        results.append(row)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdf", help="PDF to render (default: synthetic document)")
+    parser.add_argument("--pages", type=int, default=4, help="pages in the synthetic document")
+    parser.add_argument("--policy", action="append", help="render policy to compare (repeatable)")
+    parser.add_argument("--engine-url", help="OpenAI-compatible engine base URL for end-to-end latency")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    header = f"{'policy':<18}{'pages':>6}{'scale':>8}{'Mpx/page':>10}{'render s':>10}{'encode s':>10}{'MB sent':>10}{'e2e s':>9}"
+    print(header)
+    for r in results:
+        e2e = f"{r['e2e_s_total']:>9.2f}" if "e2e_s_total" in r else f"{'-':>9}"
+        print(
+            f"{r['policy']:<18}{r['pages']:>6}{r['avg_scale']:>8.2f}{r['avg_pixels'] / 1e6:>10.2f}"
+            f"{r['render_s_total']:>10.3f}{r['encode_s_total']:>10.3f}{r['bytes_sent_total'] / 1e6:>10.2f}{e2e}"
+        )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import { API_BASE } from "@/lib/utils";
+import { shrinkImage } from "@/lib/imagePrep";
 
 export type TokenInfo = {
   access_token: string;
@@ -86,7 +87,7 @@ export async function usageList(token?: string): Promise<UsageEvent[]> {
 
 export type OCRKind = "image" | "pdf";
 
-export function uploadAndStream(
+export async function uploadAndStream(
   token: string | undefined,
   file: File,
   kind: OCRKind,
@@ -96,7 +97,7 @@ export function uploadAndStream(
 ) {
   const endpoint = kind === "pdf" ? "pdf" : "image";
   const form = new FormData();
-  form.append("file", file);
+  form.append("file", kind === "image" ? await shrinkImage(file) : file);
   if (prompt && prompt.trim()) {
     form.append("prompt", prompt);
   }
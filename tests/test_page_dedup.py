@@ -0,0 +1,56 @@
+import asyncio
+
+from PIL import Image
+
+from app.imaging import page_signature
+from app.page_dedup import PageResult, PageTriage
+
+
+def _triage() -> PageTriage:
+    return PageTriage(blank_ink_ratio=0, dedup="exact", max_distance=10, max_tile_diff=12, max_entries=16)
+
+
+def test_pages_without_ink_are_never_duplicates():
+    async def run():
+        triage = _triage()
+        first = page_signature(Image.new("L", (200, 200), 255))
+        claim = triage.claim(("scope",), first, 1, 1)
+        assert claim is None
+        triage.finish(claim, PageResult("text of another page", 1, 1, 1.0))
+        second = page_signature(Image.new("L", (200, 200), 40))
+        assert await triage.duplicate_of(("scope",), second, 1, 2) is None
+
+    asyncio.run(run())
+
+
+def _inked(shade: int = 0):
+    image = Image.new("L", (200, 200), 255)
+    image.paste(shade, (50, 50, 150, 150))
+    return page_signature(image)
+
+
+def test_running_later_page_is_not_waited_for():
+    async def run():
+        triage = _triage()
+        triage.claim(("scope",), _inked(), 7, 5)
+        # Page 3 of the same stream must not wait for page 5, which may be held back behind it
+        assert await asyncio.wait_for(triage.duplicate_of(("scope",), _inked(), 7, 3), 1) is None
+        # Nor for a page of another stream
+        assert await asyncio.wait_for(triage.duplicate_of(("scope",), _inked(), 8, 9), 1) is None
+
+    asyncio.run(run())
+
+
+def test_running_earlier_page_is_waited_for():
+    async def run():
+        triage = _triage()
+        claim = triage.claim(("scope",), _inked(), 7, 2)
+        waiting = asyncio.create_task(triage.duplicate_of(("scope",), _inked(), 7, 4))
+        await asyncio.sleep(0)
+        assert not waiting.done()
+        triage.finish(claim, PageResult("page two", 2, 7, 1.0))
+        assert (await waiting).text == "page two"
+        # Once done, its result serves other streams as well
+        assert (await triage.duplicate_of(("scope",), _inked(), 8, 1)).text == "page two"
+
+    asyncio.run(run())
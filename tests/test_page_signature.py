@@ -0,0 +1,37 @@
+from PIL import Image, ImageDraw
+
+from app.core.config import settings
+from app.imaging import page_signature
+
+
+LINE = "The quick brown fox jumps over the lazy dog"
+
+
+def _page(background: int, text: int) -> Image.Image:
+    image = Image.new("L", (612, 792), background)
+    draw = ImageDraw.Draw(image)
+    for y in range(50, 700, 30):
+        draw.text((50, y), LINE, fill=text)
+    return image
+
+
+def test_dark_text_on_paper_is_ink():
+    assert page_signature(_page(255, 0)).ink_ratio > settings.PDF_BLANK_INK_RATIO
+
+
+def test_light_text_on_dark_background_is_ink():
+    assert page_signature(_page(0, 255)).ink_ratio > settings.PDF_BLANK_INK_RATIO
+
+
+def test_low_contrast_text_is_ink():
+    assert page_signature(_page(255, 205)).ink_ratio > settings.PDF_BLANK_INK_RATIO
+
+
+def test_empty_page_has_no_ink():
+    assert page_signature(_page(255, 255)).ink_ratio == 0
+
+
+def test_inverted_pages_have_different_bitmaps_from_empty_ones():
+    empty = page_signature(_page(0, 0)).digest
+    assert page_signature(_page(0, 255)).digest != empty
+    assert page_signature(_page(30, 230)).digest != empty